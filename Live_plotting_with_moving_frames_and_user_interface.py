@@ -7,8 +7,9 @@ import time
 import threading
 import pandas as pd
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
 import numpy as np
+from live_plot_engine import LivePlotEngine
+from plot_decimation import MinMaxDecimator, envelope_bins
 
 def create_channel_selection_dialog():
     root = tk.Tk()
@@ -63,7 +64,7 @@ if __name__ == "__main__":
 
 
 
-def acquire_and_save_data(channels, sample_rate, duration, duration_unit, num_samples, csv_file_path):
+def acquire_and_save_data(channels, sample_rate, duration, duration_unit, num_samples, csv_file_path, plot_decimator):
     # Convert the duration to seconds based on the user-specified unit
     duration_in_seconds = duration
     if duration_unit == 'minutes':
@@ -94,50 +95,34 @@ def acquire_and_save_data(channels, sample_rate, duration, duration_unit, num_sa
 
             # Append data to the CSV file
             pd.DataFrame(data_dict, columns=column_headings).to_csv(csv_file_path, mode='a', index=False, header=False)
+            plot_decimator.update(np.asarray(data).reshape(len(channels), -1))
 
             # Wait for a short period before acquiring data again (adjust as needed)
             # time.sleep(1)
 
-def live_plot_from_csv(csv_file_path):
+def live_plot_from_csv(channels, plot_decimator):
     plt.style.use('fivethirtyeight')  # Set the style for the current function
 
-    # Number of data points to display on the x-axis
-    x_range = 10000
-    
-    def animate(i):
-        data = pd.read_csv(csv_file_path)
+    # The lines are created once and only their data is updated on every frame, from the min/max envelope of the newest
+    # samples kept in memory (the CSV file is never read again); the y-limits follow the data
+    x = np.repeat(np.arange(1 - plot_decimator.num_bins, 1) * plot_decimator.bin_size, 2)
+    engine = LivePlotEngine(channels, x, lambda: plot_decimator.envelope()[1], ylim=None, envelope=True)
+    engine.run()
 
-        # Limit the number of data points displayed on the x-axis
-        num_data_points = len(data)
-        start_idx = max(num_data_points - x_range, 0)
-        end_idx = num_data_points
-        x = np.arange(start_idx, end_idx)
 
-        plt.cla()
-        for channel in data.columns:
-            y = data[channel][start_idx:end_idx]
-            plt.plot(x, y, label=channel, linewidth=1)
-            # plt.ylim(-20, 20)
-
-
-        plt.legend(loc='upper left')
-        plt.tight_layout()
-
-    ani = FuncAnimation(plt.gcf(), animate, interval=100)
-
-    plt.tight_layout()
-    plt.show()
+# Number of data points to display on the x-axis, drawn as up to 800 min/max pairs (fewer with many channels, see envelope_bins)
+plot_decimator = MinMaxDecimator(len(selected_channels), 10000, envelope_bins(len(selected_channels)))
 
 
 # Create threads with function references as targets
 acquire_thread = threading.Thread(
     target=acquire_and_save_data,
-    args=(selected_channels, 1000, 5, "seconds", 1000, "acquired_data.csv")
+    args=(selected_channels, 1000, 5, "seconds", 1000, "acquired_data.csv", plot_decimator)
 )
 
 plot_thread = threading.Thread(
     target=live_plot_from_csv,
-    args=("acquired_data.csv",)
+    args=(selected_channels, plot_decimator)
 )
 
 # Start the threads
@@ -0,0 +1,336 @@
+# This script runs an acquisition without the Tk dialog and without the live plot, e.g. on an unattended rack machine
+# without a display. The settings come from a profile file (TOML, YAML or JSON) and/or from command line flags; the flags
+# override the values of the profile.
+#
+#   python acquire_cli.py --channels Dev1/ai0:3 --rate 10000 --duration 30 --num-samples 1000 --output run.bin
+#   python acquire_cli.py --config profile.toml --duration 2 --duration-unit hours
+#   python acquire_cli.py --channels Dev1/ai0:3 --rate 10000 --duration 5 --num-samples 1000 --repeat 20 --output shot.bin
+#   python acquire_cli.py --channels Dev1/ai0:3 --rate 100000 --duration 60 --num-samples auto --filter notch:50 --decimate 10 --output run.bin
+#   python acquire_cli.py --channels Dev1/ai0:3 --rate 100000 --duration 1 --num-samples 1000 --mode finite --reference-trigger Dev1/ai0@0.5 --pre-samples 10000 --output shot.bin
+#
+# Example profile.toml:
+#
+#   channels = ["Dev1/ai0:7", "Dev2/ai0:7"]
+#   rate = 10000
+#   duration = 1.5
+#   duration_unit = "hours"
+#   num_samples = 1000
+#   output = "run.h5"
+#
+# Only the modules needed for the acquisition are imported; matplotlib is only imported with --plot.
+
+
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+
+
+# Settings which can be given in a profile, with their default values
+DEFAULTS = {
+    "channels": [],
+    "devices": None,
+    "rate": None,
+    "duration": None,
+    "duration_unit": "seconds",
+    "num_samples": None,
+    "target_latency": 0.1,
+    "output": None,
+    "binary_dtype": "float64",
+    "mode": "polling",
+    "writer_policy": "spill",
+    "max_spill_blocks": 256,
+    "spill_fallback": "drop-oldest",
+    "segment_seconds": 600.0,
+    "fsync": "segment",
+    "segment_bytes": None,
+    "checkpoint_seconds": 1.0,
+    "resume": False,
+    "statistics": True,
+    "overview": True,
+    "time_index": True,
+    "simulate": False,
+    "plot": False,
+    "publish": None,
+    "shared_ring": None,
+    "plot_process": False,
+    "trigger": None,
+    "reference_trigger": None,
+    "pre_samples": 1000,
+    "post_samples": 1000,
+    "filters": [],
+    "decimation": 1,
+    "metrics": None,
+    "metrics_log": None,
+    "metrics_interval": 10.0,
+    "repeat": 1,
+}
+
+
+def expand_channels(channel_specs):
+    """
+        This function expands the channel ranges of NI-DAQmx ('Dev1/ai0:3' means ai0, ai1, ai2 and ai3) and the comma
+        separated lists given on the command line into a list of single physical channel names.
+    """
+    if isinstance(channel_specs, str):
+        channel_specs = [channel_specs]
+
+    channels = []
+    for spec in channel_specs:
+        for part in str(spec).split(","):
+            part = part.strip()
+            if not part:
+                continue
+            match = re.fullmatch(r"(.*?)(\d+):(\d+)", part)
+            if match:
+                prefix, first, last = match.group(1), int(match.group(2)), int(match.group(3))
+                step = 1 if last >= first else -1
+                channels.extend(f"{prefix}{number}" for number in range(first, last + step, step))
+            else:
+                channels.append(part)
+    return channels
+
+
+def parse_filter(spec):
+    """
+        This function turns a filter given as 'KIND:FREQUENCY' (e.g. 'notch:50', 'lowpass:2000' or 'bandpass:10-300')
+        into the tuple (kind, frequency) used by dsp_stage.DSPStage.
+    """
+    kind, _, frequency = str(spec).partition(":")
+    if not frequency:
+        raise SystemExit(f"Invalid filter '{spec}', expected KIND:FREQUENCY, e.g. 'notch:50' or 'bandpass:10-300'")
+    if "-" in frequency:
+        low, high = frequency.split("-", 1)
+        return kind, (float(low), float(high))
+    return kind, float(frequency)
+
+
+def load_profile(file_path):
+    """
+        This function reads a profile file. The format follows the extension: '.toml', '.yaml'/'.yml' or '.json'.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".toml":
+        import tomllib
+        with open(file_path, "rb") as f:
+            profile = tomllib.load(f)
+    elif extension in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise SystemExit("Reading YAML profiles needs the PyYAML package (pip install pyyaml)")
+        with open(file_path) as f:
+            profile = yaml.safe_load(f) or {}
+    elif extension == ".json":
+        with open(file_path) as f:
+            profile = json.load(f)
+    else:
+        raise SystemExit(f"Unknown profile format '{extension}', use .toml, .yaml or .json")
+
+    unknown = set(profile) - set(DEFAULTS)
+    if unknown:
+        raise SystemExit(f"Unknown settings in {file_path}: {', '.join(sorted(unknown))}")
+    return profile
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Headless data acquisition with the PXIe-6284.")
+    parser.add_argument("--config", help="profile file with the settings (.toml, .yaml or .json)")
+    parser.add_argument("--channels", help="physical channels, e.g. 'Dev1/ai0:3,Dev2/ai0'")
+    parser.add_argument("--rate", type=float, help="sample rate in samples per second")
+    parser.add_argument("--duration", type=float, help="duration of the acquisition")
+    parser.add_argument("--duration-unit", dest="duration_unit", choices=("seconds", "minutes", "hours"))
+    parser.add_argument("--num-samples", dest="num_samples", type=lambda value: value if value == "auto" else int(value),
+                        help="samples per channel read in each batch, or 'auto' to size the batches from the rate")
+    parser.add_argument("--target-latency", dest="target_latency", type=float, help="time between two reads in seconds with --num-samples auto")
+    parser.add_argument("--output", help="file to save the data to; the extension selects the format (.csv, .bin, .h5, .zarr, .seg)")
+    parser.add_argument("--binary-dtype", dest="binary_dtype", choices=("float64", "int16"), help="sample format of .bin files")
+    parser.add_argument("--mode", choices=("polling", "callback", "finite"), help="acquisition mode (default: polling)")
+    parser.add_argument("--writer-policy", dest="writer_policy", choices=("block", "drop-oldest", "spill"),
+                        help="what happens when the disk cannot keep up (default: spill)")
+    parser.add_argument("--max-spill-blocks", dest="max_spill_blocks", type=lambda value: value if value == "unlimited" else int(value),
+                        help="extra batches kept in memory with --writer-policy spill before --spill-fallback applies, or 'unlimited' (default: 256)")
+    parser.add_argument("--spill-fallback", dest="spill_fallback", choices=("drop-oldest", "block"),
+                        help="policy once --max-spill-blocks batches are in memory (default: drop-oldest)")
+    parser.add_argument("--segment-seconds", dest="segment_seconds", type=float, help="length of the segments of a .seg recording")
+    parser.add_argument("--fsync", choices=("none", "segment", "checkpoint", "block"), help="when a .seg recording is forced to the disk")
+    parser.add_argument("--segment-bytes", dest="segment_bytes", type=int, help="largest size of the segments of a .seg recording in bytes")
+    parser.add_argument("--checkpoint-seconds", dest="checkpoint_seconds", type=float,
+                        help="time between two checkpoints of a .seg recording, i.e. the tail a crash can lose (default: 1)")
+    parser.add_argument("--resume", action="store_const", const=True, help="continue an interrupted .seg recording instead of replacing it")
+    parser.add_argument("--no-statistics", dest="statistics", action="store_const", const=False, help="do not save the summary statistics")
+    parser.add_argument("--no-overview", dest="overview", action="store_const", const=False, help="do not save the overview pyramid")
+    parser.add_argument("--no-time-index", dest="time_index", action="store_const", const=False, help="do not save the time index")
+    parser.add_argument("--simulate", action="store_const", const=True, help="use the simulated device instead of the hardware")
+    parser.add_argument("--plot", action="store_const", const=True, help="show the live plot (imports matplotlib)")
+    parser.add_argument("--publish", metavar="HOST:PORT", help="stream the batches to block_publisher.BlockSubscriber clients")
+    parser.add_argument("--shared-ring", dest="shared_ring", metavar="NAME",
+                        help="share the batches with other processes through a shared memory ring with this name")
+    parser.add_argument("--plot-process", dest="plot_process", action="store_const", const=True,
+                        help="show the live plot in a separate process which reads the shared memory ring")
+    parser.add_argument("--trigger", metavar="CHANNEL@LEVEL[@falling]",
+                        help="save only the windows around the crossings of a level, e.g. 'Dev1/ai0@0.5'")
+    parser.add_argument("--reference-trigger", dest="reference_trigger", metavar="SOURCE@LEVEL[@falling]",
+                        help="with --mode finite, let the hardware end the capture on an analog edge, keeping --pre-samples "
+                             "samples before it, e.g. 'APFI0@0.5' or 'Dev1/ai0@0.5'")
+    parser.add_argument("--pre-samples", dest="pre_samples", type=int, help="samples per channel saved before every trigger")
+    parser.add_argument("--post-samples", dest="post_samples", type=int, help="samples per channel saved from every trigger on")
+    parser.add_argument("--filter", dest="filters", metavar="KIND:FREQUENCY", action="append",
+                        help="filter the batches before they are recorded, e.g. 'notch:50', 'highpass:0.5', 'bandpass:10-300' (repeatable)")
+    parser.add_argument("--decimate", dest="decimation", type=int, help="record only every n-th sample, after an anti-aliasing filter")
+    parser.add_argument("--repeat", type=int,
+                        help="acquire this many times back to back into numbered files (shot_001.bin, ...), "
+                             "keeping the configured task committed between the runs")
+    parser.add_argument("--metrics", metavar="HOST:PORT", help="serve the pipeline metrics in the Prometheus format on http://HOST:PORT/metrics")
+    parser.add_argument("--metrics-log", dest="metrics_log", metavar="PATH", help="append the pipeline metrics to a JSON lines file")
+    parser.add_argument("--metrics-interval", dest="metrics_interval", type=float, help="seconds between two lines of --metrics-log (default: 10)")
+    return parser.parse_args(argv)
+
+
+def build_settings(args):
+    # Defaults, then the profile, then the command line flags
+    settings = dict(DEFAULTS)
+    if args.config:
+        settings.update(load_profile(args.config))
+    for name in DEFAULTS:
+        value = getattr(args, name, None)
+        if value is not None:
+            settings[name] = value
+
+    settings["channels"] = expand_channels(settings["channels"])
+    missing = [name for name in ("rate", "duration", "num_samples", "output") if settings[name] is None]
+    if not settings["channels"]:
+        missing.insert(0, "channels")
+    if missing:
+        raise SystemExit(f"Missing settings: {', '.join(missing)} (give them as flags or in the --config profile)")
+    if settings["rate"] <= 0 or (settings["num_samples"] != "auto" and settings["num_samples"] <= 0) or settings["duration"] < 0:
+        raise SystemExit("rate and num_samples must be positive and duration must not be negative")
+    if settings["repeat"] < 1:
+        raise SystemExit("repeat must be at least 1")
+    if settings["repeat"] > 1 and (settings["plot"] or settings["plot_process"]):
+        raise SystemExit("--repeat cannot be combined with --plot or --plot-process")
+    if settings["reference_trigger"] and settings["mode"] != "finite":
+        raise SystemExit("--reference-trigger needs --mode finite")
+    return settings
+
+
+def main(argv=None):
+    settings = build_settings(parse_arguments(argv))
+
+    from final_orgainzed_code2 import DataAcquisitionAndPlotting
+    from multi_device_acquisition import group_channels_by_device
+
+    backend = None
+    if settings["simulate"]:
+        from simulated_daq import SimulatedBackend
+        backend = SimulatedBackend()
+
+    device_names = settings["devices"] or list(group_channels_by_device(settings["channels"]))
+    acquisition = DataAcquisitionAndPlotting(backend=backend, device_names=device_names)
+    acquisition.selected_channels = settings["channels"]
+    acquisition.sample_rate = settings["rate"]
+    acquisition.duration = settings["duration"]
+    acquisition.duration_unit = settings["duration_unit"]
+    acquisition.num_samples = settings["num_samples"]
+    acquisition.target_latency = settings["target_latency"]
+    acquisition.csv_file_path = settings["output"]
+    acquisition.binary_dtype = settings["binary_dtype"]
+    acquisition.acquisition_mode = settings["mode"]
+    acquisition.writer_policy = settings["writer_policy"]
+    acquisition.writer_max_spill_blocks = None if settings["max_spill_blocks"] == "unlimited" else settings["max_spill_blocks"]
+    acquisition.writer_spill_fallback = settings["spill_fallback"]
+    acquisition.segment_seconds = settings["segment_seconds"]
+    acquisition.fsync_policy = settings["fsync"]
+    acquisition.segment_bytes = settings["segment_bytes"]
+    acquisition.checkpoint_seconds = settings["checkpoint_seconds"]
+    acquisition.resume_recording = settings["resume"]
+    acquisition.compute_statistics = settings["statistics"]
+    acquisition.build_overview = settings["overview"]
+    acquisition.build_time_index = settings["time_index"]
+    acquisition.filters = [parse_filter(spec) for spec in settings["filters"]]
+    acquisition.decimation = settings["decimation"]
+    if settings["publish"]:
+        host, _, port = settings["publish"].rpartition(":")
+        acquisition.publish_address = (host or "127.0.0.1", int(port))
+    if settings["shared_ring"] or settings["plot_process"]:
+        acquisition.shared_ring_slots = 64
+        acquisition.shared_ring_name = settings["shared_ring"] or f"pxi6284_{os.getpid()}"
+        print(f"Sharing the batches in the shared memory ring '{acquisition.shared_ring_name}'")
+
+    if settings["metrics"] or settings["metrics_log"]:
+        from pipeline_metrics import PipelineMetrics
+        http_address = None
+        if settings["metrics"]:
+            host, _, port = settings["metrics"].rpartition(":")
+            http_address = (host or "127.0.0.1", int(port))
+        acquisition.metrics = PipelineMetrics(http_address, settings["metrics_log"], settings["metrics_interval"])
+        if acquisition.metrics.address is not None:
+            print(f"Serving the pipeline metrics on http://{acquisition.metrics.address[0]}:{acquisition.metrics.address[1]}/metrics")
+
+    if settings["trigger"]:
+        from triggered_capture import LevelTrigger
+        parts = settings["trigger"].split("@")
+        acquisition.trigger = LevelTrigger(parts[0], float(parts[1]), parts[2] if len(parts) > 2 else "rising")
+        acquisition.trigger_pre_samples = settings["pre_samples"]
+        acquisition.trigger_post_samples = settings["post_samples"]
+    if settings["reference_trigger"]:
+        parts = settings["reference_trigger"].split("@")
+        acquisition.reference_trigger = (parts[0], float(parts[1]), parts[2] if len(parts) > 2 else "rising")
+        acquisition.trigger_pre_samples = settings["pre_samples"]
+
+    # Repeated runs write numbered files, and reuse the committed task of the previous run (see task_pool.TaskPool),
+    # so that a run only has to start the task instead of creating and configuring it again
+    outputs = [settings["output"]]
+    if settings["repeat"] > 1:
+        from task_pool import TaskPool
+        base, extension = os.path.splitext(settings["output"].rstrip("/\\"))
+        outputs = [f"{base}_{run + 1:03d}{extension}" for run in range(settings["repeat"])]
+        acquisition.task_pool = TaskPool(acquisition.backend)
+
+    def report(output):
+        samples = acquisition.plot_buffer.total_written if acquisition.plot_buffer is not None else 0
+        for line in acquisition.run_summary():
+            print(line)
+        print(f"Acquired {samples} samples per channel from {len(acquisition.selected_channels)} channels into {output}")
+
+    plot_process = None
+    if settings["plot_process"]:
+        # The plot process is started first and waits for the ring; the acquisition waits until it has attached to the
+        # ring before it starts, so the plot sees the first batch and the ring is not removed before it could attach
+        plot_process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "shared_memory_ring.py"),
+                                         acquisition.shared_ring_name, str(acquisition.plot_window)])
+        acquisition.shared_ring_readers = 1
+
+    try:
+        if settings["plot"]:
+            # Acquire in a thread and keep the plot in the main thread, which the GUI toolkits prefer
+            acquire_thread = threading.Thread(target=acquisition.acquire_and_save_data)
+            acquire_thread.start()
+            acquisition.live_plot_from_csv()
+            acquire_thread.join()
+            report(settings["output"])
+        else:
+            for output in outputs:
+                acquisition.csv_file_path = output
+                acquisition.acquire_and_save_data()
+                report(output)
+    except BaseException:
+        if plot_process is not None:
+            plot_process.terminate()
+        raise
+    if plot_process is not None:
+        plot_process.wait()
+    if acquisition.metrics is not None:
+        acquisition.metrics.close()
+    if acquisition.task_pool is not None:
+        print(f"{acquisition.task_pool.hits} of {len(outputs)} runs reused the committed task")
+        acquisition.task_pool.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+# This script measures how fast the acquire-save-plot pipeline of final_orgainzed_code2.py can go. It drives
+# DataAcquisitionAndPlotting.acquire_and_save_data with the simulated DAQ device, so it runs on any computer without a
+# PXI chassis, and sweeps the number of channels, the sample rate and the batch size (num_samples).
+#
+# For every combination it reports:
+#   - the sustained throughput in samples per second (summed over all channels)
+#   - the percentiles of the time spent writing one batch to the file
+#   - the percentiles of the time needed to draw and render one frame of the live plot
+#   - the peak memory (RSS) of the process that ran the combination
+#
+# The results are written as JSON, and a previous result file can be passed with --baseline to report regressions:
+#
+#   python benchmark_pipeline.py --output before.json
+#   python benchmark_pipeline.py --output after.json --baseline before.json
+
+
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def percentiles(values):
+    if len(values) == 0:
+        return None
+    p50, p90, p99, maximum = np.percentile(np.asarray(values) * 1000.0, [50, 90, 99, 100])
+    return {"p50_ms": p50, "p90_ms": p90, "p99_ms": p99, "max_ms": maximum}
+
+
+def run_case(case):
+    # Runs one combination of the sweep. It is called in a fresh process, so that the peak RSS belongs to this case only.
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    from final_orgainzed_code2 import DataAcquisitionAndPlotting
+    from simulated_daq import SimulatedBackend
+
+    result = dict(case)
+    with tempfile.TemporaryDirectory() as directory:
+        acquisition = DataAcquisitionAndPlotting(backend=SimulatedBackend(realtime=case["pacing"] == "realtime"))
+        acquisition.selected_channels = [f"Dev1/ai{i}" for i in range(case["channels"])]
+        acquisition.sample_rate = case["rate"]
+        acquisition.duration = case["duration"]
+        acquisition.num_samples = case["batch_size"]
+        acquisition.csv_file_path = os.path.join(directory, "benchmark." + case["format"])
+        acquisition.writer_policy = case["writer_policy"]
+        acquisition.batch_write_times = []
+
+        started = time.perf_counter()
+        try:
+            acquisition.acquire_and_save_data()
+        except Exception as error:
+            # An overflow of the simulated input buffer means this combination cannot be sustained
+            result["error"] = f"{type(error).__name__}: {error}"
+        elapsed = time.perf_counter() - started
+
+        samples_per_channel = acquisition.plot_buffer.total_written if acquisition.plot_buffer is not None else 0
+        result["elapsed_s"] = elapsed
+        result["samples_per_channel"] = samples_per_channel
+        result["sustained_samples_per_s"] = samples_per_channel * case["channels"] / elapsed
+        result["batches"] = len(acquisition.batch_write_times)
+        if acquisition.block_writer is not None:
+            result["max_queue_depth"] = acquisition.block_writer.max_queue_depth
+            result["dropped_blocks"] = acquisition.block_writer.dropped_blocks
+        result["write_latency"] = percentiles(acquisition.batch_write_times)
+        result["file_size_bytes"] = os.path.getsize(acquisition.csv_file_path) if os.path.exists(acquisition.csv_file_path) else 0
+
+        # Render the live plot from the filled ring buffer, the same way the animation does on every tick
+        frame_times = []
+        if samples_per_channel > 0:
+            engine = acquisition.create_plot_engine()
+            engine.render_frame()   # The first frame renders the whole figure and caches its background
+            for _ in range(case["frames"]):
+                frame_started = time.perf_counter()
+                engine.render_frame()
+                frame_times.append(time.perf_counter() - frame_started)
+            plt.close(engine.figure)
+        result["frame_time"] = percentiles(frame_times)
+
+    # ru_maxrss is in kilobytes on Linux
+    result["peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(case):
+    return (case["channels"], case["rate"], case["batch_size"], case["format"], case["pacing"], case.get("writer_policy"))
+
+
+def find_regressions(results, baseline, tolerance):
+    # A case regresses when its throughput drops, or its p99 write or frame time grows, by more than the tolerance
+    previous = {case_key(case): case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        old = previous.get(case_key(case))
+        if old is None:
+            continue
+        if "error" in case:
+            if "error" not in old:
+                regressions.append((case_key(case), "error", case["error"]))
+            continue
+        if case["sustained_samples_per_s"] < old["sustained_samples_per_s"] * (1 - tolerance):
+            regressions.append((case_key(case), "sustained_samples_per_s", old["sustained_samples_per_s"], case["sustained_samples_per_s"]))
+        for metric in ("write_latency", "frame_time"):
+            if case.get(metric) and old.get(metric) and case[metric]["p99_ms"] > old[metric]["p99_ms"] * (1 + tolerance):
+                regressions.append((case_key(case), metric + ".p99_ms", old[metric]["p99_ms"], case[metric]["p99_ms"]))
+    return regressions
+
+
+def parse_list(text, kind=int):
+    return [kind(value) for value in text.split(",") if value.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput and latency benchmark of the acquire-save-plot pipeline.")
+    parser.add_argument("--channels", default="1,4,8,16,32", help="comma separated channel counts (default: 1,4,8,16,32)")
+    parser.add_argument("--rates", default="1000,10000,100000", help="comma separated sample rates in S/s")
+    parser.add_argument("--batch-sizes", default="100,1000,10000", help="comma separated num_samples values")
+    parser.add_argument("--formats", default="csv,bin", help="comma separated file formats to record (csv, bin)")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds acquired per combination (default: 2)")
+    parser.add_argument("--pacing", choices=("fast", "realtime"), default="fast",
+                        help="'fast' reads as fast as the pipeline allows, 'realtime' paces the device at the sample rate")
+    parser.add_argument("--writer-policy", choices=("block", "drop-oldest", "spill"), default="block",
+                        help="backpressure policy of the writer thread (default: block, so that 'fast' pacing measures what the disk sustains)")
+    parser.add_argument("--frames", type=int, default=20, help="number of live plot frames rendered per combination")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write the results to")
+    parser.add_argument("--baseline", help="JSON result file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change reported as a regression (default: 0.1)")
+    args = parser.parse_args(argv)
+
+    cases = [
+        {"channels": channels, "rate": rate, "batch_size": batch_size, "format": file_format,
+         "pacing": args.pacing, "writer_policy": args.writer_policy, "duration": args.duration, "frames": args.frames}
+        for channels, rate, batch_size, file_format in itertools.product(
+            parse_list(args.channels), parse_list(args.rates), parse_list(args.batch_sizes), parse_list(args.formats, str))
+    ]
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": git_revision(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cases": [],
+    }
+
+    # Every case runs in its own process, so that the peak RSS and the state of the allocator do not leak between cases
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=1, maxtasksperchild=1) as pool:
+        for number, case in enumerate(cases, start=1):
+            result = pool.apply(run_case, (case,))
+            results["cases"].append(result)
+            write = result["write_latency"] or {}
+            frame = result["frame_time"] or {}
+            print(f"[{number}/{len(cases)}] {case['channels']:>2} ch  {case['rate']:>7} S/s  batch {case['batch_size']:>6}  {case['format']:>3}: "
+                  f"{result['sustained_samples_per_s'] / 1e6:8.3f} MS/s  write p99 {write.get('p99_ms', float('nan')):7.3f} ms  "
+                  f"frame p99 {frame.get('p99_ms', float('nan')):7.1f} ms  RSS {result['peak_rss_bytes'] / 2**20:6.0f} MiB"
+                  + (f"  ERROR {result['error']}" if "error" in result else ""))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", *regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
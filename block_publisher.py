@@ -0,0 +1,377 @@
+import collections
+import json
+import socket
+import struct
+import sys
+import threading
+
+import numpy as np
+
+
+# Every connection starts with a metadata frame: magic, length of the JSON text, JSON text with
+# {"channel_names", "sample_rate", "dtype", "first_sequence"}, where first_sequence is the sequence number of the first
+# batch queued for this subscriber. Then every batch is sent as a block frame: a fixed header followed by the samples as
+# one contiguous (channels, samples) array in the dtype of the metadata.
+METADATA_MAGIC = b"PXIMETA1"
+BLOCK_MAGIC = b"PXIBLK01"
+METADATA_HEADER = struct.Struct("<8sI")               # magic, JSON length
+BLOCK_HEADER = struct.Struct("<8sQQIIQ")              # magic, sequence, first sample, channels, samples, payload bytes
+
+
+class _Subscriber:
+
+    # One connected client: its own bounded queue of frames and its own sender thread
+
+    def __init__(self, connection, address, queue_blocks):
+        self.connection = connection
+        self.address = address
+        self.frames = collections.deque()
+        self.queue_blocks = queue_blocks
+        self.condition = threading.Condition()
+        self.closed = False
+        self.sent_blocks = 0
+        self.dropped_blocks = 0
+        self.thread = None
+
+    def enqueue(self, frame):
+        with self.condition:
+            if self.closed:
+                return
+            if len(self.frames) >= self.queue_blocks:
+                # A slow client loses its oldest frame instead of delaying the acquisition
+                self.frames.popleft()
+                self.dropped_blocks += 1
+            self.frames.append(frame)
+            self.condition.notify()
+
+    def run(self, on_disconnect):
+        try:
+            while True:
+                with self.condition:
+                    while not self.frames and not self.closed:
+                        self.condition.wait()
+                    if not self.frames:
+                        break
+                    header, payload = self.frames.popleft()
+                self.connection.sendall(header)
+                self.connection.sendall(payload)
+                self.sent_blocks += 1
+        except OSError:
+            pass
+        finally:
+            self.close()
+            on_disconnect(self)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+
+class BlockPublisher:
+
+    """
+        This class publishes every acquired batch over TCP, so that other processes (on this computer or on the network)
+        can plot or analyse the live data without reading the recorded file.
+
+        Every batch is sent as a small binary header followed by the raw samples (see BLOCK_HEADER). The samples are
+        copied once per batch, whatever the number of subscribers, and every subscriber has its own queue and its own
+        sender thread. When a subscriber cannot keep up, its queue is limited to queue_blocks frames and its oldest
+        frames are dropped (and counted), so a slow subscriber never delays the acquisition or the other subscribers.
+
+        publish() is meant to be a stage of the acquisition pipeline, e.g. add_block_consumer(publisher.publish).
+        Clients connect with BlockSubscriber.
+
+        Arguments:
+                    channel_names: A list of strings with the names of the channels.
+                    sample_rate: A float with the sample rate in samples per second.
+                    host: A string with the address to listen on. Defaults to '127.0.0.1' (this computer only);
+                          use '0.0.0.0' to accept subscribers from the network.
+                    port: An integer with the TCP port. Defaults to 0, which picks a free port (see the port attribute).
+                    queue_blocks: An integer with the largest number of frames waiting for one subscriber. Defaults to 64.
+                    dtype: The data type in which the samples are sent. Defaults to float64; float32 halves the bandwidth.
+    """
+
+    def __init__(self, channel_names, sample_rate, host="127.0.0.1", port=0, queue_blocks=64, dtype=np.float64):
+        self.channel_names = list(channel_names)
+        self.sample_rate = float(sample_rate)
+        self.queue_blocks = int(queue_blocks)
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+
+        self._metadata = {"channel_names": self.channel_names, "sample_rate": self.sample_rate, "dtype": self.dtype.str}
+
+        self.sequence = 0           # Number of batches published so far
+        self.samples_published = 0  # Number of samples per channel published so far
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._server = socket.create_server((host, port))
+        self.host, self.port = self._server.getsockname()[:2]
+        self._accept_thread = threading.Thread(target=self._accept, name="BlockPublisher-accept", daemon=True)
+        self._accept_thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, address = self._server.accept()
+            except OSError:
+                return      # The server socket was closed
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            subscriber = _Subscriber(connection, address, self.queue_blocks)
+            with self._lock:
+                if self._closed:
+                    subscriber.close()
+                    return
+                # Every batch from this sequence number on is queued for the subscriber, so that it can count the
+                # batches dropped for it from the very first one
+                self._subscribers.append(subscriber)
+                first_sequence = self.sequence
+            metadata = json.dumps(dict(self._metadata, first_sequence=first_sequence)).encode()
+            try:
+                # The sender thread is not started yet, so the metadata frame is always the first one
+                connection.sendall(METADATA_HEADER.pack(METADATA_MAGIC, len(metadata)) + metadata)
+            except OSError:
+                self._remove(subscriber)
+                subscriber.close()
+                continue
+            subscriber.thread = threading.Thread(target=subscriber.run, args=(self._remove,),
+                                                 name=f"BlockPublisher-{address[0]}:{address[1]}", daemon=True)
+            subscriber.thread.start()
+
+    def _remove(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    @property
+    def num_subscribers(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def subscriber_stats(self):
+        """
+            This function returns a list with a dictionary per connected subscriber:
+            {'address': 'host:port', 'sent_blocks': ..., 'dropped_blocks': ..., 'queued_blocks': ...}.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return [
+            {
+                "address": f"{subscriber.address[0]}:{subscriber.address[1]}",
+                "sent_blocks": subscriber.sent_blocks,
+                "dropped_blocks": subscriber.dropped_blocks,
+                "queued_blocks": len(subscriber.frames),
+            }
+            for subscriber in subscribers
+        ]
+
+    def publish(self, block):
+        """
+            This function sends a batch to every connected subscriber. It only copies the batch and returns; the
+            sending is done by the threads of the subscribers.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples).
+        """
+        block = np.asarray(block).reshape(len(self.channel_names), -1)
+        num_samples = block.shape[1]
+
+        with self._lock:
+            subscribers = list(self._subscribers)
+            sequence, first_sample = self.sequence, self.samples_published
+            self.sequence += 1
+            self.samples_published += num_samples
+        if subscribers:
+            payload = np.ascontiguousarray(block, dtype=self.dtype).tobytes()
+            header = BLOCK_HEADER.pack(BLOCK_MAGIC, sequence, first_sample, block.shape[0], num_samples, len(payload))
+            for subscriber in subscribers:
+                subscriber.enqueue((header, payload))
+
+    def close(self):
+        """
+            This function stops accepting subscribers, sends the frames that are still queued and disconnects everybody.
+        """
+        with self._lock:
+            self._closed = True
+            subscribers = list(self._subscribers)
+        self._server.close()
+        for subscriber in subscribers:
+            with subscriber.condition:
+                subscriber.closed = True
+                subscriber.condition.notify()
+        for subscriber in subscribers:
+            if subscriber.thread is not None:
+                subscriber.thread.join(timeout=5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _receive_into(connection, view):
+    # Fill the whole memoryview from the socket; return False when the connection is closed
+    received = 0
+    while received < len(view):
+        count = connection.recv_into(view[received:])
+        if count == 0:
+            return False
+        received += count
+    return True
+
+
+class BlockSubscriber:
+
+    """
+        This class receives the batches published by a BlockPublisher.
+
+        Arguments:
+                    host: A string with the address of the publisher.
+                    port: An integer with the TCP port of the publisher.
+                    timeout: An optional float with the time in seconds receive() waits for a batch before raising
+                             socket.timeout. Defaults to None (wait forever).
+
+        After connecting, channel_names, sample_rate and dtype describe the stream. missed_blocks counts the batches
+        which the publisher dropped for this subscriber (gaps in the sequence numbers).
+    """
+
+    def __init__(self, host, port, timeout=None):
+        self.connection = socket.create_connection((host, port))
+        self.connection.settimeout(timeout)
+
+        header = bytearray(METADATA_HEADER.size)
+        if not _receive_into(self.connection, memoryview(header)):
+            raise ConnectionError("the publisher closed the connection")
+        magic, length = METADATA_HEADER.unpack(header)
+        if magic != METADATA_MAGIC:
+            raise ValueError("not a block publisher")
+        metadata = bytearray(length)
+        if not _receive_into(self.connection, memoryview(metadata)):
+            raise ConnectionError("the publisher closed the connection")
+        metadata = json.loads(metadata.decode())
+
+        self.channel_names = metadata["channel_names"]
+        self.sample_rate = metadata["sample_rate"]
+        self.dtype = np.dtype(metadata["dtype"])
+        self.missed_blocks = 0
+        self._header = bytearray(BLOCK_HEADER.size)
+        self._next_sequence = metadata.get("first_sequence")
+
+    def receive(self):
+        """
+            This function waits for the next batch and returns a tuple (sequence, first_sample, block), where block is an
+            array of shape (num_channels, num_samples) and first_sample is the index of its first sample in the stream.
+            It returns None when the publisher has closed the stream.
+        """
+        if not _receive_into(self.connection, memoryview(self._header)):
+            return None
+        magic, sequence, first_sample, num_channels, num_samples, length = BLOCK_HEADER.unpack(self._header)
+        if magic != BLOCK_MAGIC:
+            raise ValueError("corrupt frame received from the publisher")
+
+        block = np.empty((num_channels, num_samples), dtype=self.dtype)
+        if not _receive_into(self.connection, memoryview(block).cast("B")):
+            return None
+
+        if self._next_sequence is not None:
+            self.missed_blocks += sequence - self._next_sequence
+        self._next_sequence = sequence + 1
+        return sequence, first_sample, block
+
+    def __iter__(self):
+        while True:
+            received = self.receive()
+            if received is None:
+                return
+            yield received
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _expect(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def loopback_check(num_channels=4):
+    """
+        This function checks a BlockPublisher and BlockSubscribers against each other over the loopback interface, and
+        raises AssertionError when something is wrong:
+            - a subscriber receives every batch, with consecutive sequence numbers and unchanged samples, and the
+              first_sample of every batch continues the previous batch, whatever the batch sizes
+            - a subscriber which connects after some batches were published starts at the next sequence number,
+              without counting the batches before it as missed
+            - when a subscriber does not read, the publisher drops its oldest batches, and missed_blocks on the
+              subscriber equals dropped_blocks on the publisher; every received batch still has the first_sample of
+              its sequence number
+
+        Run it with:  python block_publisher.py
+    """
+    generator = np.random.default_rng(0)
+    with BlockPublisher([f"ai{channel}" for channel in range(num_channels)], 1000.0) as publisher:
+        # Continuity with varying batch sizes
+        with BlockSubscriber(publisher.host, publisher.port, timeout=10) as subscriber:
+            sizes = [100, 1, 250, 100, 37, 1000]
+            blocks = [generator.standard_normal((num_channels, size)) for size in sizes]
+            for block in blocks:
+                publisher.publish(block)
+            expected_first_sample = 0
+            for expected_sequence, block in enumerate(blocks):
+                sequence, first_sample, received = subscriber.receive()
+                _expect(sequence == expected_sequence, f"sequence {sequence} instead of {expected_sequence}")
+                _expect(first_sample == expected_first_sample, f"first_sample {first_sample} instead of {expected_first_sample}")
+                _expect(np.array_equal(received, block), f"the samples of batch {sequence} changed")
+                expected_first_sample += block.shape[1]
+            _expect(subscriber.missed_blocks == 0, f"{subscriber.missed_blocks} batches missed without drops")
+
+        # A late subscriber starts at the next batch
+        published = publisher.sequence
+        with BlockSubscriber(publisher.host, publisher.port, timeout=10) as subscriber:
+            publisher.publish(np.zeros((num_channels, 10)))
+            sequence, first_sample, _ = subscriber.receive()
+            _expect(sequence == published, f"late subscriber started at {sequence} instead of {published}")
+            _expect(first_sample == publisher.samples_published - 10, "late subscriber got the wrong first_sample")
+            _expect(subscriber.missed_blocks == 0, "late subscriber counted the batches before it as missed")
+
+    # Drops: the batches are much larger than the socket buffers and the subscriber reads nothing until the end
+    block_size = 200000
+    with BlockPublisher(["ai0", "ai1"], 1000.0, queue_blocks=4) as publisher:
+        with BlockSubscriber(publisher.host, publisher.port, timeout=10) as subscriber:
+            first_sequence = publisher.sequence
+            num_blocks = 40
+            for _ in range(num_blocks):
+                publisher.publish(np.zeros((2, block_size)))
+            (stats,) = publisher.subscriber_stats()
+            _expect(stats["dropped_blocks"] > 0, "a subscriber which did not read had no batch dropped")
+
+            received = 0
+            while True:
+                sequence, first_sample, _ = subscriber.receive()
+                received += 1
+                _expect(first_sample == (sequence - first_sequence) * block_size, f"batch {sequence} has first_sample {first_sample}")
+                if sequence == first_sequence + num_blocks - 1:
+                    break
+            _expect(subscriber.missed_blocks == stats["dropped_blocks"],
+                    f"missed_blocks {subscriber.missed_blocks} but the publisher dropped {stats['dropped_blocks']}")
+            _expect(received + subscriber.missed_blocks == num_blocks,
+                    f"{received} received and {subscriber.missed_blocks} missed of {num_blocks} batches")
+
+
+if __name__ == "__main__":
+    loopback_check()
+    print("BlockPublisher loopback check passed")
+    sys.exit(0)
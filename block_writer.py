@@ -0,0 +1,192 @@
+import collections
+import threading
+import time
+
+import numpy as np
+
+
+class BlockWriter:
+
+    """
+        This class moves the writing of the acquired batches to the file into a dedicated thread, so that the thread
+        which reads from the DAQ never waits for the disk. The reading thread hands every batch to submit(), which copies
+        it into one of a fixed number of preallocated blocks and returns immediately. The writer thread takes the blocks
+        from the queue in order, passes them to the sink (e.g. the write function of a recorder) and puts them back into
+        the pool.
+
+        When the disk stalls for longer than the queue can absorb, the backpressure policy decides what happens:
+            'block':       submit() waits until the writer has freed a block. Nothing is lost, but the reads are delayed.
+            'drop-oldest': the oldest batch that is still waiting to be written is dropped and its block is reused.
+                           The reads never wait and dropped_blocks counts the lost batches.
+            'spill':       an extra block is allocated beyond the pool, so the queue keeps growing in memory until the
+                           disk catches up. The reads do not wait and spilled_blocks counts the extra allocations. At
+                           most max_spill_blocks extra blocks are allocated; beyond that the spill_fallback policy
+                           ('block' or 'drop-oldest') applies, so a long stall cannot use up the memory of the machine.
+                           With max_spill_blocks=None the queue grows without limit.
+        The default is 'spill' with the 'drop-oldest' fallback: a short stall costs memory and nothing else, and a stall
+        too long for max_spill_blocks loses the oldest batches (counted in dropped_blocks) instead of delaying the reads
+        until the driver's buffer overflows and the acquisition fails.
+
+        write() is the same as submit(), so a BlockWriter can be given where a recorder is expected (e.g. to a
+        TriggeredCapture).
+
+        Arguments:
+                    sink: A function which is called with every batch, as an array of shape (num_channels, num_samples).
+                    num_channels: An integer with the number of channels in every batch.
+                    block_size: An integer with the largest number of samples per channel in one batch.
+                    num_blocks: An integer with the number of preallocated blocks, i.e. the depth of the queue. Defaults to 16.
+                    policy: The backpressure policy, one of 'block', 'drop-oldest' or 'spill'. Defaults to 'spill'.
+                    dtype: The NumPy data type of the blocks. Defaults to float64.
+                    max_spill_blocks: An integer with the largest number of blocks allocated beyond the pool by the
+                                      'spill' policy, or None for no limit. Defaults to 256.
+                    spill_fallback: The policy used when max_spill_blocks is reached, 'block' or 'drop-oldest' (default).
+    """
+
+    POLICIES = ("block", "drop-oldest", "spill")
+
+    def __init__(self, sink, num_channels, block_size, num_blocks=16, policy="spill", dtype=np.float64,
+                 max_spill_blocks=256, spill_fallback="drop-oldest"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"unknown policy '{policy}', expected one of {self.POLICIES}")
+        if spill_fallback not in ("block", "drop-oldest"):
+            raise ValueError("spill_fallback must be 'block' or 'drop-oldest'")
+        if num_blocks < 2:
+            raise ValueError("num_blocks must be at least 2")
+
+        self.sink = sink
+        self.num_channels = int(num_channels)
+        self.block_size = int(block_size)
+        self.num_blocks = int(num_blocks)
+        self.policy = policy
+        self.dtype = dtype
+        self.max_spill_blocks = None if max_spill_blocks is None else int(max_spill_blocks)
+        self.spill_fallback = spill_fallback
+
+        self.dropped_blocks = 0     # Batches lost with the 'drop-oldest' policy
+        self.spilled_blocks = 0     # Blocks allocated beyond the pool with the 'spill' policy
+        self.max_queue_depth = 0    # Largest number of batches that were waiting to be written at the same time
+        self.blocks_written = 0
+        self.write_times = None     # Set to a list to collect the time (in seconds) the sink needed for every batch
+        self.metrics = None         # Set to a PipelineMetrics to record the time of every write as its 'write' stage
+
+        self._free = [self._allocate() for _ in range(self.num_blocks)]
+        self._allocated = self.num_blocks
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+        self._closing = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="BlockWriter", daemon=True)
+        self._thread.start()
+
+    def _allocate(self):
+        return np.empty((self.num_channels, self.block_size), dtype=self.dtype)
+
+    @property
+    def queue_depth(self):
+        """
+            The number of batches that are waiting to be written.
+        """
+        return len(self._pending)
+
+    def _take_free_block(self):
+        # Called with the condition held
+        while not self._free:
+            policy = self.policy
+            if policy == "spill":
+                if self.max_spill_blocks is None or self._allocated - self.num_blocks < self.max_spill_blocks:
+                    self.spilled_blocks += 1
+                    self._allocated += 1
+                    return self._allocate()
+                policy = self.spill_fallback
+            if policy == "drop-oldest" and self._pending:
+                block, _ = self._pending.popleft()
+                self.dropped_blocks += 1
+                return block
+            # 'block' policy (or nothing left to drop): wait for the writer thread to release a block
+            self._condition.wait()
+            self._raise_writer_error()
+        return self._free.pop()
+
+    def submit(self, block):
+        """
+            This function queues one batch for writing. The batch is copied, so the caller can reuse its array right away.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples) with num_samples <= block_size.
+        """
+        block = np.asarray(block).reshape(self.num_channels, -1)
+        num_samples = block.shape[1]
+        if num_samples > self.block_size:
+            raise ValueError(f"batch of {num_samples} samples does not fit in blocks of {self.block_size} samples")
+
+        with self._condition:
+            self._raise_writer_error()
+            if self._closing:
+                raise RuntimeError("BlockWriter is closed")
+            target = self._take_free_block()
+
+        np.copyto(target[:, :num_samples], block)
+
+        with self._condition:
+            self._pending.append((target, num_samples))
+            self.max_queue_depth = max(self.max_queue_depth, len(self._pending))
+            self._condition.notify_all()
+
+    write = submit
+
+    def _release(self, block):
+        # Called with the condition held. Blocks allocated beyond the pool by the 'spill' policy are given back to NumPy.
+        if self._allocated > self.num_blocks:
+            self._allocated -= 1
+        else:
+            self._free.append(block)
+        self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closing:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                block, num_samples = self._pending.popleft()
+
+            try:
+                write_started = time.perf_counter()
+                self.sink(block[:, :num_samples])
+                write_time = time.perf_counter() - write_started
+                if self.write_times is not None:
+                    self.write_times.append(write_time)
+                if self.metrics is not None:
+                    self.metrics.observe("write", write_time)
+            except BaseException as error:
+                with self._condition:
+                    self._error = error
+                    self._pending.clear()
+                    self._release(block)
+                return
+
+            with self._condition:
+                self.blocks_written += 1
+                self._release(block)
+
+    def _raise_writer_error(self):
+        if self._error is not None:
+            raise RuntimeError("writing to the file failed") from self._error
+
+    def close(self):
+        """
+            This function waits until every queued batch has been written and stops the writer thread.
+            It raises the error of the sink, if writing failed.
+        """
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._raise_writer_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,132 @@
+import math
+
+import numpy as np
+
+
+def default_buffer_size(sample_rate):
+    """
+        This function returns the input buffer size per channel which NI-DAQmx allocates for a continuous task when
+        none is given: 1 kS up to 100 S/s, 10 kS up to 10 kS/s, 100 kS up to 1 MS/s and 1 MS above.
+    """
+    if sample_rate <= 100:
+        return 1000
+    if sample_rate <= 10000:
+        return 10000
+    if sample_rate <= 1000000:
+        return 100000
+    return 1000000
+
+
+class BufferPlan:
+
+    """
+        This class holds the sizes chosen by plan_buffers().
+
+        Attributes:
+                    batch_size: Samples per channel read in every batch at the start of the acquisition.
+                    max_batch_size: Largest batch the BatchSizeTuner may switch to when the reads fall behind.
+                    buffer_size: Input buffer size per channel of the task (samps_per_chan of cfg_samp_clk_timing).
+    """
+
+    def __init__(self, sample_rate, num_channels, target_latency, batch_size, max_batch_size, buffer_size):
+        self.sample_rate = sample_rate
+        self.num_channels = num_channels
+        self.target_latency = target_latency
+        self.batch_size = batch_size
+        self.max_batch_size = max_batch_size
+        self.buffer_size = buffer_size
+
+    def describe(self):
+        return (f"Batch size {self.batch_size} samples per channel ({1000 * self.batch_size / self.sample_rate:.1f} ms, "
+                f"target {1000 * self.target_latency:.1f} ms), up to {self.max_batch_size} when the reads fall behind; "
+                f"input buffer {self.buffer_size} samples per channel ({self.buffer_size / self.sample_rate:.2f} s, "
+                f"{self.buffer_size * self.num_channels * 2 / 1e6:.1f} MB of driver memory)")
+
+
+def plan_buffers(sample_rate, num_channels, target_latency=0.1, max_reads_per_second=100):
+    """
+        This function chooses the read batch size and the input buffer size of a continuous acquisition.
+
+        The batch size is the number of samples acquired in target_latency seconds, so that a batch reaches the writer
+        and the plot about target_latency after its first sample was converted. It is raised when that would mean more
+        than max_reads_per_second reads, because every read has a fixed cost in the driver and in Python which then
+        dominates. The input buffer is the NI-DAQmx default for the sample rate, but at least 8 batches, so that the
+        reads can be late by several batches before the buffer overflows, and it is a whole number of batches.
+
+        Arguments:
+                    sample_rate: A float with the sample rate in samples per second.
+                    num_channels: An integer with the number of channels in the task.
+                    target_latency: A float with the wanted time between two reads, in seconds. Defaults to 0.1.
+                    max_reads_per_second: An integer with the largest number of reads per second. Defaults to 100.
+
+        It returns a BufferPlan.
+    """
+    if sample_rate <= 0 or target_latency <= 0:
+        raise ValueError("sample_rate and target_latency must be positive")
+
+    batch_size = max(int(round(sample_rate * target_latency)), math.ceil(sample_rate / max_reads_per_second), 1)
+    buffer_size = max(default_buffer_size(sample_rate), 8 * batch_size)
+    buffer_size = -(-buffer_size // batch_size) * batch_size
+    max_batch_size = max(batch_size, buffer_size // 4)
+    return BufferPlan(sample_rate, num_channels, target_latency, batch_size, max_batch_size, buffer_size)
+
+
+class BatchSizeTuner:
+
+    """
+        This class adapts the read batch size of a running acquisition to the backlog of the driver, i.e. the number of
+        samples which are still waiting in the input buffer after a read (task.in_stream.avail_samp_per_chan).
+
+        When the backlog after a read is larger than the batch, the reads are falling behind (e.g. a slow stage in the
+        pipeline or a busy computer), so the batch size is doubled, up to max_batch_size: fewer and larger reads cost
+        less per sample and let the loop catch up before the buffer overflows. When the backlog stays below a quarter of
+        the batch for settle_reads reads in a row, the batch size is halved again, down to the planned size, to get the
+        latency back.
+
+        The batches are read into one preallocated flat array: block() returns its first num_channels * batch_size
+        elements reshaped to (num_channels, batch_size), which is contiguous for every batch size, so a read can fill it
+        directly and changing the batch size never allocates.
+
+        Arguments:
+                    plan: The BufferPlan of the acquisition.
+                    settle_reads: An integer with the number of reads with a small backlog before the batch shrinks. Defaults to 10.
+                    dtype: The data type of the batches. Defaults to float64.
+    """
+
+    def __init__(self, plan, settle_reads=10, dtype=np.float64):
+        self.plan = plan
+        self.settle_reads = int(settle_reads)
+        self.batch_size = plan.batch_size
+        self.adjustments = []       # (read number, old batch size, new batch size, backlog) of every change
+        self._storage = np.zeros(plan.num_channels * plan.max_batch_size, dtype=dtype)
+        self._reads = 0
+        self._quiet_reads = 0
+
+    def block(self):
+        """
+            This function returns the array for the next read, of shape (num_channels, batch_size).
+        """
+        return self._storage[:self.plan.num_channels * self.batch_size].reshape(self.plan.num_channels, self.batch_size)
+
+    def update(self, backlog):
+        """
+            This function is called after every read with the backlog of the driver, and returns the batch size of the
+            next read.
+        """
+        self._reads += 1
+        new_size = self.batch_size
+        if backlog > self.batch_size and self.batch_size < self.plan.max_batch_size:
+            new_size = min(2 * self.batch_size, self.plan.max_batch_size)
+            self._quiet_reads = 0
+        elif backlog < self.batch_size // 4 and self.batch_size > self.plan.batch_size:
+            self._quiet_reads += 1
+            if self._quiet_reads >= self.settle_reads:
+                new_size = max(self.batch_size // 2, self.plan.batch_size)
+                self._quiet_reads = 0
+        else:
+            self._quiet_reads = 0
+
+        if new_size != self.batch_size:
+            self.adjustments.append((self._reads, self.batch_size, new_size, int(backlog)))
+            self.batch_size = new_size
+        return self.batch_size
@@ -0,0 +1,205 @@
+import threading
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+FILTER_KINDS = ("lowpass", "highpass", "bandpass", "bandstop", "notch")
+
+
+def _import_signal():
+    try:
+        from scipy import signal
+    except ImportError:
+        raise ImportError("Filtering and decimating the acquired data needs the scipy package (pip install scipy)") from None
+    return signal
+
+
+def design_filter(kind, frequency, sample_rate, order=4, quality=30.0):
+    """
+        This function designs an IIR filter and returns it as second-order sections (an array of shape (sections, 6)),
+        the form used by SOSFilter, which stays numerically stable for high orders and low cut-off frequencies.
+
+        Arguments:
+                    kind: One of FILTER_KINDS. 'lowpass', 'highpass', 'bandpass' and 'bandstop' are Butterworth filters,
+                          'notch' removes one frequency (e.g. 50 Hz mains hum) with a second-order notch.
+                    frequency: A float with the cut-off or notch frequency in Hz, or a tuple (low, high) for 'bandpass'
+                               and 'bandstop'.
+                    sample_rate: A float with the sample rate in samples per second.
+                    order: An integer with the order of the Butterworth filters. Defaults to 4.
+                    quality: A float with the quality factor of the notch (frequency / bandwidth). Defaults to 30.
+    """
+    if kind not in FILTER_KINDS:
+        raise ValueError(f"unknown filter '{kind}', expected one of {FILTER_KINDS}")
+    signal = _import_signal()
+    if kind == "notch":
+        b, a = signal.iirnotch(frequency, quality, fs=sample_rate)
+        return signal.tf2sos(b, a)
+    return signal.butter(order, frequency, btype=kind, fs=sample_rate, output="sos")
+
+
+class SOSFilter:
+
+    """
+        This class applies an IIR filter, given as second-order sections, to a stream of batches. The state of every
+        section of every channel (zi) is carried from one batch to the next, so filtering the batches one after the
+        other gives exactly the same result as filtering the whole recording at once. All the channels are filtered
+        by one call to scipy.signal.sosfilt.
+
+        The state is started from the steady state of the first sample of every channel, which avoids the step that a
+        filter started from zero would show at the beginning of the recording.
+
+        Arguments:
+                    sos: An array of shape (sections, 6), e.g. from design_filter(). Several filters are applied in
+                         series by stacking their sections (np.vstack).
+                    num_channels: An integer with the number of channels.
+    """
+
+    def __init__(self, sos, num_channels):
+        signal = _import_signal()
+        self._sosfilt = signal.sosfilt
+        self.sos = np.atleast_2d(np.asarray(sos, dtype=np.float64))
+        self.num_channels = int(num_channels)
+        self._steady_state = signal.sosfilt_zi(self.sos)       # Shape (sections, 2), for an input of 1
+        self._zi = None
+
+    def process(self, block):
+        """
+            This function filters a batch and returns the filtered batch, of the same shape.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples).
+        """
+        block = np.asarray(block, dtype=np.float64).reshape(self.num_channels, -1)
+        if block.shape[1] == 0:
+            return block.copy()
+        if self._zi is None:
+            # Shape (sections, channels, 2): the state of every section of every channel
+            self._zi = self._steady_state[:, np.newaxis, :] * block[np.newaxis, :, 0, np.newaxis]
+        filtered, self._zi = self._sosfilt(self.sos, block, axis=-1, zi=self._zi)
+        return filtered
+
+    def reset(self):
+        self._zi = None
+
+
+class PolyphaseDecimator:
+
+    """
+        This class lowers the sample rate of a stream of batches by an integer factor. The batches go through a
+        low-pass FIR filter which removes everything above the new Nyquist frequency, and only every factor-th output
+        is kept. Like a polyphase filter, only the kept outputs are computed: every one of them is the dot product of
+        the filter with the last num_taps input samples, taken for all kept outputs of all channels at once from a
+        sliding window view (no copy) of the batch.
+
+        The last num_taps - 1 input samples are carried to the next batch and the phase of the decimation is kept
+        across batches, so output sample k always corresponds to input sample k * factor, whatever the batch sizes.
+        The filter delays the signal by (num_taps - 1) / 2 input samples.
+
+        Arguments:
+                    num_channels: An integer with the number of channels.
+                    factor: An integer with the decimation factor.
+                    num_taps: An optional integer with the length of the filter. Defaults to 20 * factor + 1 (the same
+                              Kaiser-windowed filter as scipy.signal.resample_poly).
+    """
+
+    def __init__(self, num_channels, factor, num_taps=None):
+        self.num_channels = int(num_channels)
+        self.factor = int(factor)
+        if self.factor < 1:
+            raise ValueError("the decimation factor must be at least 1")
+        if num_taps is None:
+            num_taps = 20 * self.factor + 1
+        signal = _import_signal()
+        taps = signal.firwin(int(num_taps), 1.0 / self.factor, window=("kaiser", 5.0))
+        self._reversed_taps = np.ascontiguousarray(taps[::-1])
+        self.samples_in = 0
+        self._history = None
+
+    def process(self, block):
+        """
+            This function decimates a batch and returns the new samples, as an array of shape (num_channels, n) where n
+            is about num_samples / factor (it depends on the phase carried over from the previous batches).
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples).
+        """
+        block = np.asarray(block, dtype=np.float64).reshape(self.num_channels, -1)
+        num_taps = len(self._reversed_taps)
+        if self._history is None:
+            # Start as if the first sample had always been there, like SOSFilter
+            first = block[:, :1] if block.shape[1] else np.zeros((self.num_channels, 1))
+            self._history = np.repeat(first, num_taps - 1, axis=1)
+
+        extended = np.concatenate((self._history, block), axis=1)
+        # Window w ends on input sample samples_in + w; the kept outputs are those on multiples of the factor
+        first_output = -self.samples_in % self.factor
+        windows = sliding_window_view(extended, num_taps, axis=1)[:, first_output::self.factor]
+        decimated = windows @ self._reversed_taps
+
+        self.samples_in += block.shape[1]
+        self._history = extended[:, extended.shape[1] - (num_taps - 1):].copy()
+        return decimated
+
+    def reset(self):
+        self.samples_in = 0
+        self._history = None
+
+
+class DSPStage:
+
+    """
+        This class filters and decimates the acquired batches before they are recorded, plotted and analysed, so that the
+        hardware can be read at the full rate while only a filtered, lower-rate product goes to the disk. All the
+        filters are applied in series by a single SOSFilter, then the PolyphaseDecimator lowers the rate; the
+        decimator's own low-pass filter also prevents aliasing.
+
+        process() returns the processed batch, which can be empty when a short batch does not complete an output sample.
+        Batches have to be given in order, from one thread at a time.
+
+        Arguments:
+                    num_channels: An integer with the number of channels.
+                    sample_rate: A float with the sample rate of the acquisition in samples per second.
+                    filters: A list of filters, each given as second-order sections or as a tuple (kind, frequency) for
+                             design_filter(), e.g. [('notch', 50.0), ('highpass', 0.5)].
+                    decimation: An integer with the decimation factor. Defaults to 1 (no decimation).
+    """
+
+    def __init__(self, num_channels, sample_rate, filters=(), decimation=1):
+        self.num_channels = int(num_channels)
+        self.sample_rate = float(sample_rate)
+        self.decimation = int(decimation)
+        sections = []
+        for spec in filters:
+            if isinstance(spec, tuple) and isinstance(spec[0], str):
+                sections.append(design_filter(spec[0], spec[1], self.sample_rate))
+            else:
+                sections.append(np.atleast_2d(spec))
+        self.filter = SOSFilter(np.vstack(sections), self.num_channels) if sections else None
+        self.decimator = PolyphaseDecimator(self.num_channels, self.decimation) if self.decimation > 1 else None
+        self._lock = threading.Lock()
+
+    @property
+    def output_rate(self):
+        return self.sample_rate / self.decimation
+
+    def process(self, block):
+        """
+            This function filters and decimates a batch and returns the result.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples).
+        """
+        with self._lock:
+            if self.filter is not None:
+                block = self.filter.process(block)
+            if self.decimator is not None:
+                block = self.decimator.process(block)
+            return block
+
+    def reset(self):
+        with self._lock:
+            if self.filter is not None:
+                self.filter.reset()
+            if self.decimator is not None:
+                self.decimator.reset()
@@ -2,28 +2,90 @@
 
 
 
-from tkinter import filedialog
+# Tkinter and matplotlib are only imported by the functions which open the dialog or the plot, so that the
+# acquisition can also be run headless (see acquire_cli.py) without paying for their import.
 import os
-import tkinter as tk
-from tkinter import simpledialog
-import nidaqmx
+import sys
 import time
 import threading
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
+import contextlib
 import numpy as np
+from ring_buffer import RingBuffer
+from plot_decimation import DEFAULT_POINT_BUDGET, MinMaxDecimator, envelope_bins
+from multi_device_acquisition import MultiDeviceAcquisition, group_channels_by_device
+from online_statistics import OnlineStatistics
+from overview_index import OverviewPyramid, overview_path
+from recording import open_recorder
+from block_writer import BlockWriter
+from block_publisher import BlockPublisher
+from shared_memory_ring import SharedBlockRing
+from buffer_sizing import BatchSizeTuner, plan_buffers
+from triggered_capture import TriggeredCapture
+from time_index import BlockTimeIndex, time_index_path
+from dsp_stage import DSPStage
+from pxi6284 import NidaqmxBackend
 
 class DataAcquisitionAndPlotting:
-    def __init__(self):
+    def __init__(self, backend=None, device_names=("Dev1",)):
+        # The backend creates the DAQ tasks: NidaqmxBackend for the real hardware, or simulated_daq.SimulatedBackend
+        self.backend = backend if backend is not None else NidaqmxBackend()
+        self.device_names = list(device_names)  # Devices offered in the channel selection dialog, the first one provides the sample clock
         self.sample_rate = 0
         self.duration = 0.0
         self.duration_unit = 'seconds'  # Initialize duration_unit to 'seconds' by default
-        self.num_samples = 0
+        self.num_samples = 0  # Samples per channel read in each batch, or 'auto' to size the batches and the buffer from the rate (see buffer_sizing)
+        self.target_latency = 0.1  # Time between two reads in seconds aimed at when num_samples is 'auto'
+        self.buffer_plan = None  # The BufferPlan chosen for the running acquisition when num_samples is 'auto'
+        self.batch_size_tuner = None  # The BatchSizeTuner of the running acquisition (its adjustments can be inspected)
         self.csv_file_path = ""
+        self.binary_dtype = 'float64'  # Sample format used when the file is saved as '.bin' or '.seg' ('float64' or 'int16')
+        self.segment_seconds = 600.0  # Length of the segment files of a '.seg' recording, in seconds
+        self.fsync_policy = 'segment'  # When a '.seg' recording forces its data to the disk: 'none', 'segment', 'checkpoint' or 'block'
+        self.segment_bytes = None  # Optional largest size of the segment files of a '.seg' recording, in bytes
+        self.checkpoint_seconds = 1.0  # Time between two checkpoints of a '.seg' recording (the tail a killed process can lose)
+        self.resume_recording = False  # Continue an interrupted '.seg' recording in the same directory instead of replacing it
         self.selected_channels = []
         self.data_ready_event = threading.Event()
         self.plotting_active = True  # Flag to control live plotting
+        self.plot_window = 1500  # Number of data points to display on the x-axis of the live plot
+        self.plot_buffer = None  # Ring buffer shared between the acquisition thread and the live plot
+        self.plot_pixel_width = 800  # Approximate width of the plot in pixels; wider windows are drawn as a min/max envelope
+        self.plot_point_budget = DEFAULT_POINT_BUDGET  # Most points drawn per frame over all channels, which bounds the frame time
+        self.plot_decimator = None  # MinMaxDecimator used by the live plot when the window has more points than the envelope
+        self.batch_write_times = None  # Set to a list to collect the time (in seconds) spent writing each batch to the file
+        self.writer_policy = 'spill'  # What happens when the disk falls behind: 'block', 'drop-oldest' or 'spill' (see BlockWriter)
+        self.writer_max_spill_blocks = 256  # Largest number of extra batches kept in memory by the 'spill' policy, None for no limit
+        self.writer_spill_fallback = 'drop-oldest'  # Policy once writer_max_spill_blocks are in use: 'drop-oldest' or 'block'
+        self.writer_queue_blocks = 16  # Number of preallocated batches queued between the reading and the writing thread
+        self.block_writer = None  # The BlockWriter of the running acquisition (queue depth and dropped block counters)
+        self.acquisition_mode = 'polling'  # 'polling' reads in a loop until the duration is over, 'callback' reads exactly rate x duration samples from every-N-samples events,
+                                           # 'finite' acquires exactly rate x duration samples as one hardware-timed capture, read and written at once
+        self.block_consumers = []  # Extra functions which receive every acquired batch, see add_block_consumer
+        self.pipeline = []  # All the stages which receive every batch of the running acquisition, see dispatch_block
+        self.compute_statistics = True  # Keep running mean/RMS/min/max/PSD per channel and save them next to the data file
+        self.statistics = None  # The OnlineStatistics of the running acquisition, can be queried while it runs
+        self.build_overview = True  # Keep a min/max/mean pyramid of the recording for fast zooming (see overview_index.OverviewViewer)
+        self.overview = None  # The OverviewPyramid of the running acquisition
+        self.publish_address = None  # Set to (host, port) to stream every batch to BlockSubscriber clients over TCP
+        self.publisher = None  # The BlockPublisher of the running acquisition (subscriber and drop counters)
+        self.shared_ring_slots = 0  # Set to a number of batches to share them with other processes through a SharedBlockRing
+        self.shared_ring_name = None  # Optional name of the shared memory block (a random name is used when None)
+        self.shared_ring = None  # The SharedBlockRing of the running acquisition; readers attach with its name
+        self.shared_ring_readers = 0  # Number of reader processes to wait for (up to 60 s) before acquiring, so they see the first batch
+        self.task_pool = None  # Set to a TaskPool to keep the configured single-device tasks committed between runs
+        self.trigger = None  # Set to a LevelTrigger, SlopeTrigger or WindowTrigger to save only the windows around events
+        self.trigger_pre_samples = 1000  # Samples per channel saved before every trigger
+        self.trigger_post_samples = 1000  # Samples per channel saved from every trigger on
+        self.triggered_capture = None  # The TriggeredCapture of the running acquisition (its events can be inspected)
+        self.reference_trigger = None  # Set to (source, level, 'rising' or 'falling') to end a 'finite' capture on a hardware analog edge
+        self.reference_trigger_timeout = 60.0  # Longest time in seconds a finite capture waits for its reference trigger
+        self.build_time_index = True  # Save the first sample, hardware time and host time of every batch next to the data file
+        self.time_index = None  # The BlockTimeIndex of the running acquisition
+        self.filters = []  # Filters applied to every batch before it is recorded, e.g. [('notch', 50.0), ('highpass', 0.5)] (see dsp_stage)
+        self.decimation = 1  # Record only every n-th sample (after an anti-aliasing filter), at sample_rate / decimation
+        self.dsp_stage = None  # The DSPStage of the running acquisition, None when the batches are recorded as read
+        self.metrics = None  # Set to a PipelineMetrics to time every stage and report the driver backlog and the queues (see pipeline_metrics)
+        self._last_dispatch_end = None  # perf_counter() at the end of the previous batch, for the 'read' time of the metrics
 
     def is_positive_integer(self, value):
         try:
@@ -44,31 +106,36 @@ class DataAcquisitionAndPlotting:
         return False
 
     def create_channel_selection_dialog(self):
+        import tkinter as tk
+        from tkinter import filedialog
+
         root = tk.Tk()
         root.withdraw()
 
         num_channels = 32
 
         # Function to update the channels list when a checkbox is clicked
-        def update_channels(channel_var, channel_num):
+        def update_channels(channel_var, channel_name):
             if channel_var.get():
-                self.selected_channels.append(f"Dev1/ai{channel_num}")
+                self.selected_channels.append(channel_name)
             else:
-                self.selected_channels.remove(f"Dev1/ai{channel_num}")
+                self.selected_channels.remove(channel_name)
 
         # Create the dialog box
         dialog = tk.Toplevel(root)
         dialog.title("Data Acquisition Configuration")
 
-        # Create and add checkboxes for each channel
+        # Create and add checkboxes for each channel, one column per device
         channel_frame = tk.Frame(dialog)
         channel_frame.pack(padx=10, pady=5)
-        for i in range(num_channels):
-            channel_var = tk.BooleanVar()
-            channel_var.set(False)
-            channel_num = i
-            checkbox = tk.Checkbutton(channel_frame, text=f"Channel {channel_num}", variable=channel_var, command=lambda var=channel_var, num=channel_num: update_channels(var, num))
-            checkbox.pack(anchor='w')
+        for column, device in enumerate(self.device_names):
+            tk.Label(channel_frame, text=device).grid(row=0, column=column, padx=5)
+            for i in range(num_channels):
+                channel_var = tk.BooleanVar()
+                channel_var.set(False)
+                channel_name = f"{device}/ai{i}"
+                checkbox = tk.Checkbutton(channel_frame, text=f"Channel {i}", variable=channel_var, command=lambda var=channel_var, name=channel_name: update_channels(var, name))
+                checkbox.grid(row=i + 1, column=column, sticky='w')
 
         # --- Add sections for other input parameters ---
         param_frame = tk.Frame(dialog)
@@ -91,7 +158,7 @@ class DataAcquisitionAndPlotting:
         duration_unit_menu.grid(row=1, column=2, padx=5, pady=5)
 
         # Num Samples section
-        num_samples_label = tk.Label(param_frame, text="Num Samples (read in each batch):")
+        num_samples_label = tk.Label(param_frame, text="Num Samples (read in each batch, or 'auto'):")
         num_samples_label.grid(row=2, column=0, padx=5, pady=5)
         num_samples_entry = tk.Entry(param_frame)
         num_samples_entry.grid(row=2, column=1, padx=5, pady=5)
@@ -102,7 +169,7 @@ class DataAcquisitionAndPlotting:
 
         def browse_csv_file():
             file_path = filedialog.asksaveasfilename(defaultextension=".csv",
-                                                    filetypes=[("CSV Files", "*.csv"), ("All Files", "*.*")])
+                                                    filetypes=[("CSV Files", "*.csv"), ("Binary Recording", "*.bin"), ("HDF5 Files", "*.h5 *.hdf5"), ("Zarr Store", "*.zarr"), ("Segmented Recording", "*.seg"), ("All Files", "*.*")])
             if file_path:
                 csv_file_path_var.set(file_path)
 
@@ -147,7 +214,7 @@ class DataAcquisitionAndPlotting:
                 duration_entry.insert(0, "Invalid duration")
                 return
 
-            if not self.is_positive_integer(num_samples_value) or int(num_samples_value) <= 0:
+            if num_samples_value.strip().lower() != 'auto' and (not self.is_positive_integer(num_samples_value) or int(num_samples_value) <= 0):
                 num_samples_entry.delete(0, tk.END)
                 num_samples_entry.insert(0, "Invalid num samples")
                 return
@@ -155,7 +222,7 @@ class DataAcquisitionAndPlotting:
             # Convert the validated values to appropriate data types
             self.sample_rate = int(sample_rate_value)
             self.duration = float(duration_value)
-            self.num_samples = int(num_samples_value)
+            self.num_samples = 'auto' if num_samples_value.strip().lower() == 'auto' else int(num_samples_value)
             self.csv_file_path = csv_file_path_value
 
             # Set the duration_unit based on the selected option
@@ -171,6 +238,76 @@ class DataAcquisitionAndPlotting:
         # Run the dialog box
         dialog.wait_window()
 
+    def add_block_consumer(self, consumer):
+        '''
+            This function registers a function which is called with every acquired batch, as an array of shape
+            (channels, samples), right after the batch has been handed to the writer and the live plot. The array is
+            reused for the next batch, so a consumer has to copy what it wants to keep, and it should return quickly
+            because the next read waits for it.
+        '''
+        self.block_consumers.append(consumer)
+
+    def dispatch_block(self, block):
+        if self.metrics is not None:
+            self.dispatch_block_with_metrics(block)
+            return
+
+        # Filter and decimate the batch first when there is a DSP stage (a short batch may not complete an output
+        # sample), then hand it to every stage of the pipeline, in order
+        if self.dsp_stage is not None:
+            block = self.dsp_stage.process(block)
+            if block.shape[1] == 0:
+                return
+        for consumer in self.pipeline:
+            consumer(block)
+
+    def dispatch_block_with_metrics(self, block):
+        '''
+            This function is dispatch_block with every step timed. The time since the previous batch was dispatched is
+            the time spent reading (or waiting for) this batch, the DSP stage is the 'convert' stage, and every stage of
+            the pipeline has its own histogram, named after its function (e.g. 'BlockWriter.submit').
+        '''
+        metrics = self.metrics
+        started = time.perf_counter()
+        if self._last_dispatch_end is not None:
+            metrics.observe('read', started - self._last_dispatch_end)
+        metrics.increment('blocks')
+        metrics.increment('samples', block.shape[1])
+
+        if self.dsp_stage is not None:
+            block = self.dsp_stage.process(block)
+            now = time.perf_counter()
+            metrics.observe('convert', now - started)
+            started = now
+        if block.shape[1]:
+            for consumer in self.pipeline:
+                consumer(block)
+                now = time.perf_counter()
+                metrics.observe(getattr(consumer, '__qualname__', type(consumer).__name__), now - started)
+                started = now
+        self._last_dispatch_end = started
+
+    def register_metric_gauges(self):
+        '''
+            This function registers the queues of the running acquisition as gauges of the metrics. The gauges are only
+            read when the metrics are scraped or logged, so they do not slow the acquisition down.
+        '''
+        metrics = self.metrics
+        if self.block_writer is not None:
+            writer = self.block_writer
+            metrics.add_gauge('writer_queue_depth', lambda: writer.queue_depth)
+            metrics.add_gauge('writer_max_queue_depth', lambda: writer.max_queue_depth)
+            metrics.add_gauge('writer_dropped_blocks', lambda: writer.dropped_blocks)
+            metrics.add_gauge('writer_spilled_blocks', lambda: writer.spilled_blocks)
+        if self.publisher is not None:
+            publisher = self.publisher
+            metrics.add_gauge('publisher_subscribers', lambda: publisher.num_subscribers)
+            metrics.add_gauge('publisher_dropped_blocks', lambda: sum(stats['dropped_blocks'] for stats in publisher.subscriber_stats()))
+            metrics.add_gauge('publisher_queued_blocks', lambda: max([stats['queued_blocks'] for stats in publisher.subscriber_stats()], default=0))
+        if self.plot_buffer is not None:
+            plot_buffer = self.plot_buffer
+            metrics.add_gauge('recorded_samples', lambda: plot_buffer.total_written)
+
     def acquire_and_save_data(self):
         # Convert the duration to seconds based on the user-specified unit
         duration_in_seconds = self.duration
@@ -179,71 +316,362 @@ class DataAcquisitionAndPlotting:
         elif self.duration_unit == 'hours':
             duration_in_seconds *= 3600
 
+        # Channels of several devices are acquired with one task per device; their columns are grouped by device
+        devices = group_channels_by_device(self.selected_channels)
+        self.selected_channels = [channel for channels in devices.values() for channel in channels]
+
+        # With 'auto' the batch and buffer sizes follow from the rate, the number of channels and the target latency,
+        # and the batch size of a single-device polling acquisition adapts to the backlog of the driver while it runs
+        self.buffer_plan = None
+        self.batch_size_tuner = None
+        if self.num_samples == 'auto':
+            self.buffer_plan = plan_buffers(self.sample_rate, len(self.selected_channels), self.target_latency)
+            batch_size, max_batch_size, buffer_size = self.buffer_plan.batch_size, self.buffer_plan.max_batch_size, self.buffer_plan.buffer_size
+        else:
+            batch_size = max_batch_size = buffer_size = self.num_samples
+
+        # A finite capture of a single device is read in one piece, so every stage receives it as one batch. Stages
+        # which preallocate a number of batches (the shared memory ring) keep the streaming batch size instead
+        total_samples = int(round(self.sample_rate * duration_in_seconds))
+        finite = self.acquisition_mode == 'finite' and len(devices) == 1
+        if self.reference_trigger is not None and not finite:
+            raise ValueError("a reference trigger needs the 'finite' acquisition mode of a single device")
+        streaming_batch_size = max_batch_size
+        if finite:
+            batch_size = max_batch_size = buffer_size = max(total_samples, 1)
+
+        # The hardware is always read at sample_rate; with filters or decimation every batch is processed before the
+        # other stages, which then all see the filtered stream at its own (possibly lower) rate
+        self.dsp_stage = None
+        recorded_rate = self.sample_rate
+        if self.filters or self.decimation > 1:
+            self.dsp_stage = DSPStage(len(self.selected_channels), self.sample_rate, self.filters, self.decimation)
+            recorded_rate = self.dsp_stage.output_rate
+
         # Prepare the column headings based on the channel names
         column_headings = [self.selected_channels[i] for i in range(len(self.selected_channels))]
 
-        with nidaqmx.Task() as task:
-            for channel in self.selected_channels:
-                task.ai_channels.add_ai_voltage_chan(channel)
+        # The file format follows the extension of the chosen file ('.bin', '.h5'/'.hdf5', '.zarr', anything else is CSV).
+        # start_time is only the wall-clock time saved in the metadata; the duration of the polling loops is counted
+        # from their first read, so that the setup below does not shorten the capture
+        start_time = time.time()
+        recorder = open_recorder(self.csv_file_path, column_headings, recorded_rate,
+                                 binary_dtype=self.binary_dtype, start_time=start_time,
+                                 segment_seconds=self.segment_seconds, fsync=self.fsync_policy,
+                                 segment_bytes=self.segment_bytes, checkpoint_seconds=self.checkpoint_seconds,
+                                 resume=self.resume_recording)
+
+        # The live plot reads the newest samples from this buffer instead of re-reading the CSV file
+        self.plot_buffer = RingBuffer(self.plot_window, len(self.selected_channels))
+
+        # The file is written by a separate thread, so a slow disk never delays the next read. A finite capture is
+        # only written after the acquisition, in one call, so it goes to the recorder directly. The windows of a
+        # triggered capture go through the writer too, so its blocks must hold a whole window
+        self.block_writer = None
+        if not finite:
+            writer_block_size = max_batch_size
+            if self.trigger is not None:
+                writer_block_size = max(max_batch_size, self.trigger_pre_samples + self.trigger_post_samples)
+            self.block_writer = BlockWriter(recorder.write, len(self.selected_channels), writer_block_size,
+                                            num_blocks=self.writer_queue_blocks, policy=self.writer_policy,
+                                            max_spill_blocks=self.writer_max_spill_blocks,
+                                            spill_fallback=self.writer_spill_fallback)
+            self.block_writer.write_times = self.batch_write_times
+
+        # Every batch goes to the writer thread (which copies it, so the block can be reused right away), then to
+        # the live plot, then to the consumers registered with add_block_consumer
+        write_stage = self.block_writer.submit if self.block_writer is not None else recorder.write
+
+        # With a trigger only the windows around the events are written, one after the other, through the writer
+        # thread (or to the recorder directly after a finite capture)
+        self.triggered_capture = None
+        if self.trigger is not None:
+            self.trigger.reset()
+            self.triggered_capture = TriggeredCapture(self.selected_channels, recorded_rate, self.trigger,
+                                                      self.trigger_pre_samples, self.trigger_post_samples,
+                                                      recorder=self.block_writer or recorder)
+            write_stage = self.triggered_capture.update
+
+        self.pipeline = [write_stage, self.plot_buffer.write] + self.block_consumers
+
+        # Windows with more samples than the envelope has points (2 per bin, at most one bin per pixel and no more than
+        # the point budget of a frame allows over all channels) are drawn from a min/max envelope updated with every batch
+        self.plot_decimator = None
+        num_bins = envelope_bins(len(self.selected_channels), self.plot_pixel_width, self.plot_point_budget)
+        if self.plot_window > 2 * num_bins:
+            self.plot_decimator = MinMaxDecimator(len(self.selected_channels), self.plot_window, num_bins)
+            self.pipeline.insert(2, self.plot_decimator.update)
+
+        # Summary statistics are updated with every batch, so the file never has to be read again to compute them
+        self.statistics = None
+        if self.compute_statistics:
+            self.statistics = OnlineStatistics(self.selected_channels, recorded_rate)
+            self.pipeline.append(self.statistics.update)
+
+        # The overview pyramid lets a viewer zoom from the whole recording down to single samples without reading it all
+        self.overview = None
+        if self.build_overview and self.triggered_capture is None:
+            self.overview = OverviewPyramid(self.selected_channels, recorded_rate)
+            self.pipeline.append(self.overview.update)
+
+        # Other processes can receive the live batches over TCP instead of tailing the recorded file
+        self.publisher = None
+        if self.publish_address is not None:
+            self.publisher = BlockPublisher(self.selected_channels, recorded_rate, *self.publish_address)
+            self.pipeline.append(self.publisher.publish)
+
+        # Plotting and analysis processes can read the batches from shared memory, outside of the GIL of this process
+        self.shared_ring = None
+        if self.shared_ring_slots:
+            self.shared_ring = SharedBlockRing(len(self.selected_channels), streaming_batch_size, self.shared_ring_slots,
+                                               name=self.shared_ring_name)
+            self.pipeline.append(self.shared_ring.write)
+            if self.shared_ring_readers:
+                self.shared_ring.wait_for_readers(self.shared_ring_readers, timeout=60.0)
+
+        # Every batch is tagged with its first sample and the host time before any other stage runs, so that any time
+        # can later be mapped to a sample and (for '.bin' files) a byte offset without reading the file. The t0 of the
+        # hardware time is taken from the first batch, not from start_time, which is before the setup of the task
+        self.time_index = None
+        if self.build_time_index:
+            data_offset = getattr(recorder, 'data_offset', None)
+            row_bytes = None
+            if data_offset is not None and self.triggered_capture is None:
+                row_bytes = np.dtype(self.binary_dtype).itemsize * len(self.selected_channels)
+            self.time_index = BlockTimeIndex(recorded_rate, None, row_bytes, data_offset or 0)
+            self.pipeline.insert(0, self.time_index.update)
+
+        # Timing of every stage and gauges of the queues, only when metrics were asked for
+        self._last_dispatch_end = None
+        if self.metrics is not None:
+            self.register_metric_gauges()
+            if self.block_writer is not None:
+                self.block_writer.metrics = self.metrics
+
+        # Set the data_ready_event to indicate that data is ready for plotting
+        self.data_ready_event.set()
+
+        with recorder, self.block_writer or contextlib.nullcontext():
+            if len(devices) > 1:
+                # One reader thread per device, all devices on the sample clock of the first one (this also gives
+                # exactly rate x duration samples, so it is used for the finite mode of several devices too)
+                with MultiDeviceAcquisition(self.backend, self.selected_channels, self.sample_rate, batch_size, buffer_size) as acquisition:
+                    if self.metrics is not None:
+                        # The backlog of the device which is furthest behind
+                        self.metrics.add_gauge('driver_backlog_samples', lambda: max(task.in_stream.avail_samp_per_chan for task in acquisition.tasks.values()))
+                    acquisition.run(self.dispatch_block, total_samples)
+            elif finite:
+                self.acquire_finite(total_samples)
+            else:
+                with self.open_task(self.backend.constants.AcquisitionType.CONTINUOUS, buffer_size) as task:
+                    # Every batch is read straight into this preallocated array, shaped as (channels, samples)
+                    reader = self.backend.analog_reader(task)
+                    block = np.zeros((len(self.selected_channels), batch_size), dtype=np.float64)
+                    if self.metrics is not None:
+                        # Samples which have been acquired but not read yet; a growing backlog means the reads fall behind
+                        self.metrics.add_gauge('driver_backlog_samples', lambda: task.in_stream.avail_samp_per_chan)
 
-            task.timing.cfg_samp_clk_timing(rate=self.sample_rate, sample_mode=nidaqmx.constants.AcquisitionType.CONTINUOUS, samps_per_chan=self.num_samples)
+                    if self.acquisition_mode == 'callback':
+                        self.acquire_with_callbacks(task, reader, block, total_samples)
+                    elif self.buffer_plan is not None:
+                        self.acquire_with_batch_tuning(task, reader, duration_in_seconds)
+                    else:
+                        loop_start_time = time.time()
+                        while (time.time() - loop_start_time) < duration_in_seconds:
+                            reader.read_many_sample(block, number_of_samples_per_channel=batch_size)      # read_many_sample also takes the argument timeout- which means how much time it can wait before declaring timeout, to read the batch of data.
+                            self.dispatch_block(block)
 
-            # Write the header to the CSV file only once
-            pd.DataFrame(columns=column_headings).to_csv(self.csv_file_path, index=False)
+            # Events still waiting for their post-trigger samples are saved with what was acquired, before the file is closed
+            if self.triggered_capture is not None:
+                self.triggered_capture.flush()
 
-            # Set the data_ready_event to indicate that data is ready for plotting
-            self.data_ready_event.set()
+        if self.metrics is not None:
+            self.metrics.remove_gauge('driver_backlog_samples')
 
-            start_time = time.time()
-            while (time.time() - start_time) < duration_in_seconds:
-                data = task.read(number_of_samples_per_channel=self.num_samples)      # read function also takes the argument timeout- which means how much time the read function can wait before declaring timeout, to read the batch of data.
+        if self.publisher is not None:
+            self.publisher.close()
 
-                if len(self.selected_channels) == 1:
-                    data_dict = {self.selected_channels[0]: data}  # Single channel data is a 1D array
-                else:
-                    data_dict = {self.selected_channels[i]: data[i] for i in range(len(self.selected_channels))}
+        if self.shared_ring is not None:
+            self.shared_ring.close()
 
-                # Append data to the CSV file
-                pd.DataFrame(data_dict, columns=column_headings).to_csv(self.csv_file_path, mode='a', index=False, header=False)
-        # Set the plotting_active flag to False after the duration is over
-        self.plotting_active = False
+        if self.triggered_capture is not None:
+            self.triggered_capture.write_event_index(os.path.splitext(self.csv_file_path.rstrip('/\\'))[0] + '.events.json')
 
-    def live_plot_from_csv(self):
-        plt.style.use('fivethirtyeight')  # Set the style for the current function
+        if self.statistics is not None:
+            self.statistics.write_summary(os.path.splitext(self.csv_file_path.rstrip('/\\'))[0] + '.summary.json')
 
-        # Number of data points to display on the x-axis
-        x_range = 1500
+        if self.overview is not None:
+            self.overview.save(overview_path(self.csv_file_path))
 
-        def animate(i):
-            if not self.plotting_active:
-                # If plotting is not active, stop updating the plot
-                ani.event_source.stop()
-                return
+        if self.time_index is not None:
+            self.time_index.save(time_index_path(self.csv_file_path))
 
-            data = pd.read_csv(self.csv_file_path)
+        # Set the plotting_active flag to False after the duration is over
+        self.plotting_active = False
 
-            # Limit the number of data points displayed on the x-axis
-            num_data_points = len(data)
-            start_idx = max(num_data_points - x_range, 0)
-            end_idx = num_data_points
-            x = np.arange(start_idx, end_idx)
+    def acquire_with_callbacks(self, task, reader, block, total_samples):
+        '''
+            This function acquires exactly total_samples samples per channel without a polling loop. The driver calls
+            on_samples_acquired every time num_samples new samples are in its buffer, and the batch is read and handed to
+            the pipeline from that callback. The last batch is shortened so that the capture ends on the requested count.
+        '''
+        remaining = [total_samples]
+        finished = threading.Event()
+        callback_error = []
+
+        # The last batch is read into its own array, because block[:, :n] is not contiguous
+        batch_size = block.shape[1]
+        last_batch_size = total_samples % batch_size
+        last_block = np.zeros((block.shape[0], last_batch_size), dtype=block.dtype) if last_batch_size else None
+
+        def on_samples_acquired(task_handle, every_n_samples_event_type, number_of_samples, callback_data):
+            if finished.is_set():
+                return 0
+            try:
+                target = block if remaining[0] >= batch_size else last_block
+                reader.read_many_sample(target, number_of_samples_per_channel=target.shape[1])
+                remaining[0] -= target.shape[1]
+                self.dispatch_block(target)
+            except Exception as error:
+                callback_error.append(error)
+                remaining[0] = 0
+            if remaining[0] == 0:
+                finished.set()
+            return 0
+
+        if total_samples == 0:
+            return
+
+        task.register_every_n_samples_acquired_into_buffer_event(batch_size, on_samples_acquired)
+        task.start()
+        try:
+            finished.wait()
+        finally:
+            task.stop()
+            task.register_every_n_samples_acquired_into_buffer_event(batch_size, None)
+
+        if callback_error:
+            raise callback_error[0]
+
+    @contextlib.contextmanager
+    def open_task(self, sample_mode, samps_per_chan):
+        '''
+            This function returns a task with the selected channels and the sample clock timing, as a context manager.
+            With a task_pool the task comes from the pool, already committed when the same configuration was used
+            before, and goes back to the pool afterwards; otherwise a new task is created and closed at the end.
+        '''
+        if self.task_pool is not None:
+            with self.task_pool.task(self.selected_channels, self.sample_rate, sample_mode, samps_per_chan) as task:
+                yield task
+            return
+
+        with self.backend.create_task() as task:
+            for channel in self.selected_channels:
+                task.ai_channels.add_ai_voltage_chan(channel)
+            task.timing.cfg_samp_clk_timing(rate=self.sample_rate, sample_mode=sample_mode, samps_per_chan=samps_per_chan)
+            yield task
+
+    def acquire_finite(self, total_samples):
+        '''
+            This function acquires exactly total_samples samples per channel as one finite, hardware-timed capture. The
+            task is configured for exactly that many samples, so the card stops by itself after the last one, and the
+            whole capture is read with a single call into one preallocated array, which is then handed to the pipeline
+            (and written to the file) once. There is no read loop and the sample count never depends on timing.
+
+            With a reference_trigger the card keeps acquiring until the trigger source crosses the level, and the
+            capture holds the trigger_pre_samples samples before the crossing and the rest of total_samples after it
+            (see PXI6284Controller.configure_analog_edge_reference_trigger), so the trigger is at sample
+            trigger_pre_samples of the file.
+        '''
+        if total_samples == 0:
+            return
+
+        with self.open_task(self.backend.constants.AcquisitionType.FINITE, total_samples) as task:
+            timeout = total_samples / self.sample_rate + 10.0
+            if self.reference_trigger is not None:
+                source, level, slope = self.reference_trigger
+                slope = self.backend.constants.Slope.FALLING if slope == 'falling' else self.backend.constants.Slope.RISING
+                task.triggers.reference_trigger.cfg_anlg_edge_ref_trig(source, min(self.trigger_pre_samples, total_samples - 2),
+                                                                       trigger_slope=slope, trigger_level=level)
+                timeout += self.reference_trigger_timeout
+            try:
+                capture = np.empty((len(self.selected_channels), total_samples), dtype=np.float64)
+                reader = self.backend.analog_reader(task)
+                task.start()
+                # The read waits for the whole capture, so its timeout has to cover the acquisition time
+                reader.read_many_sample(capture, number_of_samples_per_channel=total_samples, timeout=timeout)
+                task.wait_until_done(timeout=10.0)
+                task.stop()
+            finally:
+                if self.reference_trigger is not None:
+                    # A pooled task is reused by the next run, which may not want the trigger
+                    task.triggers.reference_trigger.disable_ref_trig()
+
+        self.dispatch_block(capture)
+
+    def acquire_with_batch_tuning(self, task, reader, duration_in_seconds):
+        '''
+            This function is the polling loop used when num_samples is 'auto'. After every read it checks how many
+            samples are still waiting in the input buffer of the driver, and the BatchSizeTuner switches to larger
+            batches when the reads fall behind and back to the planned size when they have caught up.
+        '''
+        self.batch_size_tuner = BatchSizeTuner(self.buffer_plan)
+        loop_start_time = time.time()
+        while (time.time() - loop_start_time) < duration_in_seconds:
+            block = self.batch_size_tuner.block()
+            reader.read_many_sample(block, number_of_samples_per_channel=block.shape[1])
+            self.dispatch_block(block)
+            self.batch_size_tuner.update(task.in_stream.avail_samp_per_chan)
+
+    def create_plot_engine(self):
+        from live_plot_engine import LivePlotEngine
+
+        # The engine creates one line per channel once and only updates their data on every frame
+        if self.plot_decimator is not None:
+            # Min/max of every bin of the window, about 2 points per pixel whatever the window size
+            decimator = self.plot_decimator
+            x = np.repeat(np.arange(1 - decimator.num_bins, 1) * decimator.bin_size, 2)
+            fetch = lambda: decimator.envelope()[1]
+        else:
+            # View of the newest samples, one column per channel (no copy, no file access)
+            x = np.arange(1 - self.plot_window, 1)
+            fetch = lambda: self.plot_buffer.latest(self.plot_window)[1]
+
+        engine = LivePlotEngine(self.selected_channels, x, fetch, ylim=(-5, 5),
+                                stop_when=lambda: not self.plotting_active, envelope=self.plot_decimator is not None)
+        engine.metrics = self.metrics
+        return engine
 
-            plt.cla()
-            for channel in data.columns:
-                y = data[channel][start_idx:end_idx]
-                plt.plot(x, y, label=channel, linewidth=1)
-                plt.ylim(-5, 5)
+    def live_plot_from_csv(self):
+        import matplotlib.pyplot as plt
 
-            plt.legend(loc='upper left')
-            plt.tight_layout()
+        plt.style.use('fivethirtyeight')  # Set the style for the current function
 
         # Wait until data is ready for plotting
         self.data_ready_event.wait()
-        
-        ani = FuncAnimation(plt.gcf(), animate, interval=100)
 
-        plt.tight_layout()
-        plt.show()
+        self.create_plot_engine().run()
+
+    def run_summary(self):
+        """
+            This function returns what is worth reporting about the last acquisition, as a list of lines: the buffer
+            plan chosen for num_samples='auto', the adjustments of the batch size, the batches the writer dropped and
+            the events of a triggered capture. acquire_and_save_data only keeps them in its attributes, so that the
+            caller decides whether and where they are shown.
+        """
+        lines = []
+        if self.buffer_plan is not None:
+            lines.append(self.buffer_plan.describe())
+        if self.batch_size_tuner is not None and self.batch_size_tuner.adjustments:
+            lines.append(f"The batch size was adjusted {len(self.batch_size_tuner.adjustments)} times, "
+                         f"largest batch {max(new for _, _, new, _ in self.batch_size_tuner.adjustments)} samples per channel")
+        if self.block_writer is not None and self.block_writer.dropped_blocks:
+            lines.append(f"Warning: {self.block_writer.dropped_blocks} batches were dropped because the disk could not keep up")
+        if self.triggered_capture is not None:
+            lines.append(f"{len(self.triggered_capture.events)} events were saved"
+                         + (f", {self.triggered_capture.truncated_events} of them cut at the start or the end of the acquisition"
+                            if self.triggered_capture.truncated_events else ""))
+        return lines
 
     def run(self):
         self.create_channel_selection_dialog()
@@ -272,6 +700,19 @@ class DataAcquisitionAndPlotting:
         acquire_thread.join()
         plot_thread.join()
 
+        for line in self.run_summary():
+            print(line)
+
 if __name__ == "__main__":
-    data_acquisition_and_plotting = DataAcquisitionAndPlotting()
+    # Run with --simulate to use the software-simulated device instead of the PXI hardware,
+    # and with --devices=Dev1,Dev2 to offer the channels of several cards
+    backend = None
+    device_names = ["Dev1"]
+    for argument in sys.argv[1:]:
+        if argument == "--simulate":
+            from simulated_daq import SimulatedBackend
+            backend = SimulatedBackend()
+        elif argument.startswith("--devices="):
+            device_names = [name.strip() for name in argument.split("=", 1)[1].split(",") if name.strip()]
+    data_acquisition_and_plotting = DataAcquisitionAndPlotting(backend=backend, device_names=device_names)
     data_acquisition_and_plotting.run()
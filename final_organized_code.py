@@ -11,8 +11,9 @@ import time
 import threading
 import pandas as pd
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
 import numpy as np
+from live_plot_engine import LivePlotEngine
+from plot_decimation import MinMaxDecimator, envelope_bins
 
 class DataAcquisitionAndPlotting:
     def __init__(self):
@@ -23,6 +24,8 @@ class DataAcquisitionAndPlotting:
         self.csv_file_path = ""
         self.selected_channels = []
         self.data_ready_event = threading.Event()
+        self.plot_window = 10000  # Number of data points to display on the x-axis of the live plot
+        self.plot_decimator = None  # Min/max envelope of the newest plot_window samples, updated with every batch
 
     def is_positive_integer(self, value):
         try:
@@ -164,6 +167,9 @@ class DataAcquisitionAndPlotting:
             # Write the header to the CSV file only once
             pd.DataFrame(columns=column_headings).to_csv(self.csv_file_path, index=False)
 
+            # The live plot draws the min/max envelope of the newest samples instead of re-reading the CSV file
+            self.plot_decimator = MinMaxDecimator(len(self.selected_channels), self.plot_window, envelope_bins(len(self.selected_channels)))
+
             # Set the data_ready_event to indicate that data is ready for plotting
             self.data_ready_event.set()
 
@@ -178,38 +184,19 @@ class DataAcquisitionAndPlotting:
 
                 # Append data to the CSV file
                 pd.DataFrame(data_dict, columns=column_headings).to_csv(self.csv_file_path, mode='a', index=False, header=False)
+                self.plot_decimator.update(np.asarray(data).reshape(len(self.selected_channels), -1))
 
     def live_plot_from_csv(self):
         plt.style.use('fivethirtyeight')  # Set the style for the current function
 
-        # Number of data points to display on the x-axis
-        x_range = 10000
-
-        def animate(i):
-            data = pd.read_csv(self.csv_file_path)
-
-            # Limit the number of data points displayed on the x-axis
-            num_data_points = len(data)
-            start_idx = max(num_data_points - x_range, 0)
-            end_idx = num_data_points
-            x = np.arange(start_idx, end_idx)
-
-            plt.cla()
-            for channel in data.columns:
-                y = data[channel][start_idx:end_idx]
-                plt.plot(x, y, label=channel, linewidth=1)
-                plt.ylim(-5, 5)
-
-            plt.legend(loc='upper left')
-            plt.tight_layout()
-
         # Wait until data is ready for plotting
         self.data_ready_event.wait()
-        
-        ani = FuncAnimation(plt.gcf(), animate, interval=100)
 
-        plt.tight_layout()
-        plt.show()
+        # The lines are created once and only their data is updated on every frame, from the envelope kept in memory
+        decimator = self.plot_decimator
+        x = np.repeat(np.arange(1 - decimator.num_bins, 1) * decimator.bin_size, 2)
+        engine = LivePlotEngine(self.selected_channels, x, lambda: decimator.envelope()[1], ylim=(-5, 5), envelope=True)
+        engine.run()
 
     def run(self):
         self.create_channel_selection_dialog()
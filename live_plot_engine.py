@@ -0,0 +1,157 @@
+import time
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.patches import Polygon
+
+
+class LivePlotEngine:
+
+    """
+        This class draws the live plot of the acquisition scripts without rebuilding the figure on every frame.
+
+        The figure, the axes, the legend and one Line2D per channel are created once. Every frame only replaces the
+        y-data of the lines (set_ydata) and redraws them with blitting: the background of the figure (axes, ticks,
+        labels, legend) is rendered once and cached, and a frame restores that cached image and draws the lines on top
+        of it. The whole figure is only rendered again when the window is resized or the y-limits have to change.
+
+        The x-axis does not move: it shows the position of every point relative to the newest sample (0 is the newest
+        sample), so the background never has to be redrawn while the data scrolls through the window.
+
+        With envelope=True the data is the min/max envelope of a MinMaxDecimator and every channel is drawn as a band
+        filled between the minimums and the maximums of its bins (the edge of the band is drawn too, so a flat signal
+        still shows as a line). A line jumping between the minimum and the maximum of every bin takes several times
+        longer to render for noisy channels, because every jump is a stroke across the whole band.
+
+        Arguments:
+                    channel_names: A list of strings used as the labels of the lines.
+                    x: A 1D array with the fixed x position of every point of the window.
+                    fetch: A function without arguments which returns the newest data as an array of shape
+                           (points, channels), with at most len(x) points, or None when there is nothing to show yet.
+                           Shorter arrays are drawn at the right end of the window.
+                    interval: An integer with the time between two frames in milliseconds. Defaults to 33 (30 frames per second).
+                    ylim: A tuple (bottom, top) with fixed y-limits, or None to adapt the limits to the data.
+                    xlabel: A string with the label of the x-axis.
+                    stop_when: An optional function without arguments; the animation stops when it returns True.
+                    envelope: True when fetch returns a min/max envelope (the minimum and the maximum of every bin
+                              follow each other, and x gives the position of every bin twice). Defaults to False.
+    """
+
+    def __init__(self, channel_names, x, fetch, interval=33, ylim=(-5, 5), xlabel="Samples (0 = newest)", stop_when=None,
+                 envelope=False):
+        self.channel_names = list(channel_names)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.fetch = fetch
+        self.interval = interval
+        self.fixed_ylim = ylim
+        self.stop_when = stop_when
+        self.envelope = envelope
+        self.frames_drawn = 0
+        self.metrics = None     # Set to a PipelineMetrics to record the time of every frame as its 'render' stage
+
+        # The y-data of all lines, padded with NaN (not drawn) while the window is not full yet
+        self._y = np.full((len(self.x), len(self.channel_names)), np.nan)
+
+        self.figure, self.axes = plt.subplots()
+        # Antialiasing is turned off for the lines, because it dominates the drawing time of many noisy channels
+        if envelope:
+            colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+            self.lines = [
+                self.axes.add_patch(Polygon(np.zeros((0, 2)), closed=True, label=channel, color=colors[column % len(colors)],
+                                            linewidth=1, antialiased=False, animated=True))
+                for column, channel in enumerate(self.channel_names)
+            ]
+        else:
+            self.lines = [
+                self.axes.plot(self.x, self._y[:, column], label=channel, linewidth=1, antialiased=False, animated=True)[0]
+                for column, channel in enumerate(self.channel_names)
+            ]
+        self.axes.set_xlim(self.x[0], self.x[-1])
+        self.axes.set_ylim(*(ylim if ylim is not None else (-1, 1)))
+        self.axes.set_xlabel(xlabel)
+        self.axes.legend(loc='upper left')
+        self.figure.tight_layout()
+
+        self._background = None
+        self._timer = None
+        self.figure.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _on_draw(self, event):
+        # Called after every full render of the figure: cache the background and put the lines back on top of it
+        self._background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+        for line in self.lines:
+            self.axes.draw_artist(line)
+
+    def _update_data(self):
+        data = self.fetch()
+        if data is None or len(data) == 0:
+            return False
+
+        data = data[-len(self.x):]
+        if self.envelope:
+            # The band runs along the minimums from left to right and back along the maximums
+            x = self.x[len(self.x) - len(data):]
+            band_x = np.concatenate((x[0::2], x[-1::-2]))
+            for column, band in enumerate(self.lines):
+                band.set_xy(np.column_stack((band_x, np.concatenate((data[0::2, column], data[-1::-2, column])))))
+        else:
+            self._y[:len(self.x) - len(data)] = np.nan
+            self._y[len(self.x) - len(data):] = data
+            for column, line in enumerate(self.lines):
+                line.set_ydata(self._y[:, column])
+
+        if self.fixed_ylim is None:
+            return self._adapt_ylim(data)
+        return False
+
+    def _adapt_ylim(self, data):
+        # Widen the y-limits (with a 10 % margin) only when the data leaves them; this needs a full redraw
+        bottom, top = self.axes.get_ylim()
+        low, high = np.nanmin(data), np.nanmax(data)
+        if not np.isfinite(low) or (bottom <= low and high <= top):
+            return False
+        margin = max((high - low) * 0.1, 1e-3)
+        self.axes.set_ylim(min(bottom, low - margin), max(top, high + margin))
+        return True
+
+    def render_frame(self):
+        """
+            This function draws one frame. It is called by the animation timer, and can also be called directly
+            (e.g. to measure the frame time with a non-interactive backend).
+        """
+        frame_started = time.perf_counter()
+        needs_full_redraw = self._update_data()
+        canvas = self.figure.canvas
+
+        if self._background is None or needs_full_redraw:
+            canvas.draw()
+        else:
+            canvas.restore_region(self._background)
+            for line in self.lines:
+                self.axes.draw_artist(line)
+            canvas.blit(self.figure.bbox)
+        self.frames_drawn += 1
+        if self.metrics is not None:
+            self.metrics.observe("render", time.perf_counter() - frame_started)
+
+    def _on_timer(self):
+        if self.stop_when is not None and self.stop_when():
+            self.stop()
+            return
+        self.render_frame()
+
+    def run(self):
+        """
+            This function starts the animation timer and shows the window. It returns when the window is closed.
+        """
+        self._timer = self.figure.canvas.new_timer(interval=self.interval)
+        self._timer.add_callback(self._on_timer)
+        self._timer.start()
+        plt.show()
+
+    def stop(self):
+        """
+            This function stops updating the plot. The window stays open with the last frame.
+        """
+        if self._timer is not None:
+            self._timer.stop()
@@ -0,0 +1,154 @@
+import threading
+
+import numpy as np
+
+
+def device_of(channel_name):
+    """
+        This function returns the device part of a physical channel name, e.g. 'Dev2' for 'Dev2/ai5'.
+    """
+    return channel_name.strip('/').split('/')[0]
+
+
+def group_channels_by_device(channel_names):
+    """
+        This function groups the channel names by device, keeping the devices in the order in which they first appear
+        and the channels of every device in their original order. It returns a dictionary {device: [channel names]}.
+    """
+    groups = {}
+    for channel in channel_names:
+        groups.setdefault(device_of(channel), []).append(channel)
+    return groups
+
+
+class MultiDeviceAcquisition:
+
+    """
+        This class acquires from several PXIe-6284 cards at the same time, as one aligned stream of samples.
+
+        A DAQ task can only contain channels of one device, so one task is created per device. The first device is the
+        master: its task runs on its own sample clock. The tasks of the other devices use the sample clock and the start
+        trigger of the master (exported over the PXI backplane as /<master>/ai/SampleClock and /<master>/ai/StartTrigger),
+        so every card converts its sample n at the same moment.
+
+        Every device has its own reader thread which reads its channels straight into its rows of a merged
+        (channels, samples) array, so the cards are read in parallel. When all the threads have read a batch, the merged
+        batch is handed to the dispatch function, and the threads continue with the next batch.
+
+        Arguments:
+                    backend: The backend which creates the tasks and readers (NidaqmxBackend or SimulatedBackend).
+                    channel_names: A list of physical channel names, possibly of several devices (e.g. ['Dev1/ai0', 'Dev2/ai0']).
+                    sample_rate: A float with the sample rate in samples per second.
+                    num_samples: An integer with the number of samples per channel read in every batch.
+                    buffer_size: An integer with the input buffer size per channel of every task. Defaults to num_samples.
+    """
+
+    def __init__(self, backend, channel_names, sample_rate, num_samples, buffer_size=None):
+        self.backend = backend
+        self.devices = group_channels_by_device(channel_names)
+        self.master = next(iter(self.devices))
+        self.sample_rate = sample_rate
+        self.num_samples = int(num_samples)
+        self.buffer_size = int(buffer_size) if buffer_size is not None else self.num_samples
+
+        # Channel order of the merged stream: grouped by device, so that the rows of every device are contiguous
+        self.channel_names = [channel for channels in self.devices.values() for channel in channels]
+
+        self.tasks = {}
+        self._error = None
+
+    def open(self):
+        """
+            This function creates and configures one task per device.
+        """
+        continuous = self.backend.constants.AcquisitionType.CONTINUOUS
+        for device, channels in self.devices.items():
+            task = self.backend.create_task()
+            self.tasks[device] = task
+            for channel in channels:
+                task.ai_channels.add_ai_voltage_chan(channel)
+
+            if device == self.master:
+                task.timing.cfg_samp_clk_timing(rate=self.sample_rate, sample_mode=continuous, samps_per_chan=self.buffer_size)
+            else:
+                # Share the sample clock and the start trigger of the master device
+                task.timing.cfg_samp_clk_timing(rate=self.sample_rate, source=f"/{self.master}/ai/SampleClock",
+                                                sample_mode=continuous, samps_per_chan=self.buffer_size)
+                task.triggers.start_trigger.cfg_dig_edge_start_trig(f"/{self.master}/ai/StartTrigger")
+
+    def close(self):
+        """
+            This function stops and closes the tasks of all devices.
+        """
+        for task in self.tasks.values():
+            task.close()
+        self.tasks = {}
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def run(self, dispatch, total_samples):
+        """
+            This function acquires exactly total_samples samples per channel from all devices.
+
+            Arguments:
+                        dispatch: A function which is called with every merged batch, an array of shape
+                                  (number of channels, samples) with the rows in the order of channel_names.
+                                  The array is reused for the next batch.
+                        total_samples: An integer with the number of samples per channel to acquire.
+        """
+        num_channels = len(self.channel_names)
+        num_full_batches, last_batch_size = divmod(int(total_samples), self.num_samples)
+        batches = [np.zeros((num_channels, self.num_samples))] if num_full_batches else []
+        if last_batch_size:
+            batches.append(np.zeros((num_channels, last_batch_size)))
+        schedule = [0] * num_full_batches + ([len(batches) - 1] if last_batch_size else [])
+        if not schedule:
+            return
+
+        current = [0]
+
+        def dispatch_merged_batch():
+            # Runs in one of the threads once every device has read its part of the batch
+            dispatch(batches[schedule[current[0]]])
+            current[0] += 1
+
+        barrier = threading.Barrier(len(self.devices), action=dispatch_merged_batch)
+
+        def read_device(device, first_row, last_row):
+            reader = self.backend.analog_reader(self.tasks[device])
+            try:
+                for batch_index in schedule:
+                    # The rows of one device are a contiguous part of the merged array, so the reader fills them in place
+                    rows = batches[batch_index][first_row:last_row]
+                    reader.read_many_sample(rows, number_of_samples_per_channel=rows.shape[1])
+                    barrier.wait()
+            except threading.BrokenBarrierError:
+                pass
+            except Exception as error:
+                self._error = self._error or error
+                barrier.abort()
+
+        threads = []
+        first_row = 0
+        for device, channels in self.devices.items():
+            threads.append(threading.Thread(target=read_device, args=(device, first_row, first_row + len(channels)),
+                                            name=f"reader-{device}", daemon=True))
+            first_row += len(channels)
+
+        # The slaves wait for the start trigger of the master, so they have to be started first
+        for device, task in reversed(list(self.tasks.items())):
+            task.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for task in self.tasks.values():
+            task.stop()
+
+        if self._error is not None:
+            raise self._error
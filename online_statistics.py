@@ -0,0 +1,154 @@
+import json
+import threading
+
+import numpy as np
+
+
+class OnlineStatistics:
+
+    """
+        This class keeps summary statistics of every channel up to date while the data is being acquired, so that they
+        never have to be computed again from the recorded file.
+
+        For every channel it keeps the number of samples, the mean, the variance (and from it the standard deviation and
+        the RMS), the minimum, the maximum and the peak-to-peak value. The mean and variance of every batch are merged
+        into the running values with the parallel form of Welford's algorithm, which is numerically stable and works on
+        all channels at once.
+
+        It also estimates the power spectral density of every channel with Welch's method: the stream is cut into
+        segments of psd_segment samples overlapping by 50 %, every segment has its mean removed, is multiplied by a Hann
+        window and transformed with an FFT, and the periodograms are averaged. Samples which do not fill a segment yet
+        are carried over to the next batch.
+
+        Arguments:
+                    channel_names: A list of strings with the names of the channels.
+                    sample_rate: A float with the sample rate in samples per second.
+                    psd_segment: An integer with the length of the Welch segments. Defaults to 1024 samples.
+    """
+
+    def __init__(self, channel_names, sample_rate, psd_segment=1024):
+        self.channel_names = list(channel_names)
+        self.sample_rate = float(sample_rate)
+        self.psd_segment = int(psd_segment)
+        num_channels = len(self.channel_names)
+
+        self.count = 0
+        self._mean = np.zeros(num_channels)
+        self._m2 = np.zeros(num_channels)          # Sum of squared differences from the mean
+        self._minimum = np.full(num_channels, np.inf)
+        self._maximum = np.full(num_channels, -np.inf)
+
+        # Periodic Hann window and density scaling, the same as scipy.signal.welch
+        n = np.arange(self.psd_segment)
+        self._window = 0.5 - 0.5 * np.cos(2 * np.pi * n / self.psd_segment)
+        self._psd_scale = 1.0 / (self.sample_rate * np.sum(self._window ** 2))
+        self._psd_step = self.psd_segment // 2
+        self._psd_sum = np.zeros((num_channels, self.psd_segment // 2 + 1))
+        self.psd_segments = 0
+        self._carry = np.zeros((num_channels, 0))
+
+        self._lock = threading.Lock()
+
+    def update(self, block):
+        """
+            This function adds a batch to the statistics.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples).
+        """
+        block = np.asarray(block, dtype=np.float64).reshape(len(self.channel_names), -1)
+        num_samples = block.shape[1]
+        if num_samples == 0:
+            return
+
+        block_mean = block.mean(axis=1)
+        block_m2 = np.square(block - block_mean[:, np.newaxis]).sum(axis=1)
+
+        # Segments of the Welch estimate which are complete with this batch
+        data = np.concatenate((self._carry, block), axis=1)
+        num_segments = 0
+        if data.shape[1] >= self.psd_segment:
+            num_segments = (data.shape[1] - self.psd_segment) // self._psd_step + 1
+            segments = np.lib.stride_tricks.sliding_window_view(data, self.psd_segment, axis=1)[:, :num_segments * self._psd_step:self._psd_step]
+            segments = (segments - segments.mean(axis=2, keepdims=True)) * self._window
+            periodograms = np.square(np.abs(np.fft.rfft(segments, axis=2))).sum(axis=1)
+
+        with self._lock:
+            total = self.count + num_samples
+            delta = block_mean - self._mean
+            self._mean += delta * (num_samples / total)
+            self._m2 += block_m2 + np.square(delta) * (self.count * num_samples / total)
+            self.count = total
+            np.minimum(self._minimum, block.min(axis=1), out=self._minimum)
+            np.maximum(self._maximum, block.max(axis=1), out=self._maximum)
+
+            if num_segments:
+                self._psd_sum += periodograms
+                self.psd_segments += num_segments
+                self._carry = data[:, num_segments * self._psd_step:].copy()
+            else:
+                self._carry = data
+
+    def psd(self):
+        """
+            This function returns the current Welch estimate of the power spectral density as a tuple
+            (frequencies, density). frequencies is an array in Hz, and density is an array of shape
+            (num_channels, len(frequencies)) in V**2/Hz. density is None before the first segment is complete.
+        """
+        frequencies = np.fft.rfftfreq(self.psd_segment, d=1.0 / self.sample_rate)
+        with self._lock:
+            if self.psd_segments == 0:
+                return frequencies, None
+            density = self._psd_sum * (self._psd_scale / self.psd_segments)
+
+        # One-sided spectrum: every frequency except DC (and Nyquist for an even segment length) appears twice
+        last = -1 if self.psd_segment % 2 == 0 else None
+        density[:, 1:last] *= 2
+        return frequencies, density
+
+    def snapshot(self):
+        """
+            This function returns the current statistics as a dictionary {channel name: {statistic: value}}.
+            It can be called at any time while the acquisition is running.
+        """
+        with self._lock:
+            count = self.count
+            mean = self._mean.copy()
+            variance = self._m2 / count if count else np.full(len(self.channel_names), np.nan)
+            minimum = self._minimum.copy()
+            maximum = self._maximum.copy()
+
+        rms = np.sqrt(variance + np.square(mean))
+        return {
+            name: {
+                "count": count,
+                "mean": float(mean[i]),
+                "std": float(np.sqrt(variance[i])),
+                "rms": float(rms[i]),
+                "min": float(minimum[i]),
+                "max": float(maximum[i]),
+                "peak_to_peak": float(maximum[i] - minimum[i]),
+            }
+            for i, name in enumerate(self.channel_names)
+        }
+
+    def write_summary(self, file_path):
+        """
+            This function writes the statistics and the PSD of every channel to a JSON file.
+
+            Arguments:
+                        file_path: A string with the path of the JSON file to create.
+        """
+        frequencies, density = self.psd()
+        summary = {
+            "sample_rate": self.sample_rate,
+            "channels": self.snapshot(),
+            "psd": {
+                "segment_length": self.psd_segment,
+                "segments": self.psd_segments,
+                "frequencies": frequencies.tolist(),
+                "density": None if density is None else dict(zip(self.channel_names, density.tolist())),
+            },
+        }
+        with open(file_path, "w") as f:
+            json.dump(summary, f, indent=2)
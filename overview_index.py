@@ -0,0 +1,284 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class _OverviewLevel:
+
+    # The min/max/mean summaries of one level of the pyramid, in arrays that grow by doubling
+
+    def __init__(self, factor, num_channels, dtype=np.float32):
+        self.factor = factor
+        self.size = 0
+        self.mins = np.empty((1024, num_channels), dtype=dtype)
+        self.maxs = np.empty((1024, num_channels), dtype=dtype)
+        self.means = np.empty((1024, num_channels), dtype=dtype)
+
+    def append(self, mins, maxs, means):
+        end = self.size + len(mins)
+        if end > len(self.mins):
+            capacity = max(end, 2 * len(self.mins))
+            for name in ("mins", "maxs", "means"):
+                grown = np.empty((capacity, self.mins.shape[1]), dtype=self.mins.dtype)
+                grown[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, grown)
+        self.mins[self.size:end] = mins
+        self.maxs[self.size:end] = maxs
+        self.means[self.size:end] = means
+        self.size = end
+
+
+class OverviewPyramid:
+
+    """
+        This class maintains a multi-resolution (mipmap) overview of a recording while it is being written. Every level
+        of the pyramid summarises the channels in bins of a fixed number of samples (the factors, e.g. 1:64, 1:4096 and
+        1:262144) with the minimum, the maximum and the mean of every bin. The first level is computed from the acquired
+        batches, and every other level from the bins of the level below it, so updating the pyramid costs about one pass
+        over the new samples.
+
+        The pyramid is saved next to the recording with save(), and OverviewViewer uses it to draw any time window of
+        the recording with a few thousand points, however long the recording is.
+
+        Arguments:
+                    channel_names: A list of strings with the names of the channels.
+                    sample_rate: A float with the sample rate in samples per second.
+                    factors: A tuple of increasing bin sizes, each one a multiple of the previous one.
+                             Defaults to (64, 4096, 262144).
+    """
+
+    def __init__(self, channel_names, sample_rate, factors=(64, 4096, 262144)):
+        factors = [int(factor) for factor in factors]
+        for finer, coarser in zip(factors, factors[1:]):
+            if coarser <= finer or coarser % finer:
+                raise ValueError("every factor must be a larger multiple of the previous one")
+
+        self.channel_names = list(channel_names)
+        self.sample_rate = float(sample_rate)
+        self.levels = [_OverviewLevel(factor, len(self.channel_names)) for factor in factors]
+        self.total_samples = 0
+        self.finished = False
+
+        # Bin of the first level which is still being filled
+        num_channels = len(self.channel_names)
+        self._partial_sum = np.zeros(num_channels)
+        self._partial_min = np.full(num_channels, np.inf)
+        self._partial_max = np.full(num_channels, -np.inf)
+        self._partial_count = 0
+        self._lock = threading.Lock()
+
+    def _add_to_partial_bin(self, chunk):
+        self._partial_sum += chunk.sum(axis=1)
+        np.minimum(self._partial_min, chunk.min(axis=1), out=self._partial_min)
+        np.maximum(self._partial_max, chunk.max(axis=1), out=self._partial_max)
+        self._partial_count += chunk.shape[1]
+        if self._partial_count == self.levels[0].factor:
+            self._flush_partial_bin()
+
+    def _flush_partial_bin(self):
+        self.levels[0].append(self._partial_min[np.newaxis], self._partial_max[np.newaxis],
+                              (self._partial_sum / self._partial_count)[np.newaxis])
+        self._partial_sum.fill(0)
+        self._partial_min.fill(np.inf)
+        self._partial_max.fill(-np.inf)
+        self._partial_count = 0
+
+    def _propagate(self, final=False):
+        # Build the bins of every coarser level from the finished bins of the level below it
+        for finer, coarser in zip(self.levels, self.levels[1:]):
+            ratio = coarser.factor // finer.factor
+            first = coarser.size * ratio
+            num_bins = (finer.size - first) // ratio
+            if num_bins:
+                end = first + num_bins * ratio
+                shape = (num_bins, ratio, finer.mins.shape[1])
+                coarser.append(finer.mins[first:end].reshape(shape).min(axis=1),
+                               finer.maxs[first:end].reshape(shape).max(axis=1),
+                               finer.means[first:end].reshape(shape).mean(axis=1))
+                first = end
+
+            if final and first < finer.size:
+                # The last, incomplete bin: its mean is weighted by the number of samples in every finer bin
+                weights = np.full(finer.size - first, float(finer.factor))
+                weights[-1] = self.total_samples - (finer.size - 1) * finer.factor
+                coarser.append(finer.mins[first:finer.size].min(axis=0)[np.newaxis],
+                               finer.maxs[first:finer.size].max(axis=0)[np.newaxis],
+                               np.average(finer.means[first:finer.size], axis=0, weights=weights)[np.newaxis])
+
+    def update(self, block):
+        """
+            This function adds a batch to the pyramid.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples).
+        """
+        block = np.asarray(block).reshape(len(self.channel_names), -1)
+        num_samples = block.shape[1]
+        factor = self.levels[0].factor
+        position = 0
+
+        with self._lock:
+            if self._partial_count and num_samples:
+                position = min(factor - self._partial_count, num_samples)
+                self._add_to_partial_bin(block[:, :position])
+
+            num_full_bins = (num_samples - position) // factor
+            if num_full_bins:
+                end = position + num_full_bins * factor
+                bins = block[:, position:end].reshape(block.shape[0], num_full_bins, factor)
+                self.levels[0].append(bins.min(axis=2).T, bins.max(axis=2).T, bins.mean(axis=2).T)
+                position = end
+
+            if position < num_samples:
+                self._add_to_partial_bin(block[:, position:])
+
+            self.total_samples += num_samples
+            self._propagate()
+
+    def finish(self):
+        """
+            This function closes the last, incomplete bin of every level. Call it once after the last batch.
+        """
+        with self._lock:
+            if self.finished:
+                return
+            if self._partial_count:
+                self._flush_partial_bin()
+            self._propagate(final=True)
+            self.finished = True
+
+    def save(self, file_path):
+        """
+            This function finishes the pyramid and saves it as a NumPy .npz file.
+
+            Arguments:
+                        file_path: A string with the path of the file to create (e.g. 'run.overview.npz').
+        """
+        self.finish()
+        arrays = {}
+        for index, level in enumerate(self.levels):
+            arrays[f"level{index}_min"] = level.mins[:level.size]
+            arrays[f"level{index}_max"] = level.maxs[:level.size]
+            arrays[f"level{index}_mean"] = level.means[:level.size]
+        metadata = {
+            "channel_names": self.channel_names,
+            "sample_rate": self.sample_rate,
+            "factors": [level.factor for level in self.levels],
+            "total_samples": self.total_samples,
+        }
+        with open(file_path, "wb") as f:
+            np.savez(f, metadata=np.array(json.dumps(metadata)), **arrays)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+            This function loads a pyramid saved with save().
+        """
+        with np.load(file_path) as data:
+            metadata = json.loads(str(data["metadata"]))
+            pyramid = cls(metadata["channel_names"], metadata["sample_rate"], metadata["factors"])
+            for index, level in enumerate(pyramid.levels):
+                level.mins = data[f"level{index}_min"]
+                level.maxs = data[f"level{index}_max"]
+                level.means = data[f"level{index}_mean"]
+                level.size = len(level.mins)
+        pyramid.total_samples = metadata["total_samples"]
+        pyramid.finished = True
+        return pyramid
+
+
+def overview_path(recording_path):
+    """
+        This function returns the path of the overview file which belongs to a recording, e.g. 'run.overview.npz' for
+        'run.bin'.
+    """
+    return os.path.splitext(recording_path.rstrip("/\\"))[0] + ".overview.npz"
+
+
+class OverviewViewer:
+
+    """
+        This class returns what is needed to draw any time window of a recording, from the whole recording down to a
+        few samples, in about the same time. It picks the coarsest level of the pyramid which still has at least one bin
+        per pixel in the window, so it never touches more than about 64 bins per pixel. When even the finest level is
+        too coarse, the samples are read from the recording itself (only the samples of the window, e.g. through the
+        memory map of a BinaryRecording or the chunks of an HDF5 or Zarr recording).
+
+        Arguments:
+                    pyramid: The OverviewPyramid of the recording.
+                    raw: An optional object with a volts(start, stop) function which returns the samples of the recording
+                         as an array of shape (samples, channels), e.g. a recording.BinaryRecording.
+    """
+
+    def __init__(self, pyramid, raw=None):
+        self.pyramid = pyramid
+        self.raw = raw
+
+    @classmethod
+    def open(cls, recording_path):
+        """
+            This function opens the overview of a recording, and the recording itself for the windows which need the
+            samples (see recording.open_recording): '.bin', '.seg', '.h5'/'.hdf5' and '.zarr' recordings. A CSV file is
+            not opened, since a window in the middle of it can only be found by parsing the file up to it; such windows
+            are drawn from the finest level of the pyramid (64 samples per point) instead.
+        """
+        from recording import open_recording
+
+        pyramid = OverviewPyramid.load(overview_path(recording_path))
+        return cls(pyramid, open_recording(recording_path))
+
+    def view(self, start_time, stop_time, pixel_width):
+        """
+            This function returns the data to draw the window [start_time, stop_time) of the recording on pixel_width
+            pixels.
+
+            Arguments:
+                        start_time: A float with the start of the window in seconds since the start of the recording.
+                        stop_time: A float with the end of the window in seconds since the start of the recording.
+                        pixel_width: An integer with the width of the plot in pixels.
+
+            It returns a dictionary with:
+                'factor': the number of samples summarised by every point (1 when the samples are returned),
+                'time':   an array with the time of every point in seconds,
+                'min', 'max', 'mean': arrays of shape (points, channels).
+        """
+        rate = self.pyramid.sample_rate
+        start = max(int(np.floor(start_time * rate)), 0)
+        stop = min(int(np.ceil(stop_time * rate)), self.pyramid.total_samples)
+        stop = max(stop, start)
+        num_samples = stop - start
+
+        # Coarsest level with at least one bin per pixel
+        level = None
+        for candidate in self.pyramid.levels:
+            if num_samples // candidate.factor >= pixel_width:
+                level = candidate
+
+        if level is None and self.raw is not None:
+            samples = np.asarray(self.raw.volts(start, stop))
+            return {"factor": 1, "time": np.arange(start, stop) / rate, "min": samples, "max": samples, "mean": samples}
+        if level is None:
+            level = self.pyramid.levels[0]
+
+        first = start // level.factor
+        last = min(-(-stop // level.factor), level.size)
+        mins = level.mins[first:last]
+        maxs = level.maxs[first:last]
+        means = level.means[first:last]
+        factor = level.factor
+
+        # The coarsest level can still have many bins per pixel for very long windows: combine them to one per pixel
+        group = len(mins) // pixel_width
+        if group > 1:
+            edges = np.arange(0, len(mins), group)
+            mins = np.minimum.reduceat(mins, edges, axis=0)
+            maxs = np.maximum.reduceat(maxs, edges, axis=0)
+            means = np.add.reduceat(means, edges, axis=0) / np.diff(np.append(edges, last - first))[:, np.newaxis]
+            factor *= group
+            time = (first + edges) * level.factor / rate
+        else:
+            time = np.arange(first, last) * level.factor / rate
+
+        return {"factor": factor, "time": time, "min": mins, "max": maxs, "mean": means}
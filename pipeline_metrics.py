@@ -0,0 +1,291 @@
+import bisect
+import contextlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Upper bounds of the histogram buckets in seconds, 1-2.5-5 per decade from 10 microseconds to 10 seconds
+DEFAULT_BUCKETS = tuple(mantissa * 10.0 ** exponent for exponent in range(-5, 1) for mantissa in (1.0, 2.5, 5.0)) + (10.0,)
+
+
+class LatencyHistogram:
+
+    """
+        This class counts durations in fixed buckets, like a Prometheus histogram. Recording a duration is a binary
+        search and an increment, so it can be done for every batch; the mean, the maximum and approximate quantiles are
+        computed from the buckets when they are asked for.
+
+        Arguments:
+                    buckets: A sorted sequence with the upper bound of every bucket in seconds. Defaults to DEFAULT_BUCKETS.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)     # The last bucket holds the durations above the largest bound
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        """
+            This function adds one duration, in seconds, to the histogram.
+        """
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q):
+        """
+            This function returns the upper bound of the bucket which holds the q-quantile (e.g. 0.99), or the largest
+            duration when it is above all the buckets. It returns 0 when nothing has been recorded.
+        """
+        with self._lock:
+            counts, count, maximum = list(self.counts), self.count, self.max
+        if count == 0:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return min(bound, maximum)
+        return maximum
+
+    def summary(self):
+        """
+            This function returns a dictionary with the count, the mean, the median, the 99th percentile and the maximum.
+        """
+        with self._lock:
+            count, total, maximum = self.count, self.sum, self.max
+        return {
+            "count": count,
+            "mean": total / count if count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": maximum,
+        }
+
+
+class PipelineMetrics:
+
+    """
+        This class collects the live metrics of the acquisition and makes them available while it runs, so that a long
+        run which falls behind shows where the time goes.
+
+        It keeps three kinds of metrics:
+            stage timings: a LatencyHistogram per stage, e.g. 'read' (waiting for the next batch from the driver),
+                           'convert' (filtering and decimation), 'write' (the writer thread writing to the file),
+                           'render' (a frame of the live plot) and one per stage of the pipeline.
+            gauges:        current values such as the backlog of the driver or the depth of the writer queue. A gauge is
+                           either set with set_gauge() or given as a function with add_gauge(), which is only called when
+                           the metrics are read, so it costs nothing during the acquisition.
+            counters:      totals which only grow, e.g. the number of batches and samples.
+
+        The metrics can be served over HTTP in the Prometheus text format (GET /metrics, and GET /metrics.json for the
+        same values as JSON) and/or appended to a file as one JSON line every log_interval seconds.
+
+        The acquisition only collects metrics when it is given a PipelineMetrics, so they cost nothing when they are
+        not used.
+
+        Arguments:
+                    http_address: An optional tuple (host, port) to serve the metrics on. Port 0 picks a free port (see address).
+                    log_path: An optional string with the path of the JSON lines file.
+                    log_interval: A float with the time between two lines of the log in seconds. Defaults to 10.
+                    prefix: A string put in front of the name of every metric. Defaults to 'pxi6284'.
+    """
+
+    def __init__(self, http_address=None, log_path=None, log_interval=10.0, prefix="pxi6284"):
+        self.prefix = prefix
+        self.log_path = log_path
+        self.log_interval = float(log_interval)
+        self.histograms = {}
+        self.counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+        self._server = None
+        if http_address is not None:
+            self._server = ThreadingHTTPServer(http_address, self._make_handler())
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name="PipelineMetricsHTTP", daemon=True).start()
+
+        self._log_thread = None
+        if log_path is not None:
+            self._log_thread = threading.Thread(target=self._log_periodically, name="PipelineMetricsLog", daemon=True)
+            self._log_thread.start()
+
+    @property
+    def address(self):
+        """
+            The (host, port) the HTTP endpoint listens on, or None without an endpoint.
+        """
+        return self._server.server_address[:2] if self._server is not None else None
+
+    def histogram(self, stage):
+        """
+            This function returns the LatencyHistogram of a stage, creating it the first time.
+        """
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(stage, LatencyHistogram())
+        return histogram
+
+    def observe(self, stage, seconds):
+        """
+            This function records how long a stage took, in seconds.
+        """
+        self.histogram(stage).observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """
+            This function times the code of a with-block as one run of a stage:
+
+                with metrics.timer('write'):
+                    recorder.write(block)
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        self._gauges[name] = value
+
+    def add_gauge(self, name, function):
+        """
+            This function registers a function without arguments which returns the current value of a gauge, e.g.
+            lambda: writer.queue_depth. It replaces an earlier gauge with the same name.
+        """
+        self._gauges[name] = function
+
+    def remove_gauge(self, name):
+        self._gauges.pop(name, None)
+
+    def gauges(self):
+        """
+            This function returns the current value of every gauge as a dictionary. Gauges whose function fails are
+            left out.
+        """
+        values = {}
+        for name, gauge in list(self._gauges.items()):
+            try:
+                values[name] = gauge() if callable(gauge) else gauge
+            except Exception:
+                continue
+        return values
+
+    def snapshot(self):
+        """
+            This function returns all the metrics as a dictionary which can be saved as JSON.
+        """
+        with self._lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+        return {
+            "time": time.time(),
+            "stages": {stage: histogram.summary() for stage, histogram in histograms.items()},
+            "gauges": self.gauges(),
+            "counters": counters,
+        }
+
+    def render_prometheus(self):
+        """
+            This function returns all the metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+        lines = []
+
+        name = f"{self.prefix}_stage_seconds"
+        lines.append(f"# HELP {name} Time spent in every stage of the acquisition pipeline.")
+        lines.append(f"# TYPE {name} histogram")
+        for stage, histogram in sorted(histograms.items()):
+            with histogram._lock:
+                counts, count, total = list(histogram.counts), histogram.count, histogram.sum
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total!r}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+        for counter, value in sorted(counters.items()):
+            lines.append(f"# TYPE {self.prefix}_{counter}_total counter")
+            lines.append(f"{self.prefix}_{counter}_total {value}")
+        for gauge, value in sorted(self.gauges().items()):
+            lines.append(f"# TYPE {self.prefix}_{gauge} gauge")
+            lines.append(f"{self.prefix}_{gauge} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+    def _make_handler(self):
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics.render_prometheus().encode()
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(metrics.snapshot()).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes are frequent; do not print a line for every one of them
+                pass
+
+        return MetricsHandler
+
+    def write_log_line(self):
+        """
+            This function appends the current metrics to the log file as one JSON line.
+        """
+        with open(self.log_path, "a") as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+
+    def _log_periodically(self):
+        while not self._closed.wait(self.log_interval):
+            self.write_log_line()
+
+    def close(self):
+        """
+            This function stops the HTTP endpoint and writes a last line to the log.
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self._log_thread is not None:
+            self._log_thread.join()
+            self.write_log_line()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,135 @@
+import threading
+
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+
+# Largest number of points drawn per frame over all the channels. The time Matplotlib needs to render a frame grows with
+# the number of points (and with how far the lines jump between them), so a fixed budget keeps 32 channels within a
+# frame of 33 ms where 32 lines of 1500 points take several times as long
+DEFAULT_POINT_BUDGET = 8000
+
+
+def envelope_bins(num_channels, pixel_width=800, point_budget=DEFAULT_POINT_BUDGET):
+    """
+        This function returns the number of min/max bins per channel of a live plot: one per pixel, but no more than
+        fit in the point budget of a frame (every bin is drawn as 2 points).
+
+        Arguments:
+                    num_channels: An integer with the number of channels drawn.
+                    pixel_width: An integer with the approximate width of the plot in pixels. Defaults to 800.
+                    point_budget: An integer with the largest number of points drawn per frame. Defaults to DEFAULT_POINT_BUDGET.
+    """
+    return max(1, min(int(pixel_width), int(point_budget) // (2 * max(1, int(num_channels)))))
+
+
+class MinMaxDecimator:
+
+    """
+        This class reduces the newest samples of every channel to a min/max envelope that can be drawn in constant time,
+        however wide the visible window is. The window is divided into bins of bin_size consecutive samples and every
+        bin is drawn as two points, its minimum and its maximum. With one bin per horizontal pixel that is about 2 points
+        per pixel, and a spike inside a bin still shows up because it is the minimum or maximum of its bin.
+
+        The envelope is updated incrementally: update() reduces only the new batch (vectorized over all bins and
+        channels) and appends the finished bins to ring buffers, so nothing is recomputed when the window scrolls.
+
+        Arguments:
+                    num_channels: An integer with the number of channels.
+                    window: An integer with the number of samples per channel covered by the envelope.
+                    pixel_width: An integer with the approximate width of the plot in pixels, i.e. the number of bins.
+    """
+
+    def __init__(self, num_channels, window, pixel_width=800):
+        self.num_channels = int(num_channels)
+        self.bin_size = max(1, -(-int(window) // int(pixel_width)))   # Ceiling division
+        self.num_bins = -(-int(window) // self.bin_size)
+        self.total_samples = 0
+
+        self._mins = RingBuffer(self.num_bins, self.num_channels)
+        self._maxs = RingBuffer(self.num_bins, self.num_channels)
+
+        # Minimum and maximum of the bin which is still being filled
+        self._partial_min = np.full(self.num_channels, np.inf)
+        self._partial_max = np.full(self.num_channels, -np.inf)
+        self._partial_count = 0
+        self._lock = threading.Lock()
+
+    def _add_to_partial_bin(self, chunk):
+        np.minimum(self._partial_min, chunk.min(axis=1), out=self._partial_min)
+        np.maximum(self._partial_max, chunk.max(axis=1), out=self._partial_max)
+        self._partial_count += chunk.shape[1]
+
+        if self._partial_count == self.bin_size:
+            self._mins.write(self._partial_min[:, np.newaxis])
+            self._maxs.write(self._partial_max[:, np.newaxis])
+            self._partial_min.fill(np.inf)
+            self._partial_max.fill(-np.inf)
+            self._partial_count = 0
+
+    def update(self, block):
+        """
+            This function adds a new batch to the envelope.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples).
+        """
+        block = np.asarray(block).reshape(self.num_channels, -1)
+        num_samples = block.shape[1]
+        position = 0
+
+        with self._lock:
+            # First complete the bin left unfinished by the previous batch
+            if self._partial_count and num_samples:
+                position = min(self.bin_size - self._partial_count, num_samples)
+                self._add_to_partial_bin(block[:, :position])
+
+            # Reduce all the complete bins of the batch at once
+            num_full_bins = (num_samples - position) // self.bin_size
+            if num_full_bins:
+                end = position + num_full_bins * self.bin_size
+                bins = block[:, position:end].reshape(self.num_channels, num_full_bins, self.bin_size)
+                self._mins.write(bins.min(axis=2))
+                self._maxs.write(bins.max(axis=2))
+                position = end
+
+            # Keep the rest for the next batch
+            if position < num_samples:
+                self._add_to_partial_bin(block[:, position:])
+
+            self.total_samples += num_samples
+
+    def envelope(self):
+        """
+            This function returns the current envelope as a tuple (x, y).
+            x is an array with the running sample index of every point, and y is an array of shape (points, num_channels)
+            in which the minimum and the maximum of every bin follow each other. The unfinished newest bin is included, so
+            the envelope is never behind the acquisition by more than one batch.
+        """
+        with self._lock:
+            first_bin, mins = self._mins.latest()
+            _, maxs = self._maxs.latest()
+            num_bins = len(mins) + (1 if self._partial_count else 0)
+
+            y = np.empty((2 * num_bins, self.num_channels))
+            y[0:2 * len(mins):2] = mins
+            y[1:2 * len(mins):2] = maxs
+            if self._partial_count:
+                y[-2] = self._partial_min
+                y[-1] = self._partial_max
+
+        x = np.repeat((first_bin + np.arange(num_bins)) * self.bin_size, 2)
+        return x, y
+
+    def clear(self):
+        """
+            This function empties the envelope so that it can be reused for a new acquisition.
+        """
+        with self._lock:
+            self._mins.clear()
+            self._maxs.clear()
+            self._partial_min.fill(np.inf)
+            self._partial_max.fill(-np.inf)
+            self._partial_count = 0
+            self.total_samples = 0
@@ -1,4 +1,58 @@
-import nidaqmx
+import numpy as np
+
+
+class NidaqmxBackend:
+
+    """
+        This class is the backend used by PXI6284Controller and the acquisition scripts to talk to real NI hardware.
+        It creates nidaqmx tasks and the stream readers that belong to them.
+
+        The nidaqmx library is only imported when a backend is created, so the scripts can also be used with the
+        simulated backend (see simulated_daq.py) on a computer where nidaqmx is not installed.
+    """
+
+    def __init__(self):
+        import nidaqmx
+        import nidaqmx.constants
+        import nidaqmx.stream_readers
+        import nidaqmx.stream_writers
+
+        self._nidaqmx = nidaqmx
+        self.constants = nidaqmx.constants
+
+    def create_task(self):
+        """
+            This function creates a new NI-DAQmx task.
+        """
+        return self._nidaqmx.Task()
+
+    def analog_reader(self, task):
+        """
+            This function returns an AnalogMultiChannelReader which reads the scaled voltages of the task into NumPy arrays.
+        """
+        return self._nidaqmx.stream_readers.AnalogMultiChannelReader(task.in_stream)
+
+    def unscaled_reader(self, task):
+        """
+            This function returns an AnalogUnscaledReader which reads the raw int16 ADC codes of the task into NumPy arrays.
+        """
+        return self._nidaqmx.stream_readers.AnalogUnscaledReader(task.in_stream)
+
+    def analog_writer(self, task):
+        """
+            This function returns an AnalogMultiChannelWriter which writes NumPy arrays of voltages to the output buffer of the task.
+        """
+        return self._nidaqmx.stream_writers.AnalogMultiChannelWriter(task.out_stream, auto_start=False)
+
+    def digital_writer(self, task):
+        """
+            This function returns a DigitalMultiChannelWriter which writes NumPy arrays of port values to the output buffer of the task.
+        """
+        return self._nidaqmx.stream_writers.DigitalMultiChannelWriter(task.out_stream, auto_start=False)
+
+
+
+
 
 class PXI6284Controller:
 
@@ -14,9 +68,30 @@ class PXI6284Controller:
     
     """
 
-    def __init__(self):
-        # Initialize a new NI-DAQmx task
-        self.task = nidaqmx.Task()
+    def __init__(self, backend=None, task=None):
+        '''
+            Arguments:
+
+                backend: The object that creates the task and its stream readers. Defaults to NidaqmxBackend, which talks to
+                         the real hardware. Pass a simulated_daq.SimulatedBackend to run without a PXI chassis.
+                task: An optional task which is already configured, e.g. one from task_pool.TaskPool.acquire(). The
+                      controller then uses it instead of creating a new one, and does not close it: it belongs to
+                      whoever created it (give a pooled task back with TaskPool.release()).
+        '''
+        self.backend = backend if backend is not None else NidaqmxBackend()
+
+        # Initialize a new NI-DAQmx task, unless a configured one was given
+        self._owns_task = task is None
+        self.task = task if task is not None else self.backend.create_task()
+
+        # Stream readers are created on the first read_into/read_unscaled_into call, after the channels have been added
+        self._analog_reader = None
+        self._unscaled_reader = None
+
+        # Stream writers of the buffered waveform generation, created the same way
+        self._analog_writer = None
+        self._digital_writer = None
+        self._stream_writer = None
 
     def initialize_ai_voltage_channel(self, channel_name):
         '''
@@ -108,6 +183,50 @@ class PXI6284Controller:
                         num_samples: An integer specifying the number of samples to read from the analog or digital input channel.
         """
         return self.task.read(number_of_samples_per_channel=num_samples)
+
+
+
+
+
+    def read_into(self, buffer, timeout=10.0):
+        """
+            This function reads acquired data from the analog input channels directly into an array that you provide.
+            Unlike read_data, it does not create a Python float for every sample, so you can allocate the array once and
+            reuse it for every batch of a long acquisition. It uses AnalogMultiChannelReader.read_many_sample from the
+            nidaqmx.stream_readers module.
+
+            Arguments:
+                        buffer: A C-contiguous NumPy float64 array of shape (number of channels, number of samples). The number
+                                of samples to read is taken from the second dimension of the array.
+                        timeout: A float specifying how many seconds to wait for the samples before raising an error.
+
+            It returns the number of samples per channel that were read into the buffer.
+        """
+        if self._analog_reader is None:
+            self._analog_reader = self.backend.analog_reader(self.task)
+        return self._analog_reader.read_many_sample(buffer, number_of_samples_per_channel=buffer.shape[1], timeout=timeout)
+
+
+
+
+
+    def read_unscaled_into(self, buffer, timeout=10.0):
+        """
+            This function reads the raw ADC codes of the analog input channels directly into an array that you provide.
+            The codes are stored as 16 bit integers, so a batch takes a quarter of the memory of read_into. The codes can be
+            converted to volts with the scaling coefficients of each channel (ai_dev_scaling_coeff in nidaqmx).
+            It uses AnalogUnscaledReader.read_int16 from the nidaqmx.stream_readers module.
+
+            Arguments:
+                        buffer: A C-contiguous NumPy int16 array of shape (number of channels, number of samples). The number
+                                of samples to read is taken from the second dimension of the array.
+                        timeout: A float specifying how many seconds to wait for the samples before raising an error.
+
+            It returns the number of samples per channel that were read into the buffer.
+        """
+        if self._unscaled_reader is None:
+            self._unscaled_reader = self.backend.unscaled_reader(self.task)
+        return self._unscaled_reader.read_int16(buffer, number_of_samples_per_channel=buffer.shape[1], timeout=timeout)
     
 
 
@@ -127,6 +246,140 @@ class PXI6284Controller:
 
 
 
+    def _configure_output_buffer(self, rate, num_samples, regenerate, continuous, source):
+        # Sample clock of the generation, and whether the driver may repeat the data of the buffer
+        constants = self.backend.constants
+        sample_mode = constants.AcquisitionType.CONTINUOUS if continuous else constants.AcquisitionType.FINITE
+        self.task.timing.cfg_samp_clk_timing(rate=rate, source=source, sample_mode=sample_mode, samps_per_chan=num_samples)
+        self.task.out_stream.regen_mode = (constants.RegenerationMode.ALLOW_REGENERATION if regenerate
+                                           else constants.RegenerationMode.DONT_ALLOW_REGENERATION)
+        self.task.out_stream.output_buf_size = num_samples
+
+    def _write_waveform_block(self, block, digital, timeout):
+        if digital:
+            if self._digital_writer is None:
+                self._digital_writer = self.backend.digital_writer(self.task)
+            return self._digital_writer.write_many_sample_port_uint32(block, timeout=timeout)
+        if self._analog_writer is None:
+            self._analog_writer = self.backend.analog_writer(self.task)
+        return self._analog_writer.write_many_sample(block, timeout=timeout)
+
+
+
+
+
+    def write_analog_waveform(self, waveform, rate, regenerate=True, continuous=True, source="", timeout=10.0):
+        """
+            This function uploads a waveform to the output buffer of the analog output channels, so that it is generated
+            at the hardware sample rate without any Python code running per sample (unlike write_data, which writes one
+            software-timed value or list). It uses AnalogMultiChannelWriter.write_many_sample from the
+            nidaqmx.stream_writers module. Call start_task() to start the generation and stop_task() to end it.
+
+            With regenerate=True and continuous=True the card repeats the waveform from its buffer until the task is
+            stopped (e.g. a periodic stimulus), so it is uploaded only once. With continuous=False the waveform is
+            generated once and the task is done after its last sample.
+
+            Arguments:
+                        waveform: A NumPy array of voltages of shape (number of channels, number of samples), or a 1D array
+                                  for a single channel.
+                        rate: A float with the sample rate of the generation in samples per second.
+                        regenerate: A boolean specifying whether the driver may repeat the buffer. Defaults to True.
+                        continuous: A boolean specifying continuous (True) or finite (False) generation. Defaults to True.
+                        source: A string with the terminal of the sample clock. Defaults to '' (the onboard clock).
+                        timeout: A float specifying how many seconds to wait for space in the buffer.
+
+            It returns the number of samples per channel that were written.
+        """
+        waveform = np.ascontiguousarray(waveform, dtype=np.float64).reshape(len(self.task.ao_channels.channel_names), -1)
+        self._configure_output_buffer(rate, waveform.shape[1], regenerate, continuous, source)
+        return self._write_waveform_block(waveform, digital=False, timeout=timeout)
+
+
+
+
+
+    def write_digital_waveform(self, pattern, rate, regenerate=True, continuous=True, source="", timeout=10.0):
+        """
+            This function uploads a digital pattern to the output buffer of the digital output channels, so that it is
+            clocked out at the hardware sample rate. It uses DigitalMultiChannelWriter.write_many_sample_port_uint32 from
+            the nidaqmx.stream_writers module, so the channels have to be whole ports (e.g. 'Dev1/port0') and every value
+            holds the states of all the lines of a port (bit n is line n). Call start_task() to start the generation.
+
+            The digital lines of the PXIe-6284 have no sample clock of their own: use the clock of another task of the
+            card as source, e.g. '/Dev1/ai/SampleClock' while an analog input task is running.
+
+            Arguments:
+                        pattern: A NumPy array of port values of shape (number of channels, number of samples), or a 1D array
+                                 for a single port.
+                        rate: A float with the sample rate of the generation in samples per second.
+                        regenerate: A boolean specifying whether the driver may repeat the buffer. Defaults to True.
+                        continuous: A boolean specifying continuous (True) or finite (False) generation. Defaults to True.
+                        source: A string with the terminal of the sample clock.
+                        timeout: A float specifying how many seconds to wait for space in the buffer.
+
+            It returns the number of samples per channel that were written.
+        """
+        pattern = np.ascontiguousarray(pattern, dtype=np.uint32).reshape(len(self.task.do_channels.channel_names), -1)
+        self._configure_output_buffer(rate, pattern.shape[1], regenerate, continuous, source)
+        return self._write_waveform_block(pattern, digital=True, timeout=timeout)
+
+
+
+
+
+    def start_waveform_stream(self, first_blocks, rate, digital=False, source="", timeout=10.0):
+        """
+            This function starts a streaming generation, for waveforms which are too long for the output buffer or are
+            computed while they are generated. Regeneration is turned off and the buffer holds len(first_blocks) blocks
+            (at least two): they are written before the task is started, and every later block is given to
+            write_next_block(), which waits until the card has generated one block and its space is free again. With two
+            blocks this is double buffering: the card outputs one half of the buffer while Python fills the other.
+
+            Arguments:
+                        first_blocks: A list of at least two arrays of shape (number of channels, block size), voltages
+                                      (float64) for analog channels or port values (uint32) for digital channels.
+                        rate: A float with the sample rate of the generation in samples per second.
+                        digital: A boolean specifying whether the task has digital (True) or analog (False) output channels.
+                        source: A string with the terminal of the sample clock. Defaults to '' (the onboard clock).
+                        timeout: A float specifying how many seconds to wait for space in the buffer.
+        """
+        if len(first_blocks) < 2:
+            raise ValueError("a waveform stream needs at least two blocks in the buffer")
+        dtype = np.uint32 if digital else np.float64
+        channels = self.task.do_channels if digital else self.task.ao_channels
+        blocks = [np.ascontiguousarray(block, dtype=dtype).reshape(len(channels.channel_names), -1) for block in first_blocks]
+
+        self._configure_output_buffer(rate, sum(block.shape[1] for block in blocks), False, True, source)
+        for block in blocks:
+            self._write_waveform_block(block, digital, timeout)
+        self._stream_writer = (digital, dtype, len(channels.channel_names))
+        self.task.start()
+
+
+
+
+
+    def write_next_block(self, block, timeout=10.0):
+        """
+            This function writes the next block of a generation started with start_waveform_stream. It waits until there
+            is space for the block in the output buffer, which paces the loop that computes the blocks at the sample rate.
+
+            Arguments:
+                        block: An array of shape (number of channels, block size).
+                        timeout: A float specifying how many seconds to wait for space in the buffer.
+
+            It returns the number of samples per channel that were written.
+        """
+        if self._stream_writer is None:
+            raise RuntimeError("start_waveform_stream has to be called before write_next_block")
+        digital, dtype, num_channels = self._stream_writer
+        block = np.ascontiguousarray(block, dtype=dtype).reshape(num_channels, -1)
+        return self._write_waveform_block(block, digital, timeout)
+
+
+
+
+
     def configure_sample_clock_timing(self, rate, active_edge):
         """
             This function configures the sample clock timing for the task.
@@ -235,6 +488,42 @@ class PXI6284Controller:
 
 
 
+    def configure_analog_edge_reference_trigger(self, trigger_source, edge, level, pretrigger_samples):
+        """
+            This function configures an analog edge reference trigger for a finite acquisition. The card acquires
+            continuously into its buffer and keeps the last pretrigger_samples samples; when the trigger source crosses
+            the level with the given slope, it acquires the remaining samples (samps_per_chan of the timing minus
+            pretrigger_samples) and stops. The trigger is evaluated by the hardware, so it never misses an event between
+            two reads. triggered_capture.TriggeredCapture does the same in software on a continuous stream.
+
+            Arguments:
+                        trigger_source: A string with the name of the trigger source, e.g. 'APFI0' or an analog input channel of the task.
+                        edge: A value from the nidaqmx.constants.Slope enumeration indicating the trigger slope (rising or falling).
+                        level: A float specifying the voltage threshold for the trigger.
+                        pretrigger_samples: An integer with the number of samples per channel to keep before the trigger.
+        """
+        self.task.triggers.reference_trigger.cfg_anlg_edge_ref_trig(trigger_source, pretrigger_samples, trigger_slope=edge, trigger_level=level)
+
+
+
+
+
+    def configure_digital_edge_reference_trigger(self, trigger_source, edge, pretrigger_samples):
+        """
+            This function configures a digital edge reference trigger for a finite acquisition, like
+            configure_analog_edge_reference_trigger but on the edge of a digital signal.
+
+            Arguments:
+                        trigger_source: A string with the name of the trigger terminal, e.g. '/Dev1/PFI0'.
+                        edge: A value from the nidaqmx.constants.Edge enumeration indicating the triggering edge.
+                        pretrigger_samples: An integer with the number of samples per channel to keep before the trigger.
+        """
+        self.task.triggers.reference_trigger.cfg_dig_edge_ref_trig(trigger_source, pretrigger_samples, trigger_edge=edge)
+
+
+
+
+
     def configure_digital_pattern_start_trigger(self, trigger_source, pattern, condition):
         """
             This function configures a digital pattern start trigger for the task.
@@ -267,7 +556,8 @@ class PXI6284Controller:
             It is a special method in Python classes that is automatically called when an object is about to be destroyed and garbage collected. In the context of the PXI6284Controller class, the __del__ method is used to clean up and release system resources associated with the NI-DAQmx task.
         
         """
-        self.task.close()
+        if self._owns_task:
+            self.task.close()
 
 
 
@@ -345,48 +635,49 @@ class PXI6284Controller:
 # # Stop the task after the plot is closed
 # controller.stop_task()
 
-desired_num_data_points = 1000
+if __name__ == "__main__":
+    desired_num_data_points = 1000
 
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FuncAnimation
 
-controller = PXI6284Controller()
-controller.initialize_ai_voltage_channel("Dev1/ai5")
-controller.start_task()
+    controller = PXI6284Controller()
+    controller.initialize_ai_voltage_channel("Dev1/ai5")
+    controller.start_task()
 
-# Set up the figure and axes
-fig, ax = plt.subplots()
-line, = ax.plot([], [])
+    # Set up the figure and axes
+    fig, ax = plt.subplots()
+    line, = ax.plot([], [])
 
-# Initialize empty lists to store x and y data
-x_data, y_data = [], []
+    # Initialize empty lists to store x and y data
+    x_data, y_data = [], []
 
-# Define the update function for the animation
-def update(frame):
+    # Define the update function for the animation
+    def update(frame):
 
-    data = controller.read_data(10)
+        data = controller.read_data(10)
     
-    x_data.extend(range(len(x_data), len(x_data) + len(data)))
-    y_data.extend(data)
+        x_data.extend(range(len(x_data), len(x_data) + len(data)))
+        y_data.extend(data)
     
-    line.set_data(x_data, y_data)
+        line.set_data(x_data, y_data)
     
-    ax.set_xlim(min(x_data), max(x_data))
+        ax.set_xlim(min(x_data), max(x_data))
     
-    min_y = min(y_data)
-    max_y = max(y_data)
-    ax.set_ylim(min_y - (max_y - min_y) * 0.1, max_y + (max_y - min_y) * 0.1)
+        min_y = min(y_data)
+        max_y = max(y_data)
+        ax.set_ylim(min_y - (max_y - min_y) * 0.1, max_y + (max_y - min_y) * 0.1)
 
-    if len(x_data) >= desired_num_data_points:
-        controller.stop_task()
-        ani.event_source.stop()
+        if len(x_data) >= desired_num_data_points:
+            controller.stop_task()
+            ani.event_source.stop()
     
-    return line,
+        return line,
 
-# Create the animation
-ani = FuncAnimation(fig, update, frames=None, blit=True, interval=100, cache_frame_data=False)
+    # Create the animation
+    ani = FuncAnimation(fig, update, frames=None, blit=True, interval=100, cache_frame_data=False)
 
-# Show the plot
-plt.show()
+    # Show the plot
+    plt.show()
 
 
@@ -0,0 +1,582 @@
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+
+# Every binary recording starts with these 8 bytes, followed by the length of the JSON header as a little-endian uint32
+BINARY_MAGIC = b"PXIREC01"
+
+# The sample data starts at a multiple of this many bytes, so that memory-mapped reads are aligned
+BINARY_ALIGNMENT = 64
+
+
+class CsvRecorder:
+
+    """
+        This class writes the acquired batches to a CSV file with one column per channel, which is the format the
+        acquisition scripts have always produced. The file is opened once for the whole run instead of once per batch.
+
+        Arguments:
+                    file_path: A string with the path of the CSV file to create.
+                    channel_names: A list of strings used as the column headings (e.g. ['Dev1/ai0', 'Dev1/ai1']).
+    """
+
+    def __init__(self, file_path, channel_names):
+        import pandas as pd
+
+        self._pd = pd
+        self.file_path = file_path
+        self.channel_names = list(channel_names)
+        self.samples_written = 0
+        self._file = open(file_path, "w", newline="")
+
+        # Write the header to the CSV file only once
+        pd.DataFrame(columns=self.channel_names).to_csv(self._file, index=False)
+
+    def write(self, block):
+        """
+            This function appends one batch to the CSV file.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples) holding the batch to append.
+        """
+        block = np.asarray(block).reshape(len(self.channel_names), -1)
+        self._pd.DataFrame(block.T, columns=self.channel_names).to_csv(self._file, index=False, header=False)
+        self.samples_written += block.shape[1]
+
+    def close(self):
+        """
+            This function flushes and closes the CSV file.
+        """
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BinaryRecorder:
+
+    """
+        This class writes the acquired batches to a binary chunk file, which is much faster than formatting every sample
+        as text. The file starts with a small JSON header holding the channel names, the sample rate, the start time and
+        the sample format, and is followed by the samples stored row by row (one row per sample, one column per channel).
+
+        Two sample formats are supported:
+            'float64': the voltages exactly as they are returned by the DAQ (8 bytes per sample).
+            'int16':   the voltages scaled to 16 bit integers over +/- voltage_range (2 bytes per sample). The scale
+                       factor is stored in the header, so that the reader can convert them back to volts.
+
+        Every batch is copied into a preallocated buffer before it is written, so no memory is allocated per batch once
+        the buffer has reached the size of the largest batch.
+
+        Arguments:
+                    file_path: A string with the path of the binary file to create.
+                    channel_names: A list of strings with the names of the recorded channels.
+                    sample_rate: A float with the sample rate in samples per second.
+                    dtype: Either 'float64' (default) or 'int16'.
+                    voltage_range: A float with the full scale voltage used for the 'int16' format. Defaults to 10.0 V,
+                                   the largest input range of the PXIe-6284.
+                    start_time: The acquisition start time as a Unix timestamp. Defaults to the current time.
+    """
+
+    def __init__(self, file_path, channel_names, sample_rate, dtype="float64", voltage_range=10.0, start_time=None):
+        if dtype not in ("float64", "int16"):
+            raise ValueError("dtype must be 'float64' or 'int16'")
+
+        self.file_path = file_path
+        self.channel_names = list(channel_names)
+        self.sample_rate = float(sample_rate)
+        self.dtype = np.dtype(dtype)
+        self.samples_written = 0
+
+        header = {
+            "channel_names": self.channel_names,
+            "sample_rate": self.sample_rate,
+            "start_time": time.time() if start_time is None else float(start_time),
+            "dtype": self.dtype.name,
+            "scale": 1.0,
+        }
+        if self.dtype == np.int16:
+            # Volts per count, so that volts = counts * scale
+            header["scale"] = float(voltage_range) / np.iinfo(np.int16).max
+        self.header = header
+        self._inverse_scale = 1.0 / header["scale"]
+
+        self._file = open(file_path, "wb")
+        encoded_header = _encode_binary_header(header)
+        self._file.write(encoded_header)
+        self.data_offset = len(encoded_header)     # Position of the first sample in the file, in bytes
+
+        self._buffer = np.empty((0, len(self.channel_names)), dtype=self.dtype)
+        self._scratch = np.empty((0, len(self.channel_names)), dtype=np.float64)
+
+    def _reserve(self, num_samples):
+        # Grow the preallocated buffers only when a batch is larger than every batch before it
+        if num_samples > self._buffer.shape[0]:
+            self._buffer = np.empty((num_samples, len(self.channel_names)), dtype=self.dtype)
+            if self.dtype == np.int16:
+                self._scratch = np.empty((num_samples, len(self.channel_names)), dtype=np.float64)
+
+    def write(self, block):
+        """
+            This function appends one batch to the binary file.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples) holding the batch to append, in volts.
+        """
+        block = np.asarray(block).reshape(len(self.channel_names), -1)
+        num_samples = block.shape[1]
+        self._reserve(num_samples)
+        out = self._buffer[:num_samples]
+
+        if self.dtype == np.int16:
+            scratch = self._scratch[:num_samples]
+            np.multiply(block.T, self._inverse_scale, out=scratch)
+            np.rint(scratch, out=scratch)
+            np.clip(scratch, np.iinfo(np.int16).min, np.iinfo(np.int16).max, out=scratch)
+            np.copyto(out, scratch, casting="unsafe")
+        else:
+            np.copyto(out, block.T)
+
+        self._file.write(out)
+        self.samples_written += num_samples
+
+    def flush(self, fsync=False):
+        """
+            This function hands the written samples to the operating system, and with fsync=True also waits until they
+            are on the disk.
+        """
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """
+            This function flushes and closes the binary file.
+        """
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BinaryRecording:
+
+    """
+        This class opens a file written by BinaryRecorder without loading it. The samples are memory-mapped with
+        np.memmap, so slicing a multi-GB capture only reads the pages that are actually touched.
+
+        The number of samples is derived from the file size, so a file whose recording was interrupted can still be read
+        up to the last complete sample.
+
+        Arguments:
+                    file_path: A string with the path of the binary file to open.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.header, self.data_offset = _read_binary_header(file_path)
+        self.channel_names = self.header["channel_names"]
+        self.sample_rate = self.header["sample_rate"]
+        self.start_time = self.header["start_time"]
+        self.scale = self.header["scale"]
+        self.dtype = np.dtype(self.header["dtype"])
+
+        row_size = self.dtype.itemsize * len(self.channel_names)
+        num_samples = (os.path.getsize(file_path) - self.data_offset) // row_size
+        if num_samples > 0:
+            self.samples = np.memmap(file_path, dtype=self.dtype, mode="r", offset=self.data_offset,
+                                     shape=(num_samples, len(self.channel_names)))
+        else:
+            self.samples = np.empty((0, len(self.channel_names)), dtype=self.dtype)
+
+    def __len__(self):
+        return self.samples.shape[0]
+
+    def volts(self, start=0, stop=None, channels=None):
+        """
+            This function returns a slice of the recording converted to volts.
+
+            Arguments:
+                        start: An integer with the index of the first sample to return.
+                        stop: An integer with the index after the last sample to return. Defaults to the end of the file.
+                        channels: An optional list of channel names to return. Defaults to all channels.
+
+            It returns a float64 array of shape (num_samples, num_channels). Only this slice is read from the disk.
+        """
+        columns = slice(None) if channels is None else [self.channel_names.index(name) for name in channels]
+        data = self.samples[start:stop, columns]
+        if self.dtype == np.float64:
+            return np.array(data)
+        return data.astype(np.float64) * self.scale
+
+    def channel(self, name):
+        """
+            This function returns the raw memory-mapped samples of one channel (in file units, without scaling).
+
+            Arguments:
+                        name: A string with the name of the channel (e.g. 'Dev1/ai0').
+        """
+        return self.samples[:, self.channel_names.index(name)]
+
+    def close(self):
+        """
+            This function releases the memory map.
+        """
+        mmap = getattr(self.samples, "_mmap", None)
+        self.samples = None
+        if mmap is not None:
+            mmap.close()
+
+
+class Hdf5Recorder:
+
+    """
+        This class writes the acquired batches to an HDF5 file with h5py. Every channel gets its own extensible, chunked
+        and compressed dataset in the group 'channels', which grows with every batch, so a multi-hour capture takes a
+        fraction of the space of a CSV file and a single channel can be loaded without reading the others.
+
+        The sample rate, the start time and the channel names are stored as attributes of the file, and every dataset
+        has the attributes 'channel_name' and 'column'. The time of sample n is start_time + n / sample_rate.
+
+        Arguments:
+                    file_path: A string with the path of the HDF5 file to create.
+                    channel_names: A list of strings with the names of the recorded channels.
+                    sample_rate: A float with the sample rate in samples per second.
+                    start_time: The acquisition start time as a Unix timestamp. Defaults to the current time.
+                    chunk_samples: An integer with the number of samples per chunk of every dataset.
+                    compression: The h5py compression filter, e.g. 'gzip' (default) or 'lzf'.
+                    compression_level: An integer with the gzip compression level (0 to 9).
+    """
+
+    def __init__(self, file_path, channel_names, sample_rate, start_time=None, chunk_samples=65536, compression="gzip", compression_level=4):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("Saving to HDF5 files needs the h5py package (pip install h5py)") from None
+
+        self.file_path = file_path
+        self.channel_names = list(channel_names)
+        self.samples_written = 0
+
+        self._file = h5py.File(file_path, "w")
+        self._file.attrs["sample_rate"] = float(sample_rate)
+        self._file.attrs["start_time"] = time.time() if start_time is None else float(start_time)
+        self._file.attrs["channel_names"] = json.dumps(self.channel_names)
+
+        group = self._file.create_group("channels")
+        compression_opts = compression_level if compression == "gzip" else None
+        self._datasets = []
+        for column, name in enumerate(self.channel_names):
+            dataset = group.create_dataset(_storage_name(name), shape=(0,), maxshape=(None,), dtype="f8",
+                                           chunks=(chunk_samples,), compression=compression,
+                                           compression_opts=compression_opts, shuffle=True)
+            dataset.attrs["channel_name"] = name
+            dataset.attrs["column"] = column
+            self._datasets.append(dataset)
+
+    def write(self, block):
+        """
+            This function appends one batch to the dataset of every channel.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples) holding the batch to append.
+        """
+        block = np.asarray(block).reshape(len(self.channel_names), -1)
+        end = self.samples_written + block.shape[1]
+        for dataset, samples in zip(self._datasets, block):
+            dataset.resize((end,))
+            dataset[self.samples_written:end] = samples
+        self.samples_written = end
+
+    def close(self):
+        """
+            This function stores the number of samples and closes the HDF5 file.
+        """
+        if self._file.id.valid:
+            self._file.attrs["samples_written"] = self.samples_written
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _ChannelArraysRecording:
+
+    # Reading side shared by Hdf5Recording and ZarrRecording: one 1D array per channel, in the order of channel_names
+
+    def _open_arrays(self, attrs, group):
+        self.sample_rate = float(attrs["sample_rate"])
+        self.start_time = float(attrs["start_time"])
+        self.channel_names = self._decode_channel_names(attrs["channel_names"])
+        self._arrays = [group[_storage_name(name)] for name in self.channel_names]
+        # A recording which was interrupted between the writes of two channels ends at the shortest channel
+        self.num_samples = min((array.shape[0] for array in self._arrays), default=0)
+
+    @staticmethod
+    def _decode_channel_names(names):
+        return json.loads(names) if isinstance(names, str) else list(names)
+
+    def __len__(self):
+        return self.num_samples
+
+    def volts(self, start=0, stop=None, channels=None):
+        """
+            This function returns a slice of the recording as a float64 array of shape (num_samples, num_channels).
+            Only the chunks which hold the slice are read and decompressed.
+
+            Arguments:
+                        start: An integer with the index of the first sample to return.
+                        stop: An integer with the index after the last sample to return. Defaults to the end of the recording.
+                        channels: An optional list of channel names to return. Defaults to all channels.
+        """
+        start, stop, _ = slice(start, stop).indices(self.num_samples)
+        stop = max(stop, start)
+        names = self.channel_names if channels is None else channels
+        data = np.empty((stop - start, len(names)), dtype=np.float64)
+        for column, name in enumerate(names):
+            data[:, column] = self._arrays[self.channel_names.index(name)][start:stop]
+        return data
+
+    def channel(self, name):
+        """
+            This function returns all the samples of one channel.
+
+            Arguments:
+                        name: A string with the name of the channel (e.g. 'Dev1/ai0').
+        """
+        return self.volts(channels=[name])[:, 0]
+
+
+class Hdf5Recording(_ChannelArraysRecording):
+
+    """
+        This class opens a file written by Hdf5Recorder without loading it, with the same volts() and channel() functions
+        as BinaryRecording. Only the chunks of the requested slice are read.
+
+        Arguments:
+                    file_path: A string with the path of the HDF5 file to open.
+    """
+
+    def __init__(self, file_path):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("Reading HDF5 files needs the h5py package (pip install h5py)") from None
+
+        self.file_path = file_path
+        self._file = h5py.File(file_path, "r")
+        self._open_arrays(self._file.attrs, self._file["channels"])
+
+    def close(self):
+        if self._file.id.valid:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ZarrRecorder:
+
+    """
+        This class writes the acquired batches to a Zarr store (a directory of compressed chunks) with the zarr package.
+        The layout is the same as the one of Hdf5Recorder: one growing, chunked and compressed array per channel in the
+        group 'channels', and the sample rate, start time and channel names as attributes of the root group.
+
+        Arguments:
+                    file_path: A string with the path of the Zarr store (directory) to create.
+                    channel_names: A list of strings with the names of the recorded channels.
+                    sample_rate: A float with the sample rate in samples per second.
+                    start_time: The acquisition start time as a Unix timestamp. Defaults to the current time.
+                    chunk_samples: An integer with the number of samples per chunk of every array.
+    """
+
+    def __init__(self, file_path, channel_names, sample_rate, start_time=None, chunk_samples=65536):
+        try:
+            import zarr
+        except ImportError:
+            raise ImportError("Saving to Zarr stores needs the zarr package (pip install zarr)") from None
+
+        self.file_path = file_path
+        self.channel_names = list(channel_names)
+        self.samples_written = 0
+
+        self._root = zarr.open_group(file_path, mode="w")
+        self._root.attrs.update({
+            "sample_rate": float(sample_rate),
+            "start_time": time.time() if start_time is None else float(start_time),
+            "channel_names": self.channel_names,
+        })
+
+        group = self._root.create_group("channels")
+        self._arrays = []
+        for column, name in enumerate(self.channel_names):
+            array = group.zeros(name=_storage_name(name), shape=(0,), chunks=(chunk_samples,), dtype="f8")
+            array.attrs.update({"channel_name": name, "column": column})
+            self._arrays.append(array)
+
+    def write(self, block):
+        """
+            This function appends one batch to the array of every channel.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples) holding the batch to append.
+        """
+        block = np.asarray(block).reshape(len(self.channel_names), -1)
+        for array, samples in zip(self._arrays, block):
+            array.append(samples)
+        self.samples_written += block.shape[1]
+
+    def close(self):
+        """
+            This function stores the number of samples in the attributes of the store.
+        """
+        self._root.attrs["samples_written"] = self.samples_written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ZarrRecording(_ChannelArraysRecording):
+
+    """
+        This class opens a store written by ZarrRecorder without loading it, with the same volts() and channel()
+        functions as BinaryRecording. Only the chunks of the requested slice are read.
+
+        Arguments:
+                    file_path: A string with the path of the Zarr store (directory) to open.
+    """
+
+    def __init__(self, file_path):
+        try:
+            import zarr
+        except ImportError:
+            raise ImportError("Reading Zarr stores needs the zarr package (pip install zarr)") from None
+
+        self.file_path = file_path
+        root = zarr.open_group(file_path, mode="r")
+        self._open_arrays(root.attrs, root["channels"])
+
+    def close(self):
+        # A Zarr store keeps no file open between two reads
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _storage_name(channel_name):
+    # '/' separates groups in HDF5 and Zarr, so 'Dev1/ai0' is stored as 'Dev1_ai0'
+    return channel_name.strip("/").replace("/", "_")
+
+
+def _encode_binary_header(header):
+    payload = json.dumps(header).encode("utf-8")
+    prefix_size = len(BINARY_MAGIC) + 4
+    padding = -(prefix_size + len(payload)) % BINARY_ALIGNMENT
+    payload += b" " * padding
+    return BINARY_MAGIC + struct.pack("<I", len(payload)) + payload
+
+
+def _read_binary_header(file_path):
+    with open(file_path, "rb") as f:
+        magic = f.read(len(BINARY_MAGIC))
+        if magic != BINARY_MAGIC:
+            raise ValueError(f"{file_path} is not a binary recording")
+        (header_size,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_size).decode("utf-8"))
+    return header, len(BINARY_MAGIC) + 4 + header_size
+
+
+# Storage backend used for every file extension; files with any other extension are written as CSV
+RECORDER_EXTENSIONS = {
+    ".bin": "binary",
+    ".h5": "hdf5",
+    ".hdf5": "hdf5",
+    ".zarr": "zarr",
+    ".seg": "segmented",
+}
+
+
+def open_recorder(file_path, channel_names, sample_rate, binary_dtype="float64", start_time=None, segment_seconds=600.0, fsync="segment",
+                  segment_bytes=None, checkpoint_seconds=1.0, resume=False):
+    """
+        This function creates the recorder matching the extension of file_path (see RECORDER_EXTENSIONS):
+        '.bin' files are written with BinaryRecorder, '.h5'/'.hdf5' files with Hdf5Recorder, '.zarr' stores with
+        ZarrRecorder, '.seg' directories with segmented_recording.SegmentedRecorder, and everything else is written as CSV. All recorders have the same write(block) and close()
+        functions, so the acquisition does not depend on the format.
+
+        Arguments:
+                    file_path: A string with the path of the file to create.
+                    channel_names: A list of strings with the names of the recorded channels.
+                    sample_rate: A float with the sample rate in samples per second.
+                    binary_dtype: The sample format used for binary files, either 'float64' or 'int16'.
+                    start_time: The acquisition start time as a Unix timestamp, stored in every format except CSV.
+                    segment_seconds: A float with the length of the segments of a '.seg' recording in seconds.
+                    fsync: The fsync policy of a '.seg' recording (see SegmentedRecorder).
+                    segment_bytes: An optional integer with the largest size of a segment of a '.seg' recording in bytes.
+                    checkpoint_seconds: A float with the time between two checkpoints of a '.seg' recording, i.e. the
+                                        length of the tail which a killed process can lose.
+                    resume: A boolean specifying whether an interrupted '.seg' recording is continued instead of replaced.
+    """
+    storage = RECORDER_EXTENSIONS.get(os.path.splitext(file_path.rstrip("/\\"))[1].lower())
+    if storage == "binary":
+        return BinaryRecorder(file_path, channel_names, sample_rate, dtype=binary_dtype, start_time=start_time)
+    if storage == "hdf5":
+        return Hdf5Recorder(file_path, channel_names, sample_rate, start_time=start_time)
+    if storage == "zarr":
+        return ZarrRecorder(file_path, channel_names, sample_rate, start_time=start_time)
+    if storage == "segmented":
+        from segmented_recording import SegmentedRecorder
+        return SegmentedRecorder(file_path, channel_names, sample_rate, dtype=binary_dtype, segment_seconds=segment_seconds,
+                                 segment_bytes=segment_bytes, checkpoint_seconds=checkpoint_seconds, fsync=fsync,
+                                 start_time=start_time, resume=resume)
+    return CsvRecorder(file_path, channel_names)
+
+
+def open_recording(file_path):
+    """
+        This function opens a recording for reading with the class matching its extension (see RECORDER_EXTENSIONS):
+        BinaryRecording, Hdf5Recording, ZarrRecording or segmented_recording.SegmentedRecording. All of them have the
+        same volts(start, stop, channels) function, which reads only the requested slice.
+
+        CSV files are not supported and give None: a CSV file has no index of its rows, so reading a slice means parsing
+        the whole file up to it.
+
+        Arguments:
+                    file_path: A string with the path of the recording.
+    """
+    storage = RECORDER_EXTENSIONS.get(os.path.splitext(file_path.rstrip("/\\"))[1].lower())
+    if storage == "binary":
+        return BinaryRecording(file_path)
+    if storage == "hdf5":
+        return Hdf5Recording(file_path)
+    if storage == "zarr":
+        return ZarrRecording(file_path)
+    if storage == "segmented":
+        from segmented_recording import SegmentedRecording
+        return SegmentedRecording(file_path)
+    return None
@@ -0,0 +1,103 @@
+import threading
+
+import numpy as np
+
+
+class RingBuffer:
+
+    """
+        This class keeps the most recent samples of every channel in a preallocated NumPy array, so that the live plot
+        can show the newest data without re-reading the file that is being recorded.
+
+        The storage has one column per channel and twice as many rows as the capacity. Every sample is written twice,
+        once at its position in the ring and once at the same position shifted by the capacity. Because of this mirror
+        copy the newest samples are always stored contiguously, and latest() can hand them out as a view of the storage
+        without copying anything. The cost of a write and of a read only depends on the block size and the capacity,
+        never on how long the acquisition has been running.
+
+        Arguments:
+                    capacity: An integer specifying how many samples per channel are kept in memory.
+                    num_channels: An integer specifying the number of channels (columns) stored in the buffer.
+                    dtype: The NumPy data type of the stored samples. Defaults to float64, which is what the DAQ returns.
+    """
+
+    def __init__(self, capacity, num_channels, dtype=np.float64):
+        if capacity <= 0:
+            raise ValueError("capacity must be a positive integer")
+        if num_channels <= 0:
+            raise ValueError("num_channels must be a positive integer")
+
+        self.capacity = int(capacity)
+        self.num_channels = int(num_channels)
+        self._storage = np.zeros((2 * self.capacity, self.num_channels), dtype=dtype)
+        self._write_index = 0       # Position in the ring where the next sample will be written
+        self.total_written = 0      # Number of samples per channel written since the buffer was created
+        self._lock = threading.Lock()
+
+    def write(self, block):
+        """
+            This function appends a block of samples to the buffer, overwriting the oldest samples once the buffer is full.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples), which is the layout returned by task.read and
+                               by the nidaqmx stream readers. A 1D array is accepted for a single channel.
+        """
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block.reshape(1, -1)
+        if block.shape[0] != self.num_channels:
+            raise ValueError(f"expected {self.num_channels} channels, got {block.shape[0]}")
+
+        samples = block.T
+        num_samples = samples.shape[0]
+
+        # Only the newest 'capacity' samples of an oversized block can ever be read back
+        if num_samples > self.capacity:
+            samples = samples[-self.capacity:]
+
+        with self._lock:
+            self._copy_into_ring(samples)
+            self.total_written += num_samples
+
+    def _copy_into_ring(self, samples):
+        start = self._write_index
+        count = samples.shape[0]
+        first_part = min(count, self.capacity - start)
+
+        # Write the part that fits before the end of the ring, then wrap around for the rest
+        for offset, chunk in ((start, samples[:first_part]), (0, samples[first_part:])):
+            if len(chunk) == 0:
+                continue
+            self._storage[offset:offset + len(chunk)] = chunk
+            self._storage[offset + self.capacity:offset + self.capacity + len(chunk)] = chunk
+
+        self._write_index = (start + count) % self.capacity
+
+    def latest(self, num_samples=None):
+        """
+            This function returns the newest samples of every channel without copying them.
+
+            Arguments:
+                        num_samples: An integer specifying how many of the newest samples to return. Defaults to the capacity.
+                                     Fewer samples are returned while the buffer is still filling up.
+
+            It returns a tuple (start_index, view). start_index is the running index of the first returned sample since the
+            start of the acquisition, and view is an array of shape (returned_samples, num_channels) that shares memory with
+            the buffer. The view is overwritten by later writes, so copy it if it has to be kept.
+        """
+        if num_samples is None:
+            num_samples = self.capacity
+
+        with self._lock:
+            available = min(self.total_written, self.capacity, num_samples)
+            end = self._write_index + self.capacity
+            start_index = self.total_written - available
+            return start_index, self._storage[end - available:end]
+
+    def clear(self):
+        """
+            This function empties the buffer so that it can be reused for a new acquisition.
+        """
+        with self._lock:
+            self._write_index = 0
+            self.total_written = 0
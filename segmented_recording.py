@@ -0,0 +1,320 @@
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from recording import BinaryRecorder, BinaryRecording
+
+
+MANIFEST_NAME = "manifest.json"
+FSYNC_POLICIES = ("none", "segment", "checkpoint", "block")
+
+
+def _write_json_atomically(file_path, content, fsync):
+    # Write to a temporary file and rename it over the old one, so a crash leaves either the old or the new manifest
+    temporary_path = file_path + ".tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(content, f, indent=2)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+    os.replace(temporary_path, file_path)
+    if fsync and hasattr(os, "O_DIRECTORY"):
+        # Make the rename itself durable
+        directory = os.open(os.path.dirname(os.path.abspath(file_path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+def _segment_samples(segment_path):
+    # Number of complete samples of a segment file and the position of their end, or (0, 0) for a segment which is
+    # missing, empty or whose header was not completely written (the process died right after opening it)
+    try:
+        recording = BinaryRecording(segment_path)
+    except (OSError, ValueError, struct.error):
+        return 0, 0
+    num_samples = len(recording)
+    data_end = recording.data_offset + num_samples * recording.dtype.itemsize * len(recording.channel_names)
+    recording.close()
+    return num_samples, data_end
+
+
+def read_manifest(directory):
+    """
+        This function returns the manifest of a segmented recording as a dictionary.
+    """
+    with open(os.path.join(directory, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+class SegmentedRecorder:
+
+    """
+        This class records a long acquisition as a directory of binary segment files (see recording.BinaryRecorder)
+        instead of one huge file, so that a crash, a power cut or a full disk only damages the end of the last segment,
+        and later tools can open any time range by reading only the segments which contain it.
+
+        A new segment is started every segment_seconds seconds of data (or every segment_bytes bytes); a batch which
+        crosses the boundary is split, so every segment except the last holds exactly the same number of samples. The
+        directory also holds a manifest (manifest.json) listing every segment with its first sample, its number of
+        samples and its start time. The manifest is always replaced atomically (written to a temporary file and renamed).
+
+        Every checkpoint_seconds the open segment is flushed to the operating system and its entry in the manifest is
+        updated. The samples written after the last checkpoint are the write-ahead tail, which is what a killed process
+        can lose. The fsync policy decides when the data is also forced to the disk, which protects it against a power
+        cut or an OS crash, at the price of some write throughput:
+            'none':       never; the operating system writes the data when it wants.
+            'segment':    when a segment is closed (the default).
+            'checkpoint': when a segment is closed and at every checkpoint.
+            'block':      after every batch (safest and slowest).
+
+        With resume=True an interrupted recording in the same directory is continued: the last segment is cut to its last
+        complete sample and closed, and the new samples go to a new segment, numbered after the old ones.
+
+        Arguments:
+                    directory: A string with the path of the directory to create (e.g. 'run.seg').
+                    channel_names: A list of strings with the names of the recorded channels.
+                    sample_rate: A float with the sample rate in samples per second.
+                    dtype: The sample format of the segments, 'float64' (default) or 'int16'.
+                    segment_seconds: A float with the length of every segment in seconds. Defaults to 600 (10 minutes).
+                    segment_bytes: An optional integer with the largest size of a segment in bytes.
+                    checkpoint_seconds: A float with the time between two checkpoints in seconds. Defaults to 1.
+                    fsync: The fsync policy, one of FSYNC_POLICIES. Defaults to 'segment'.
+                    start_time: The acquisition start time as a Unix timestamp. Defaults to the current time.
+                    resume: A boolean specifying whether an existing recording in the directory is continued.
+    """
+
+    def __init__(self, directory, channel_names, sample_rate, dtype="float64", segment_seconds=600.0, segment_bytes=None,
+                 checkpoint_seconds=1.0, fsync="segment", start_time=None, resume=False):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy '{fsync}', expected one of {FSYNC_POLICIES}")
+
+        self.directory = directory
+        self.channel_names = list(channel_names)
+        self.sample_rate = float(sample_rate)
+        self.dtype = np.dtype(dtype).name
+        self.checkpoint_seconds = float(checkpoint_seconds)
+        self.fsync = fsync
+        self.start_time = time.time() if start_time is None else float(start_time)
+
+        row_size = np.dtype(self.dtype).itemsize * len(self.channel_names)
+        limits = [int(round(segment_seconds * self.sample_rate))] if segment_seconds else []
+        if segment_bytes:
+            limits.append(int(segment_bytes) // row_size)
+        self.segment_samples = max(min(limits), 1) if limits else None
+
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        if resume and os.path.exists(manifest_path):
+            self.manifest = read_manifest(directory)
+            if self.manifest["channel_names"] != self.channel_names or self.manifest["sample_rate"] != self.sample_rate:
+                raise ValueError("the recording in the directory has other channels or another sample rate")
+            self._recover_last_segment()
+        else:
+            self.manifest = {
+                "channel_names": self.channel_names,
+                "sample_rate": self.sample_rate,
+                "start_time": self.start_time,
+                "dtype": self.dtype,
+                "segment_samples": self.segment_samples,
+                "finished": False,
+                "segments": [],
+            }
+        self.manifest["finished"] = False
+
+        # Samples are counted from the start of the whole recording, across resumed runs
+        self.samples_written = sum(segment["num_samples"] for segment in self.manifest["segments"])
+        self._run_first_sample = self.samples_written
+        self._segment = None
+        self._segment_entry = None
+        self._last_checkpoint = time.monotonic()
+        self._write_manifest()
+
+    def _recover_last_segment(self):
+        # Trust the file over the manifest: count the complete samples of every segment which was still open
+        for entry in self.manifest["segments"]:
+            if entry["closed"]:
+                continue
+            segment_path = os.path.join(self.directory, entry["file"])
+            num_samples, data_end = _segment_samples(segment_path)
+            if num_samples and os.path.exists(segment_path):
+                with open(segment_path, "r+b") as f:
+                    f.truncate(data_end)
+            entry["num_samples"] = num_samples
+            entry["closed"] = True
+
+    def _write_manifest(self, fsync=None):
+        if fsync is None:
+            fsync = self.fsync != "none"
+        _write_json_atomically(os.path.join(self.directory, MANIFEST_NAME), self.manifest, fsync)
+
+    def _open_segment(self):
+        number = len(self.manifest["segments"])
+        file_name = f"segment_{number:06d}.bin"
+        segment_start = self.start_time + (self.samples_written - self._run_first_sample) / self.sample_rate
+        self._segment = BinaryRecorder(os.path.join(self.directory, file_name), self.channel_names, self.sample_rate,
+                                       dtype=self.dtype, start_time=segment_start)
+        # The header reaches the file before the manifest lists the segment, so a listed segment is always readable
+        self._segment.flush(fsync=self.fsync != "none")
+        self._segment_entry = {
+            "file": file_name,
+            "first_sample": self.samples_written,
+            "num_samples": 0,
+            "start_time": segment_start,
+            "closed": False,
+        }
+        self.manifest["segments"].append(self._segment_entry)
+        # The segment is listed before any of its samples are written, so a reader always finds every segment file
+        self._write_manifest()
+
+    def _close_segment(self):
+        self._segment.flush(fsync=self.fsync != "none")
+        self._segment.close()
+        self._segment_entry["num_samples"] = self._segment.samples_written
+        self._segment_entry["closed"] = True
+        self._segment = None
+        self._segment_entry = None
+        self._write_manifest()
+
+    def _checkpoint(self):
+        self._segment.flush(fsync=self.fsync in ("checkpoint", "block"))
+        self._segment_entry["num_samples"] = self._segment.samples_written
+        self._write_manifest(fsync=self.fsync in ("checkpoint", "block"))
+        self._last_checkpoint = time.monotonic()
+
+    def write(self, block):
+        """
+            This function appends one batch to the recording, starting new segments where needed.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples) holding the batch to append, in volts.
+        """
+        block = np.asarray(block).reshape(len(self.channel_names), -1)
+        position = 0
+        while position < block.shape[1]:
+            if self._segment is None:
+                self._open_segment()
+            count = block.shape[1] - position
+            if self.segment_samples is not None:
+                count = min(count, self.segment_samples - self._segment.samples_written)
+            self._segment.write(block[:, position:position + count])
+            self.samples_written += count
+            position += count
+            if self.segment_samples is not None and self._segment.samples_written >= self.segment_samples:
+                self._close_segment()
+
+        if self._segment is not None:
+            if self.fsync == "block":
+                self._checkpoint()
+            elif time.monotonic() - self._last_checkpoint >= self.checkpoint_seconds:
+                self._checkpoint()
+
+    def close(self):
+        """
+            This function closes the last segment and marks the recording as finished in the manifest.
+        """
+        if self.manifest.get("finished"):
+            return
+        if self._segment is not None:
+            self._close_segment()
+        self.manifest["finished"] = True
+        self._write_manifest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SegmentedRecording:
+
+    """
+        This class reads a recording written by SegmentedRecorder. Only the manifest is read when it is opened; the
+        segments are memory-mapped when a read touches them for the first time, so reading a few seconds of a day-long
+        recording only opens one or two files.
+
+        A segment which the manifest lists as still open (the recording was interrupted) is read up to its last complete
+        sample, which can be more than the manifest knows from its last checkpoint. A segment file which is missing or
+        has no complete header counts as empty.
+
+        Arguments:
+                    directory: A string with the path of the recording directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest = read_manifest(directory)
+        self.channel_names = self.manifest["channel_names"]
+        self.sample_rate = self.manifest["sample_rate"]
+        self.start_time = self.manifest["start_time"]
+        self.segments = self.manifest["segments"]
+        self._recordings = {}
+
+        # Size of every segment, from the manifest, or from the file for a segment which was never closed
+        sizes = []
+        for index, segment in enumerate(self.segments):
+            if segment["closed"]:
+                sizes.append(segment["num_samples"])
+            else:
+                sizes.append(_segment_samples(os.path.join(directory, segment["file"]))[0])
+        self._ends = np.cumsum(sizes, dtype=np.int64)
+        self._starts = self._ends - np.asarray(sizes, dtype=np.int64)
+
+    def __len__(self):
+        return int(self._ends[-1]) if len(self._ends) else 0
+
+    def _open(self, index):
+        if index not in self._recordings:
+            self._recordings[index] = BinaryRecording(os.path.join(self.directory, self.segments[index]["file"]))
+        return self._recordings[index]
+
+    def segments_for(self, start, stop):
+        """
+            This function returns the indexes of the segments which hold samples start to stop (excluded).
+        """
+        first = int(np.searchsorted(self._ends, start, side="right"))
+        last = int(np.searchsorted(self._starts, stop, side="left"))
+        return [index for index in range(first, min(last, len(self.segments))) if self._ends[index] > self._starts[index]]
+
+    def volts(self, start=0, stop=None, channels=None):
+        """
+            This function returns samples start to stop (excluded) of the recording, in volts, as an array of shape
+            (num_samples, num_channels). Only the segments which hold these samples are opened.
+
+            Arguments:
+                        start: An integer with the index of the first sample, counted from the start of the recording.
+                        stop: An integer with the index after the last sample. Defaults to the end of the recording.
+                        channels: An optional list of channel names to return. Defaults to all channels.
+        """
+        stop = len(self) if stop is None else min(int(stop), len(self))
+        start = max(int(start), 0)
+        parts = []
+        for index in self.segments_for(start, stop):
+            offset = int(self._starts[index])
+            parts.append(self._open(index).volts(max(start - offset, 0), min(stop, int(self._ends[index])) - offset, channels))
+        if not parts:
+            num_channels = len(self.channel_names) if channels is None else len(channels)
+            return np.empty((0, num_channels))
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def time_range(self, start_time, stop_time, channels=None):
+        """
+            This function returns the samples between two times, in seconds from the start of the recording, like volts().
+        """
+        return self.volts(int(np.floor(start_time * self.sample_rate)), int(np.ceil(stop_time * self.sample_rate)), channels)
+
+    def close(self):
+        for recording in self._recordings.values():
+            recording.close()
+        self._recordings = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
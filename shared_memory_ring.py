@@ -0,0 +1,325 @@
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# Layout of the shared memory block:
+#   header:  16 int64 values, see the _HEADER_* indices
+#   slots:   num_slots slots, every slot starts on a multiple of 64 bytes with 4 int64 values
+#            (sequence, first sample, number of samples, unused) followed by the (channels, block_size) samples
+_MAGIC = 0x31474E4952584950     # b"PXIRING1" read as a little-endian integer
+_HEADER_MAGIC, _HEADER_CHANNELS, _HEADER_BLOCK_SIZE, _HEADER_SLOTS, _HEADER_DTYPE, _HEADER_WRITTEN, _HEADER_SAMPLES, _HEADER_CLOSED, _HEADER_READERS = range(9)
+_HEADER_VALUES = 16
+_HEADER_BYTES = _HEADER_VALUES * 8
+_SLOT_HEADER = 4
+_ALIGNMENT = 64
+DTYPES = ("float64", "float32", "int16")
+
+
+def _slot_bytes(num_channels, block_size, dtype):
+    size = _SLOT_HEADER * 8 + num_channels * block_size * np.dtype(dtype).itemsize
+    return -(-size // _ALIGNMENT) * _ALIGNMENT
+
+
+def _attach(name):
+    # Attach to an existing block without letting the resource tracker of this process unlink it at exit
+    # (only the process which created the block may remove it)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always registers the block, so the registration is skipped for the time of the call
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None if rtype == "shared_memory" else register(name, rtype)
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class _SharedRingLayout:
+
+    # NumPy views of the header and of every slot of the shared memory block
+
+    def _map(self, memory, num_channels, block_size, num_slots, dtype):
+        self.num_channels = num_channels
+        self.block_size = block_size
+        self.num_slots = num_slots
+        self.dtype = np.dtype(dtype)
+        self.header = np.ndarray((_HEADER_VALUES,), dtype=np.int64, buffer=memory.buf)
+
+        slot_bytes = _slot_bytes(num_channels, block_size, dtype)
+        self.slot_headers = []
+        self.slot_data = []
+        for slot in range(num_slots):
+            offset = _HEADER_BYTES + slot * slot_bytes
+            self.slot_headers.append(np.ndarray((_SLOT_HEADER,), dtype=np.int64, buffer=memory.buf, offset=offset))
+            self.slot_data.append(np.ndarray((num_channels, block_size), dtype=self.dtype, buffer=memory.buf,
+                                             offset=offset + _SLOT_HEADER * 8))
+
+    def _release(self):
+        # The views have to be dropped before the shared memory can be closed
+        self.header = None
+        self.slot_headers = []
+        self.slot_data = []
+
+
+class SharedBlockRing(_SharedRingLayout):
+
+    """
+        This class is the writing side of a ring of fixed-size blocks in shared memory, through which the acquisition
+        hands its batches to plotting and analysis processes. Those processes run in their own interpreter, so heavy
+        drawing or computing never competes with the DAQ reads for the GIL, and nothing is pickled or sent through a pipe.
+
+        The ring has num_slots slots of (num_channels, block_size) samples. Block n is written into slot n % num_slots,
+        overwriting the oldest block, so the writer never waits for the readers. Every slot carries a sequence number
+        used as a seqlock: it is 2n + 1 while block n is being written and 2n + 2 once it is complete. A reader
+        (SharedBlockReader) checks the number before and after copying a slot, so it can detect a block that is not
+        complete yet or that was overwritten while it was copied, without any lock shared between the processes.
+        Every reader keeps its own cursor, so any number of readers can follow the stream at their own pace.
+
+        write() is meant to be a stage of the acquisition pipeline, e.g. add_block_consumer(ring.write). A reader which
+        is started with the acquisition can be waited for with wait_for_readers(), so that it sees the first block.
+
+        Arguments:
+                    num_channels: An integer with the number of channels in every block.
+                    block_size: An integer with the number of samples per channel in one slot; larger blocks are split.
+                    num_slots: An integer with the number of blocks kept in the ring. Defaults to 64.
+                    dtype: The data type of the samples, one of DTYPES. Defaults to 'float64'. The acquired batches are
+                           volts in float64; 'float32' rounds them to float32 precision, and 'int16' only takes integer
+                           batches (e.g. raw ADC codes), since volts would be truncated to whole numbers.
+                    name: An optional string with the name of the shared memory block, which the readers use to attach.
+                          Defaults to a random name (see the name attribute).
+    """
+
+    def __init__(self, num_channels, block_size, num_slots=64, dtype="float64", name=None):
+        dtype = np.dtype(dtype).name
+        if dtype not in DTYPES:
+            raise ValueError(f"unsupported dtype '{dtype}', expected one of {DTYPES}")
+        if num_channels <= 0 or block_size <= 0 or num_slots < 2:
+            raise ValueError("num_channels and block_size must be positive and num_slots at least 2")
+
+        size = _HEADER_BYTES + num_slots * _slot_bytes(num_channels, block_size, dtype)
+        self._memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self._memory.name
+        self._map(self._memory, int(num_channels), int(block_size), int(num_slots), dtype)
+
+        for slot_header in self.slot_headers:
+            slot_header[:] = 0
+        self.header[:] = 0
+        self.header[_HEADER_CHANNELS:_HEADER_WRITTEN] = (self.num_channels, self.block_size, self.num_slots, DTYPES.index(dtype))
+        self.header[_HEADER_MAGIC] = _MAGIC                 # Last, so that a reader never sees a half-written header
+        self.blocks_written = 0
+
+    @property
+    def readers(self):
+        # Number of SharedBlockReaders which have attached to the ring so far
+        return int(self.header[_HEADER_READERS])
+
+    def wait_for_readers(self, count=1, timeout=None):
+        """
+            This function waits until count readers have attached to the ring, or until timeout seconds have passed
+            (None waits for ever). It returns True when the readers have attached.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.readers < count:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def write(self, block):
+        """
+            This function copies a batch into the next slot of the ring. A batch larger than a slot (e.g. a whole
+            finite capture) is split over consecutive slots of block_size samples.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples).
+        """
+        block = np.asarray(block).reshape(self.num_channels, -1)
+        if not np.can_cast(block.dtype, self.dtype, casting="same_kind"):
+            raise TypeError(f"cannot write {block.dtype} samples into a {self.dtype} ring without losing their values")
+        num_samples = block.shape[1]
+        if num_samples > self.block_size:
+            for start in range(0, num_samples, self.block_size):
+                self.write(block[:, start:start + self.block_size])
+            return
+
+        sequence = self.blocks_written
+        slot = sequence % self.num_slots
+        slot_header = self.slot_headers[slot]
+
+        slot_header[0] = 2 * sequence + 1                   # Being written
+        slot_header[1] = self.header[_HEADER_SAMPLES]
+        slot_header[2] = num_samples
+        self.slot_data[slot][:, :num_samples] = block
+        slot_header[0] = 2 * sequence + 2                   # Complete
+
+        self.blocks_written += 1
+        self.header[_HEADER_SAMPLES] += num_samples
+        self.header[_HEADER_WRITTEN] = self.blocks_written
+
+    def close(self, unlink=True):
+        """
+            This function marks the stream as finished, so that the readers stop after the last block, and releases the
+            shared memory. The block is removed from the system when unlink is True (the default); readers which are
+            still attached keep their mapping until they close it.
+        """
+        if self.header is None:
+            return
+        self.header[_HEADER_CLOSED] = 1
+        self._release()
+        self._memory.close()
+        if unlink:
+            self._memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SharedBlockReader(_SharedRingLayout):
+
+    """
+        This class is the reading side of a SharedBlockRing, used in another process.
+
+        Arguments:
+                    name: A string with the name of the ring (the name attribute of the SharedBlockRing).
+                    start: 'oldest' to start with the oldest block that is still in the ring, or 'newest' (the default)
+                           to start with the next block that will be written.
+                    timeout: An optional float with the time in seconds to wait for the ring to be created, for a
+                             reader started before the acquisition. Defaults to 0 (the ring must already exist);
+                             FileNotFoundError is raised when it does not exist by then.
+
+        missed_blocks counts the blocks which were overwritten before this reader got to them.
+    """
+
+    def __init__(self, name, start="newest", timeout=0.0):
+        deadline = time.monotonic() + (timeout or 0.0)
+        while True:
+            try:
+                self._memory = _attach(name)
+            except FileNotFoundError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+                continue
+            except ValueError:
+                # The block exists but has no size yet: the writer is still creating it
+                if time.monotonic() >= deadline:
+                    raise ValueError(f"'{name}' is not a shared block ring") from None
+                time.sleep(0.05)
+                continue
+            header = np.ndarray((_HEADER_VALUES,), dtype=np.int64, buffer=self._memory.buf)
+            if header[_HEADER_MAGIC] == _MAGIC:
+                break
+            del header
+            self._memory.close()
+            if time.monotonic() >= deadline:
+                raise ValueError(f"'{name}' is not a shared block ring")
+            # The writer has not finished the header yet
+            time.sleep(0.05)
+        self._map(self._memory, int(header[_HEADER_CHANNELS]), int(header[_HEADER_BLOCK_SIZE]),
+                  int(header[_HEADER_SLOTS]), DTYPES[int(header[_HEADER_DTYPE])])
+        del header
+
+        written = int(self.header[_HEADER_WRITTEN])
+        self.cursor = written if start == "newest" else max(written - self.num_slots, 0)
+        self.missed_blocks = 0
+        # Readers attach one at a time in practice (e.g. a plot process started by the CLI), so a plain increment is enough
+        self.header[_HEADER_READERS] += 1
+
+    @property
+    def finished(self):
+        # True when the writer has closed the ring and every block has been read
+        return bool(self.header[_HEADER_CLOSED]) and self.cursor >= int(self.header[_HEADER_WRITTEN])
+
+    def read(self, out=None, timeout=None):
+        """
+            This function copies the next block into out and returns a tuple (sequence, first_sample, samples), where
+            samples is a view of out of shape (num_channels, number of samples in the block). It returns None when no
+            new block arrived within timeout seconds (None waits until one arrives) or when the stream is finished.
+
+            Arguments:
+                        out: An optional array of shape (num_channels, block_size) which receives the samples, so that
+                             a reading loop does not allocate. A new array is created when it is None.
+                        timeout: An optional float with the longest time to wait for a block, in seconds.
+        """
+        if out is None:
+            out = np.empty((self.num_channels, self.block_size), dtype=self.dtype)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            written = int(self.header[_HEADER_WRITTEN])
+            if written - self.cursor > self.num_slots:
+                # The writer has lapped this reader: skip to the oldest block which is still in the ring
+                self.missed_blocks += written - self.num_slots - self.cursor
+                self.cursor = written - self.num_slots
+
+            slot = self.cursor % self.num_slots
+            slot_header = self.slot_headers[slot]
+            expected = 2 * self.cursor + 2
+            sequence = int(slot_header[0])
+            if sequence == expected:
+                first_sample = int(slot_header[1])
+                num_samples = int(slot_header[2])
+                out[:, :num_samples] = self.slot_data[slot][:, :num_samples]
+                if int(slot_header[0]) == expected:
+                    self.cursor += 1
+                    return expected // 2 - 1, first_sample, out[:, :num_samples]
+                # Overwritten while it was copied: the next pass skips ahead
+                continue
+            if sequence > expected:
+                # Overwritten before it could be read
+                self.missed_blocks += 1
+                self.cursor += 1
+                continue
+
+            if self.header[_HEADER_CLOSED]:
+                return None
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(0.0005)
+
+    def close(self):
+        self._release()
+        self._memory.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    # Live plot of a ring in its own process:  python shared_memory_ring.py <name of the ring> [window]
+    # It can be started before the acquisition: it waits up to a minute for the ring, then starts with its oldest block
+    from live_plot_engine import LivePlotEngine
+    from ring_buffer import RingBuffer
+
+    try:
+        reader = SharedBlockReader(sys.argv[1], start="oldest", timeout=60.0)
+    except FileNotFoundError:
+        sys.exit(f"The shared memory ring '{sys.argv[1]}' does not exist (the acquisition has not started or has already finished)")
+    window = int(sys.argv[2]) if len(sys.argv) > 2 else 1500
+    buffer = RingBuffer(window, reader.num_channels)
+    block = np.empty((reader.num_channels, reader.block_size), dtype=reader.dtype)
+
+    def fetch():
+        # Take every block which arrived since the last frame
+        while True:
+            received = reader.read(block, timeout=0)
+            if received is None:
+                break
+            buffer.write(received[2])
+        return buffer.latest(window)[1]
+
+    engine = LivePlotEngine([f"channel {index}" for index in range(reader.num_channels)], np.arange(1 - window, 1),
+                            fetch, ylim=None, stop_when=lambda: reader.finished)
+    engine.run()
+    reader.close()
@@ -0,0 +1,537 @@
+import enum
+import threading
+import time
+import types
+
+import numpy as np
+
+
+class AcquisitionType(enum.Enum):
+    # Same values as nidaqmx.constants.AcquisitionType
+    FINITE = 10178
+    CONTINUOUS = 10123
+    HW_TIMED_SINGLE_POINT = 12522
+
+
+class Edge(enum.Enum):
+    # Same values as nidaqmx.constants.Edge
+    RISING = 10280
+    FALLING = 10171
+
+
+class Slope(enum.Enum):
+    # Same values as nidaqmx.constants.Slope
+    RISING = 10280
+    FALLING = 10171
+
+
+class TaskMode(enum.Enum):
+    # Same values as nidaqmx.constants.TaskMode
+    TASK_START = 0
+    TASK_STOP = 1
+    TASK_VERIFY = 2
+    TASK_COMMIT = 3
+    TASK_RESERVE = 4
+    TASK_UNRESERVE = 5
+    TASK_ABORT = 6
+
+
+class RegenerationMode(enum.Enum):
+    # Same values as nidaqmx.constants.RegenerationMode
+    ALLOW_REGENERATION = 10097
+    DONT_ALLOW_REGENERATION = 10158
+
+
+# Stand-in for nidaqmx.constants, so that code written against backend.constants works with both backends
+constants = types.SimpleNamespace(AcquisitionType=AcquisitionType, Edge=Edge, Slope=Slope, TaskMode=TaskMode,
+                                  RegenerationMode=RegenerationMode)
+
+
+class SimulatedDaqError(Exception):
+
+    """
+        This exception is raised by the simulated device in the situations where the real driver raises a DaqError.
+        The error_code attribute holds the matching NI-DAQmx error code (e.g. -200279 when the input buffer overflowed).
+    """
+
+    def __init__(self, message, error_code):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+class SimulatedDevice:
+
+    """
+        This class describes the signals produced by the simulated DAQ device. The waveforms are deterministic: the same
+        device settings always produce the same samples, independently of how the samples are split into batches.
+
+        Arguments:
+                    waveforms: A list of waveform names which are assigned to the channels in turn. The supported names are
+                               'sine', 'noise' and 'step'. Defaults to ('sine', 'noise', 'step').
+                    amplitude: A float with the peak amplitude of every waveform in volts.
+                    frequency: A float with the base frequency in Hz. Channel n of a sine or step waveform uses
+                               frequency * (n + 1), so that the channels can be told apart in the live plot.
+                    seed: An integer used to seed the noise generators.
+    """
+
+    WAVEFORMS = ("sine", "noise", "step")
+
+    def __init__(self, waveforms=WAVEFORMS, amplitude=1.0, frequency=10.0, seed=0):
+        for waveform in waveforms:
+            if waveform not in self.WAVEFORMS:
+                raise ValueError(f"unknown waveform '{waveform}', expected one of {self.WAVEFORMS}")
+        self.waveforms = tuple(waveforms)
+        self.amplitude = float(amplitude)
+        self.frequency = float(frequency)
+        self.seed = int(seed)
+
+    def noise_generators(self, num_channels):
+        """
+            This function returns one seeded random generator per channel, used for the 'noise' waveform.
+        """
+        return [np.random.default_rng([self.seed, channel]) for channel in range(num_channels)]
+
+    def generate(self, out, first_sample, rate, generators):
+        """
+            This function fills out (an array of shape (num_channels, num_samples)) with the samples starting at the running
+            sample index first_sample.
+        """
+        num_samples = out.shape[1]
+        t = (first_sample + np.arange(num_samples)) / rate
+
+        for channel in range(out.shape[0]):
+            waveform = self.waveforms[channel % len(self.waveforms)]
+            frequency = self.frequency * (channel + 1)
+
+            if waveform == "sine":
+                np.sin(2 * np.pi * frequency * t, out=out[channel])
+                out[channel] *= self.amplitude
+            elif waveform == "noise":
+                generators[channel].standard_normal(num_samples, out=out[channel])
+                out[channel] *= self.amplitude / 3
+            else:
+                # Square wave which steps between -amplitude and +amplitude
+                out[channel] = np.where(np.floor(2 * frequency * t) % 2 == 0, -self.amplitude, self.amplitude)
+
+
+class _SimulatedChannelCollection:
+
+    def __init__(self):
+        self.channel_names = []
+
+    def _add(self, physical_channel, *args, **kwargs):
+        self.channel_names.append(physical_channel)
+
+    # Same names as the nidaqmx channel collections
+    add_ai_voltage_chan = _add
+    add_ao_voltage_chan = _add
+    add_di_chan = _add
+    add_do_chan = _add
+
+    def __len__(self):
+        return len(self.channel_names)
+
+
+class _SimulatedTiming:
+
+    def __init__(self):
+        self.samp_clk_rate = 1000.0
+        self.samp_clk_active_edge = Edge.RISING
+        self.samp_quant_samp_mode = AcquisitionType.FINITE
+        self.samp_quant_samp_per_chan = 1000
+        self.samp_timing_type = None
+
+    def cfg_samp_clk_timing(self, rate, source="", active_edge=Edge.RISING, sample_mode=AcquisitionType.FINITE, samps_per_chan=1000):
+        self.samp_clk_rate = float(rate)
+        self.samp_clk_active_edge = active_edge
+        self.samp_quant_samp_mode = sample_mode
+        self.samp_quant_samp_per_chan = int(samps_per_chan)
+
+    def cfg_implicit_timing(self, sample_mode=AcquisitionType.FINITE, samps_per_chan=1000):
+        self.samp_quant_samp_mode = sample_mode
+        self.samp_quant_samp_per_chan = int(samps_per_chan)
+
+
+class _SimulatedStartTrigger:
+
+    def __init__(self):
+        self.configuration = None
+
+    def cfg_dig_edge_start_trig(self, trigger_source, trigger_edge=Edge.RISING):
+        self.configuration = ("digital_edge", trigger_source, trigger_edge)
+
+    def cfg_anlg_edge_start_trig(self, trigger_source="", trigger_slope=None, trigger_level=0.0):
+        self.configuration = ("analog_edge", trigger_source, trigger_slope, trigger_level)
+
+    def cfg_dig_pattern_start_trig(self, trigger_source, trigger_pattern, trigger_when=None):
+        self.configuration = ("digital_pattern", trigger_source, trigger_pattern, trigger_when)
+
+    def cfg_none_start_trig(self):
+        self.configuration = None
+
+
+class _SimulatedReferenceTrigger:
+
+    def __init__(self):
+        self.configuration = None
+
+    def cfg_anlg_edge_ref_trig(self, trigger_source, pretrigger_samples, trigger_slope=None, trigger_level=0.0):
+        self.configuration = ("analog_edge", trigger_source, int(pretrigger_samples), trigger_slope, trigger_level)
+
+    def cfg_dig_edge_ref_trig(self, trigger_source, pretrigger_samples, trigger_edge=Edge.RISING):
+        self.configuration = ("digital_edge", trigger_source, int(pretrigger_samples), trigger_edge)
+
+    def disable_ref_trig(self):
+        self.configuration = None
+
+
+class _SimulatedInStream:
+
+    def __init__(self, task):
+        self._task = task
+
+    @property
+    def avail_samp_per_chan(self):
+        return self._task._available_samples()
+
+    @property
+    def input_buf_size(self):
+        return self._task._buffer_size()
+
+
+class _SimulatedOutStream:
+
+    def __init__(self, task):
+        self._task = task
+        self.regen_mode = RegenerationMode.ALLOW_REGENERATION
+        self.output_buf_size = 0
+
+    @property
+    def total_samp_per_chan_generated(self):
+        return self._task._generated_samples()
+
+
+class SimulatedTask:
+
+    """
+        This class imitates the parts of nidaqmx.Task that are used by PXI6284Controller and the acquisition scripts,
+        so that the acquisition, saving and plotting code can run on a computer without a PXI chassis.
+
+        In real-time mode the samples become available at the configured sample rate, exactly like on the hardware: a read
+        waits until enough samples have been "acquired", and the task raises the overflow error -200279 when the reads fall
+        further behind than the input buffer can hold. Otherwise every read returns immediately, which is useful to measure
+        how fast the rest of the pipeline can go.
+
+        Arguments:
+                    device: The SimulatedDevice which produces the samples.
+                    realtime: A boolean specifying whether samples are paced at the sample rate (True) or produced as fast
+                              as they are read (False).
+    """
+
+    def __init__(self, device=None, realtime=True):
+        self.device = device if device is not None else SimulatedDevice()
+        self.realtime = realtime
+        self.ai_channels = _SimulatedChannelCollection()
+        self.ao_channels = _SimulatedChannelCollection()
+        self.di_channels = _SimulatedChannelCollection()
+        self.do_channels = _SimulatedChannelCollection()
+        self.timing = _SimulatedTiming()
+        self.triggers = types.SimpleNamespace(start_trigger=_SimulatedStartTrigger(), reference_trigger=_SimulatedReferenceTrigger())
+        self.in_stream = _SimulatedInStream(self)
+        self.out_stream = _SimulatedOutStream(self)
+        self.output_blocks = []     # The data in the output buffer, as the blocks that were written
+        self.samples_written = 0    # Samples per channel written to the output buffer since the task was configured
+        self._lock = threading.Lock()
+        self._running = False
+        self._start_time = 0.0
+        self._samples_read = 0
+        self._generators = None
+        self._every_n_samples = None
+        self._event_thread = None
+        self.committed = False      # Set by control(TaskMode.TASK_COMMIT), cleared by TASK_UNRESERVE
+        self.closed = False
+
+    def _total_samples(self):
+        if self.timing.samp_quant_samp_mode == AcquisitionType.FINITE:
+            return self.timing.samp_quant_samp_per_chan
+        return None
+
+    def _buffer_size(self):
+        # Same default input buffer sizes as the NI-DAQmx driver uses for continuous acquisitions
+        rate = self.timing.samp_clk_rate
+        if self._total_samples() is not None:
+            return self._total_samples()
+        default = 1000 if rate <= 100 else 10000 if rate <= 10000 else 100000 if rate <= 1000000 else 1000000
+        return max(default, self.timing.samp_quant_samp_per_chan)
+
+    def _acquired_samples(self):
+        if not self._running:
+            return self._samples_read
+        if not self.realtime:
+            acquired = self._samples_read + self._buffer_size()
+        else:
+            acquired = int((time.perf_counter() - self._start_time) * self.timing.samp_clk_rate)
+        total = self._total_samples()
+        return acquired if total is None else min(acquired, total)
+
+    def _available_samples(self):
+        return self._acquired_samples() - self._samples_read
+
+    def _generated_samples(self):
+        # Samples per channel that the outputs have generated so far
+        if not self._running:
+            return 0
+        if not self.realtime:
+            generated = self.samples_written
+        else:
+            generated = int((time.perf_counter() - self._start_time) * self.timing.samp_clk_rate)
+        if self.out_stream.regen_mode == RegenerationMode.DONT_ALLOW_REGENERATION:
+            generated = min(generated, self.samples_written)
+        total = self._total_samples()
+        return generated if total is None else min(generated, total)
+
+    def _write_from(self, data, timeout):
+        # Imitates a write to the output buffer: it waits for free space while a non-regenerating stream is running
+        num_samples = data.shape[1]
+        buffer_size = self.out_stream.output_buf_size or num_samples
+        streaming = self._running and self.out_stream.regen_mode == RegenerationMode.DONT_ALLOW_REGENERATION
+        if streaming and self.realtime:
+            if self._generated_samples() >= self.samples_written and self.samples_written:
+                raise SimulatedDaqError("The generation has stopped to prevent the regeneration of old samples.", -200290)
+            deadline = time.perf_counter() + timeout
+            while self.samples_written + num_samples - self._generated_samples() > buffer_size:
+                if time.perf_counter() >= deadline:
+                    raise SimulatedDaqError("Some or all of the samples to write could not be written to the buffer yet.", -200292)
+                time.sleep(0.0005)
+
+        self.output_blocks.append(np.array(data, copy=True))
+        self.samples_written += num_samples
+        # Only the newest buffer_size samples are still in the buffer
+        while sum(block.shape[1] for block in self.output_blocks) - self.output_blocks[0].shape[1] >= buffer_size:
+            self.output_blocks.pop(0)
+        return num_samples
+
+    def start(self):
+        if not len(self.ai_channels) and not len(self.ao_channels) and not len(self.di_channels) and not len(self.do_channels):
+            raise SimulatedDaqError("Task contains no channels.", -200478)
+        self._generators = self.device.noise_generators(len(self.ai_channels))
+        self._samples_read = 0
+        self._start_time = time.perf_counter()
+        self._running = True
+
+        if self._every_n_samples is not None:
+            self._event_thread = threading.Thread(target=self._fire_every_n_samples_events, daemon=True)
+            self._event_thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._event_thread is not None and self._event_thread is not threading.current_thread():
+            self._event_thread.join()
+        self._event_thread = None
+
+    def close(self):
+        self.stop()
+        self.closed = True
+
+    def control(self, action):
+        """
+            This function imitates Task.control: TASK_VERIFY, TASK_RESERVE and TASK_COMMIT check the task, TASK_COMMIT
+            leaves it committed (a stopped task then returns to the committed state), TASK_START/TASK_STOP start and stop
+            it, TASK_ABORT stops it, and TASK_UNRESERVE returns it to the unreserved state.
+        """
+        if action in (TaskMode.TASK_VERIFY, TaskMode.TASK_RESERVE, TaskMode.TASK_COMMIT):
+            if not len(self.ai_channels) and not len(self.ao_channels) and not len(self.di_channels) and not len(self.do_channels):
+                raise SimulatedDaqError("Task contains no channels.", -200478)
+            if action == TaskMode.TASK_COMMIT:
+                self.committed = True
+        elif action == TaskMode.TASK_START:
+            self.start()
+        elif action in (TaskMode.TASK_STOP, TaskMode.TASK_ABORT):
+            self.stop()
+        elif action == TaskMode.TASK_UNRESERVE:
+            self.stop()
+            self.committed = False
+
+    def register_every_n_samples_acquired_into_buffer_event(self, sample_interval, callback_method):
+        """
+            This function registers callback_method like nidaqmx does: it is called from a separate thread with
+            (task_handle, event_type, number_of_samples, callback_data) every time sample_interval samples have been
+            acquired. Passing None as callback_method unregisters the callback.
+        """
+        if callback_method is None:
+            self._every_n_samples = None
+        else:
+            self._every_n_samples = (int(sample_interval), callback_method)
+
+    def _fire_every_n_samples_events(self):
+        sample_interval, callback_method = self._every_n_samples
+        events_fired = 0
+        while self._running:
+            due = (events_fired + 1) * sample_interval
+            if self.realtime:
+                delay = self._start_time + due / self.timing.samp_clk_rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(min(delay, 0.1))
+                    continue
+            total = self._total_samples()
+            if total is not None and due > total:
+                return
+            events_fired += 1
+            callback_method(0, 1, sample_interval, None)
+
+    def is_task_done(self):
+        total = self._total_samples()
+        return not self._running or (total is not None and self._acquired_samples() >= total)
+
+    def wait_until_done(self, timeout=10.0):
+        deadline = time.perf_counter() + timeout
+        while not self.is_task_done():
+            if time.perf_counter() >= deadline:
+                raise SimulatedDaqError("Wait Until Done did not indicate that the task was done within the specified timeout.", -200560)
+            time.sleep(0.001)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read_into(self, out, num_samples, timeout):
+        if not self._running:
+            # Like nidaqmx, reading from a task that was not started starts it implicitly
+            self.start()
+
+        with self._lock:
+            total = self._total_samples()
+            if total is not None and self._samples_read + num_samples > total:
+                raise SimulatedDaqError("Attempted to read samples that will never be acquired.", -200278)
+
+            if self.realtime:
+                backlog = self._available_samples()
+                if backlog > self._buffer_size():
+                    raise SimulatedDaqError("The application is not able to keep up with the hardware acquisition.", -200279)
+
+                # Wait until the last requested sample has been "acquired"
+                ready_at = self._start_time + (self._samples_read + num_samples) / self.timing.samp_clk_rate
+                delay = ready_at - time.perf_counter()
+                if delay > timeout:
+                    raise SimulatedDaqError("Wait Until Done did not indicate that the task was done within the specified timeout.", -200284)
+                if delay > 0:
+                    time.sleep(delay)
+
+            self.device.generate(out[:, :num_samples], self._samples_read, self.timing.samp_clk_rate, self._generators)
+            self._samples_read += num_samples
+        return num_samples
+
+    def read(self, number_of_samples_per_channel=1, timeout=10.0):
+        """
+            This function reads like nidaqmx.Task.read: it returns a list of floats for a single channel, and a list of
+            lists (one per channel) for several channels.
+        """
+        out = np.empty((len(self.ai_channels), number_of_samples_per_channel), dtype=np.float64)
+        self._read_into(out, number_of_samples_per_channel, timeout)
+        if out.shape[0] == 1:
+            return out[0].tolist()
+        return out.tolist()
+
+
+class SimulatedReader:
+
+    """
+        This class imitates nidaqmx.stream_readers.AnalogMultiChannelReader for a SimulatedTask.
+    """
+
+    def __init__(self, task):
+        self._task = task
+
+    def read_many_sample(self, data, number_of_samples_per_channel=-1, timeout=10.0):
+        if number_of_samples_per_channel == -1:
+            number_of_samples_per_channel = data.shape[1]
+        return self._task._read_into(data, number_of_samples_per_channel, timeout)
+
+
+class SimulatedUnscaledReader:
+
+    """
+        This class imitates nidaqmx.stream_readers.AnalogUnscaledReader for a SimulatedTask. The codes are the voltages
+        scaled over a +/- 10 V range to 16 bit integers.
+    """
+
+    COUNTS_PER_VOLT = np.iinfo(np.int16).max / 10.0
+
+    def __init__(self, task):
+        self._task = task
+        self._scratch = np.empty((0, 0), dtype=np.float64)
+
+    def read_int16(self, data, number_of_samples_per_channel=-1, timeout=10.0):
+        if number_of_samples_per_channel == -1:
+            number_of_samples_per_channel = data.shape[1]
+        if self._scratch.shape != data.shape:
+            self._scratch = np.empty(data.shape, dtype=np.float64)
+        num_samples = self._task._read_into(self._scratch, number_of_samples_per_channel, timeout)
+        volts = self._scratch[:, :num_samples]
+        np.copyto(data[:, :num_samples], np.clip(np.rint(volts * self.COUNTS_PER_VOLT), -32768, 32767), casting="unsafe")
+        return num_samples
+
+
+class SimulatedAnalogWriter:
+
+    """
+        This class imitates nidaqmx.stream_writers.AnalogMultiChannelWriter for a SimulatedTask.
+    """
+
+    def __init__(self, task):
+        self._task = task
+
+    def write_many_sample(self, data, timeout=10.0):
+        return self._task._write_from(np.asarray(data, dtype=np.float64), timeout)
+
+
+class SimulatedDigitalWriter:
+
+    """
+        This class imitates nidaqmx.stream_writers.DigitalMultiChannelWriter for a SimulatedTask.
+    """
+
+    def __init__(self, task):
+        self._task = task
+
+    def write_many_sample_port_uint32(self, data, timeout=10.0):
+        return self._task._write_from(np.asarray(data, dtype=np.uint32), timeout)
+
+
+class SimulatedBackend:
+
+    """
+        This class is a drop-in replacement for pxi6284.NidaqmxBackend which creates SimulatedTasks instead of real
+        NI-DAQmx tasks. Pass it to PXI6284Controller or DataAcquisitionAndPlotting to run the whole pipeline without
+        hardware, for example to measure throughput and latency on a Linux box:
+
+            acquisition = DataAcquisitionAndPlotting(backend=SimulatedBackend(realtime=False))
+
+        Arguments:
+                    device: The SimulatedDevice shared by all the tasks created by this backend. Defaults to SimulatedDevice().
+                    realtime: A boolean specifying whether the samples are paced at the sample rate (True, default) or
+                              produced as fast as possible (False).
+    """
+
+    constants = constants
+
+    def __init__(self, device=None, realtime=True):
+        self.device = device if device is not None else SimulatedDevice()
+        self.realtime = realtime
+
+    def create_task(self):
+        return SimulatedTask(self.device, realtime=self.realtime)
+
+    def analog_reader(self, task):
+        return SimulatedReader(task)
+
+    def unscaled_reader(self, task):
+        return SimulatedUnscaledReader(task)
+
+    def analog_writer(self, task):
+        return SimulatedAnalogWriter(task)
+
+    def digital_writer(self, task):
+        return SimulatedDigitalWriter(task)
@@ -0,0 +1,150 @@
+import collections
+import contextlib
+import threading
+
+
+class TaskPool:
+
+    """
+        This class keeps configured DAQ tasks alive between acquisitions, so that back-to-back captures with the same
+        settings do not pay for creating the task, adding the channels one by one and configuring the timing every time.
+
+        A task is identified by its configuration: the channels, the sample rate, the sample mode and the number of samples
+        per channel. When it is created it is committed (task.control(TaskMode.TASK_COMMIT)): the driver verifies it,
+        reserves the card and programs it, which is most of the setup time. A committed task returns to the committed
+        state when it is stopped, so the next start() only has to arm the card.
+
+        Idle tasks are kept in least-recently-used order. When more than max_tasks tasks are idle, the one which was
+        used the longest time ago is closed, which also releases its card for other configurations. Only one task can
+        use a card at a time, so a configuration which needs a card held by an idle task of another configuration closes
+        that task first (see acquire()).
+
+        Arguments:
+                    backend: The backend which creates the tasks (NidaqmxBackend or SimulatedBackend).
+                    max_tasks: An integer with the largest number of idle tasks kept. Defaults to 4.
+    """
+
+    def __init__(self, backend, max_tasks=4):
+        self.backend = backend
+        self.max_tasks = int(max_tasks)
+        self.hits = 0               # Number of acquire() calls served by an idle task
+        self.misses = 0             # Number of acquire() calls which had to create a task
+        self._idle = collections.OrderedDict()      # key -> committed task, oldest first
+        self._in_use = {}                           # id(task) -> key
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(channel_names, sample_rate, sample_mode, samps_per_chan):
+        """
+            This function returns the key under which a task with this configuration is kept.
+        """
+        return (tuple(channel_names), float(sample_rate), sample_mode, int(samps_per_chan))
+
+    def acquire(self, channel_names, sample_rate, sample_mode=None, samps_per_chan=1000):
+        """
+            This function returns a committed task with the given analog input channels and sample clock timing, reusing
+            an idle task with the same configuration when there is one. The task has to be given back with release().
+
+            Arguments:
+                        channel_names: A list of physical channel names, e.g. ['Dev1/ai0', 'Dev1/ai1'].
+                        sample_rate: A float with the sample rate in samples per second.
+                        sample_mode: The AcquisitionType of the task. Defaults to CONTINUOUS.
+                        samps_per_chan: An integer with the buffer size (continuous) or the number of samples (finite).
+        """
+        if sample_mode is None:
+            sample_mode = self.backend.constants.AcquisitionType.CONTINUOUS
+        key = self.key(channel_names, sample_rate, sample_mode, samps_per_chan)
+
+        with self._lock:
+            task = self._idle.pop(key, None)
+            if task is not None:
+                self.hits += 1
+                self._in_use[id(task)] = key
+                return task
+
+            # A card can only be reserved by one task: close the idle tasks which use one of the same devices
+            devices = {channel.strip('/').split('/')[0] for channel in channel_names}
+            for other_key in [other_key for other_key in self._idle
+                              if devices & {channel.strip('/').split('/')[0] for channel in other_key[0]}]:
+                self._idle.pop(other_key).close()
+            self.misses += 1
+
+        task = self.backend.create_task()
+        try:
+            for channel in channel_names:
+                task.ai_channels.add_ai_voltage_chan(channel)
+            task.timing.cfg_samp_clk_timing(rate=sample_rate, sample_mode=sample_mode, samps_per_chan=int(samps_per_chan))
+            task.control(self.backend.constants.TaskMode.TASK_COMMIT)
+        except Exception:
+            task.close()
+            raise
+
+        with self._lock:
+            self._in_use[id(task)] = key
+        return task
+
+    def release(self, task, discard=False):
+        """
+            This function stops a task obtained with acquire() and keeps it for the next acquire() with the same
+            configuration. With discard=True (e.g. after an error) the task is closed instead.
+        """
+        with self._lock:
+            key = self._in_use.pop(id(task), None)
+        if key is None:
+            raise ValueError("the task does not belong to this pool")
+
+        task.stop()
+        if discard:
+            task.close()
+            return
+
+        evicted = []
+        with self._lock:
+            previous = self._idle.pop(key, None)
+            if previous is not None:
+                evicted.append(previous)
+            self._idle[key] = task
+            while len(self._idle) > self.max_tasks:
+                evicted.append(self._idle.popitem(last=False)[1])
+        for old_task in evicted:
+            old_task.close()
+
+    @contextlib.contextmanager
+    def task(self, channel_names, sample_rate, sample_mode=None, samps_per_chan=1000):
+        """
+            This function is acquire() and release() as a context manager:
+
+                with pool.task(['Dev1/ai0'], 10000, samps_per_chan=1000) as task:
+                    ...
+
+            The task is closed instead of being kept when the block raises an exception.
+        """
+        task = self.acquire(channel_names, sample_rate, sample_mode, samps_per_chan)
+        try:
+            yield task
+        except BaseException:
+            self.release(task, discard=True)
+            raise
+        self.release(task)
+
+    @property
+    def idle_tasks(self):
+        with self._lock:
+            return len(self._idle)
+
+    def close(self):
+        """
+            This function closes all the idle tasks. Tasks which are still in use are closed when they are released.
+        """
+        with self._lock:
+            tasks = list(self._idle.values())
+            self._idle.clear()
+            self.max_tasks = 0
+        for task in tasks:
+            task.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
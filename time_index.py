@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+def time_index_path(recording_path):
+    """
+        This function returns the path of the time index which belongs to a recording, e.g. 'run.index.npz' for 'run.bin'.
+    """
+    return os.path.splitext(recording_path.rstrip("/\\"))[0] + ".index.npz"
+
+
+class BlockTimeIndex:
+
+    """
+        This class gives every sample of a recording an absolute time, and lets any time be turned into a sample index and
+        a byte offset in the file without reading the file.
+
+        The samples are clocked by the card, so the time of sample n is start_time + n / sample_rate (the hardware time).
+        For every batch the index also stores the host clock (time.time()) at the moment the batch reached the pipeline.
+        When no start_time is given, it is taken from the first batch: its host time minus its duration, i.e. the time
+        its first sample was acquired, up to the latency of the first read. The host time of every later batch is later
+        than the hardware time of its last sample by its own read latency; the smallest of these differences refines
+        the start time (see estimated_start_time), and a sudden jump shows a gap in the data.
+
+        update() is a stage of the acquisition pipeline. The index is saved as a small .npz file next to the recording
+        (one row of three numbers per batch), and load() reads it back.
+
+        Arguments:
+                    sample_rate: A float with the sample rate in samples per second.
+                    start_time: An optional Unix timestamp of the first sample (the t0 of the hardware time). Defaults
+                                to the estimate from the first batch, which does not include the setup time of the task.
+                    row_bytes: An optional integer with the size of one sample of all channels in the file, for byte offsets.
+                    data_offset: An optional integer with the position of the first sample in the file, in bytes.
+    """
+
+    def __init__(self, sample_rate, start_time=None, row_bytes=None, data_offset=0):
+        self.sample_rate = float(sample_rate)
+        self.start_time = None if start_time is None else float(start_time)
+        self.row_bytes = row_bytes
+        self.data_offset = int(data_offset)
+        self.total_samples = 0
+        self.num_blocks = 0
+        self._first_samples = np.empty(1024, dtype=np.int64)
+        self._num_samples = np.empty(1024, dtype=np.int64)
+        self._host_times = np.empty(1024, dtype=np.float64)
+        self._lock = threading.Lock()
+
+    def update(self, block):
+        """
+            This function records the position and the host time of a batch.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples).
+        """
+        host_time = time.time()
+        num_samples = np.shape(block)[-1]
+        with self._lock:
+            if self.start_time is None:
+                self.start_time = host_time - num_samples / self.sample_rate
+            if self.num_blocks == len(self._first_samples):
+                for name in ("_first_samples", "_num_samples", "_host_times"):
+                    old = getattr(self, name)
+                    grown = np.empty(max(2 * len(old), 1024), dtype=old.dtype)
+                    grown[:len(old)] = old
+                    setattr(self, name, grown)
+            self._first_samples[self.num_blocks] = self.total_samples
+            self._num_samples[self.num_blocks] = num_samples
+            self._host_times[self.num_blocks] = host_time
+            self.num_blocks += 1
+            self.total_samples += num_samples
+
+    @property
+    def first_samples(self):
+        return self._first_samples[:self.num_blocks]
+
+    @property
+    def host_times(self):
+        return self._host_times[:self.num_blocks]
+
+    @property
+    def block_sizes(self):
+        return self._num_samples[:self.num_blocks]
+
+    def hardware_times(self):
+        """
+            This function returns the hardware time of the first sample of every batch, as Unix timestamps.
+        """
+        return self.start_time + self.first_samples / self.sample_rate
+
+    def host_lag(self):
+        """
+            This function returns, for every batch, how long after the hardware time of its last sample it reached the
+            pipeline according to the host clock, in seconds.
+        """
+        last_sample_times = self.start_time + (self.first_samples + self.block_sizes) / self.sample_rate
+        return self.host_times - last_sample_times
+
+    def estimated_start_time(self):
+        """
+            This function returns the start of the acquisition estimated from the host clock: the batch with the shortest
+            read latency bounds it best. It is start_time when no batch has been recorded.
+        """
+        if self.num_blocks == 0:
+            return self.start_time
+        return self.start_time + float(np.min(self.host_lag()))
+
+    def sample_at(self, timestamp):
+        """
+            This function returns the index of the sample taken at (or just before) a Unix timestamp.
+        """
+        return int(np.floor((timestamp - self.start_time) * self.sample_rate))
+
+    def time_of(self, sample_index):
+        """
+            This function returns the hardware time of a sample as a Unix timestamp.
+        """
+        return self.start_time + sample_index / self.sample_rate
+
+    def block_at(self, sample_index):
+        """
+            This function returns the number of the batch which holds a sample, with a binary search (O(log n)).
+        """
+        return int(np.searchsorted(self.first_samples, sample_index, side="right")) - 1
+
+    def block_at_time(self, timestamp, clock="hardware"):
+        """
+            This function returns the number of the batch which holds the sample taken at a Unix timestamp, using the
+            hardware time of the samples or, with clock='host', the time at which the batches reached the pipeline.
+        """
+        if clock == "host":
+            return int(np.searchsorted(self.host_times, timestamp, side="right")) - 1
+        return self.block_at(self.sample_at(timestamp))
+
+    def byte_offset(self, sample_index):
+        """
+            This function returns the position of a sample in the recorded file, in bytes.
+        """
+        if self.row_bytes is None:
+            raise ValueError("the byte offsets are only known for binary recordings")
+        return self.data_offset + int(sample_index) * self.row_bytes
+
+    def time_range(self, start_time, stop_time):
+        """
+            This function returns the samples taken between two Unix timestamps as a tuple (start, stop) of sample
+            indexes, clipped to the recording, to be used with e.g. BinaryRecording.volts(start, stop).
+        """
+        start = min(max(self.sample_at(start_time), 0), self.total_samples)
+        stop = min(max(int(np.ceil((stop_time - self.start_time) * self.sample_rate)), start), self.total_samples)
+        return start, stop
+
+    def offset_to(self, other):
+        """
+            This function returns by how many samples the recording of another index started later than this one, which
+            aligns two runs: sample n of the other run was taken at the time of sample n + offset_to(other) of this one.
+        """
+        return int(round((other.start_time - self.start_time) * self.sample_rate))
+
+    def save(self, file_path):
+        """
+            This function saves the index as a NumPy .npz file.
+        """
+        metadata = {
+            "sample_rate": self.sample_rate,
+            "start_time": self.start_time,
+            "row_bytes": self.row_bytes,
+            "data_offset": self.data_offset,
+            "total_samples": self.total_samples,
+        }
+        with self._lock:
+            with open(file_path, "wb") as f:
+                np.savez(f, metadata=np.array(json.dumps(metadata)), first_samples=self.first_samples,
+                         block_sizes=self.block_sizes, host_times=self.host_times)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+            This function loads an index saved with save().
+        """
+        with np.load(file_path) as data:
+            metadata = json.loads(str(data["metadata"]))
+            index = cls(metadata["sample_rate"], metadata["start_time"], metadata["row_bytes"], metadata["data_offset"])
+            index._first_samples = data["first_samples"].copy()
+            index._num_samples = data["block_sizes"].copy()
+            index._host_times = data["host_times"].copy()
+        index.num_blocks = len(index._first_samples)
+        index.total_samples = metadata["total_samples"]
+        return index
@@ -0,0 +1,279 @@
+import abc
+import json
+import threading
+
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+
+class _Trigger(abc.ABC):
+
+    # A software trigger fires on the samples where its condition becomes true. The condition of every sample of a
+    # batch is computed at once with NumPy; the last sample and the last condition of the previous batch are carried
+    # over, so a crossing between two batches is found as well.
+
+    def __init__(self, channel):
+        self.channel = channel
+        self._last_sample = None
+        self._last_state = True     # No trigger on the very first sample
+
+    @abc.abstractmethod
+    def condition(self, samples, sample_rate):
+        # samples holds the last sample of the previous batch followed by the batch; returns one boolean per batch sample
+        pass
+
+    def find(self, row, sample_rate):
+        """
+            This function returns the indexes (in the batch) of the samples on which the trigger fires.
+
+            Arguments:
+                        row: A 1D array with the batch of the trigger channel.
+                        sample_rate: A float with the sample rate in samples per second.
+        """
+        if len(row) == 0:
+            return np.empty(0, dtype=np.intp)
+        previous = row[0] if self._last_sample is None else self._last_sample
+        state = self.condition(np.concatenate(([previous], row)), sample_rate)
+        fired = state.copy()
+        fired[0] &= not self._last_state
+        fired[1:] &= ~state[:-1]
+        self._last_sample = row[-1]
+        self._last_state = bool(state[-1])
+        return np.flatnonzero(fired)
+
+    def reset(self):
+        self._last_sample = None
+        self._last_state = True
+
+
+class LevelTrigger(_Trigger):
+
+    """
+        This trigger fires when a channel crosses a level.
+
+        Arguments:
+                    channel: The name or the index of the trigger channel.
+                    level: A float with the level in volts.
+                    slope: 'rising' (default) to fire when the signal goes above the level, 'falling' when it goes below.
+    """
+
+    def __init__(self, channel, level, slope="rising"):
+        if slope not in ("rising", "falling"):
+            raise ValueError("slope must be 'rising' or 'falling'")
+        super().__init__(channel)
+        self.level = float(level)
+        self.slope = slope
+
+    def condition(self, samples, sample_rate):
+        if self.slope == "rising":
+            return samples[1:] >= self.level
+        return samples[1:] <= self.level
+
+
+class SlopeTrigger(_Trigger):
+
+    """
+        This trigger fires when a channel changes faster than a given rate, e.g. on the edge of a pulse.
+
+        Arguments:
+                    channel: The name or the index of the trigger channel.
+                    threshold: A positive float with the rate of change in volts per second.
+                    slope: 'rising' (default) for a signal going up faster than the threshold, 'falling' for going down.
+    """
+
+    def __init__(self, channel, threshold, slope="rising"):
+        if slope not in ("rising", "falling"):
+            raise ValueError("slope must be 'rising' or 'falling'")
+        super().__init__(channel)
+        self.threshold = abs(float(threshold))
+        self.slope = slope
+
+    def condition(self, samples, sample_rate):
+        rate_of_change = np.diff(samples) * sample_rate
+        if self.slope == "rising":
+            return rate_of_change >= self.threshold
+        return rate_of_change <= -self.threshold
+
+
+class WindowTrigger(_Trigger):
+
+    """
+        This trigger fires when a channel leaves (or enters) the window between two levels.
+
+        Arguments:
+                    channel: The name or the index of the trigger channel.
+                    low: A float with the bottom of the window in volts.
+                    high: A float with the top of the window in volts.
+                    mode: 'leave' (default) to fire when the signal goes out of the window, 'enter' when it comes into it.
+    """
+
+    def __init__(self, channel, low, high, mode="leave"):
+        if mode not in ("leave", "enter"):
+            raise ValueError("mode must be 'leave' or 'enter'")
+        super().__init__(channel)
+        self.low = float(min(low, high))
+        self.high = float(max(low, high))
+        self.mode = mode
+
+    def condition(self, samples, sample_rate):
+        inside = (samples[1:] >= self.low) & (samples[1:] <= self.high)
+        return ~inside if self.mode == "leave" else inside
+
+
+class TriggeredCapture:
+
+    """
+        This class records only the data around events instead of the whole stream. It is a stage of the acquisition
+        pipeline: every batch is appended to a ring buffer which always holds the last pre_samples + post_samples samples
+        (plus one batch), and the trigger is evaluated on the whole batch at once. For every trigger, once post_samples
+        samples after it have been acquired, the window [trigger - pre_samples, trigger + post_samples) is taken from the
+        ring buffer and written to the recorder (or handed to on_event), so a rare event costs a few windows on disk
+        instead of hours of recording.
+
+        After an event the trigger is ignored for holdoff samples, which keeps a noisy crossing from starting many
+        overlapping windows. A window is only written with the samples which exist: a trigger less than pre_samples
+        after the start of the acquisition gives a window without its first samples, and flush() (called at the end
+        of the acquisition) writes the windows still waiting for their post-trigger samples up to the last sample.
+        The first sample and the length of every window are in the event index (see write_event_index).
+
+        Arguments:
+                    channel_names: A list of strings with the names of the channels.
+                    sample_rate: A float with the sample rate in samples per second.
+                    trigger: A LevelTrigger, SlopeTrigger or WindowTrigger.
+                    pre_samples: An integer with the number of samples per channel kept before the trigger.
+                    post_samples: An integer with the number of samples per channel kept from the trigger on.
+                    holdoff: An integer with the number of samples after a trigger during which the trigger is ignored.
+                             Defaults to post_samples, so that the windows do not overlap much.
+                    recorder: An optional recorder (see recording.open_recorder) which receives every window, as an array
+                              of shape (channels, samples), one after the other. Full windows have pre_samples +
+                              post_samples samples; the position of every window in the file is in the event index.
+                    on_event: An optional function called with (event number, trigger sample index, window) for every event.
+                    max_events: An optional integer; the capture stops looking for triggers after this many events.
+    """
+
+    def __init__(self, channel_names, sample_rate, trigger, pre_samples, post_samples, holdoff=None,
+                 recorder=None, on_event=None, max_events=None):
+        self.channel_names = list(channel_names)
+        self.sample_rate = float(sample_rate)
+        self.trigger = trigger
+        self.pre_samples = int(pre_samples)
+        self.post_samples = int(post_samples)
+        if self.pre_samples < 0 or self.post_samples <= 0:
+            raise ValueError("pre_samples must not be negative and post_samples must be positive")
+        self.holdoff = self.post_samples if holdoff is None else int(holdoff)
+        self.recorder = recorder
+        self.on_event = on_event
+        self.max_events = max_events
+
+        if isinstance(trigger.channel, str):
+            self._trigger_row = self.channel_names.index(trigger.channel)
+        else:
+            self._trigger_row = int(trigger.channel)
+
+        self.events = []            # Sample index of the trigger of every event which has been saved
+        self.windows = []           # (first row in the recorded file, first sample index, number of samples) of every event
+        self.truncated_events = 0   # Events whose window was cut at the start or at the end of the acquisition
+        self._rows_written = 0
+        self.samples_seen = 0
+        self._pending = []          # Triggers waiting for their post-trigger samples
+        self._next_allowed = 0      # First sample index at which the trigger is armed again
+        self._history = None
+        self._lock = threading.Lock()
+
+    @property
+    def window_length(self):
+        return self.pre_samples + self.post_samples
+
+    def _ensure_history(self, block_size):
+        # The ring must hold a whole window plus the batch which completes it
+        capacity = self.window_length + block_size
+        if self._history is not None and self._history.capacity >= capacity:
+            return
+        history = RingBuffer(capacity, len(self.channel_names))
+        if self._history is not None and self._history.total_written:
+            start, kept = self._history.latest()
+            history.write(kept.T)
+            history.total_written = self._history.total_written
+        self._history = history
+
+    def update(self, block):
+        """
+            This function looks for triggers in a batch and saves the windows which are complete.
+
+            Arguments:
+                        block: An array of shape (num_channels, num_samples).
+        """
+        block = np.asarray(block).reshape(len(self.channel_names), -1)
+        num_samples = block.shape[1]
+        if num_samples == 0:
+            return
+
+        with self._lock:
+            self._ensure_history(num_samples)
+            first_sample = self.samples_seen
+            self._history.write(block)
+            self.samples_seen += num_samples
+
+            # Triggers of this batch, with the holdoff applied in order (there are few, so this loop is cheap)
+            for index in self.trigger.find(block[self._trigger_row], self.sample_rate):
+                trigger_sample = first_sample + int(index)
+                if self.max_events is not None and len(self.events) + len(self._pending) >= self.max_events:
+                    break
+                if trigger_sample >= self._next_allowed:
+                    self._pending.append(trigger_sample)
+                    self._next_allowed = trigger_sample + max(self.holdoff, 1)
+
+            while self._pending and self._pending[0] + self.post_samples <= self.samples_seen:
+                self._save_event(self._pending.pop(0))
+
+    def _save_event(self, trigger_sample):
+        # Only the samples which exist are saved, never a padding which an integer recorder could not store
+        oldest, history = self._history.latest()
+        start = max(trigger_sample - self.pre_samples, oldest)
+        stop = min(trigger_sample + self.post_samples, self.samples_seen)
+        window = np.ascontiguousarray(history[start - oldest:stop - oldest].T)
+        if stop - start < self.window_length:
+            self.truncated_events += 1
+
+        event_number = len(self.events)
+        self.events.append(trigger_sample)
+        self.windows.append((self._rows_written, start, stop - start))
+        self._rows_written += stop - start
+        if self.recorder is not None:
+            self.recorder.write(window)
+        if self.on_event is not None:
+            self.on_event(event_number, trigger_sample, window)
+
+    def flush(self):
+        """
+            This function saves the events which are still waiting for their post-trigger samples, with the samples
+            acquired so far. It is called at the end of the acquisition, before the recorder is closed.
+        """
+        with self._lock:
+            while self._pending:
+                self._save_event(self._pending.pop(0))
+
+    def write_event_index(self, file_path):
+        """
+            This function writes a JSON file with the trigger of every saved event: its sample index, its time in seconds
+            since the start of the acquisition, and the position of its window in the recorded file (first_row), the
+            sample index of the first sample of the window (first_sample) and its number of samples (num_samples).
+        """
+        with self._lock:
+            events = list(zip(self.events, self.windows))
+            truncated_events = self.truncated_events
+        index = {
+            "sample_rate": self.sample_rate,
+            "trigger_channel": self.channel_names[self._trigger_row],
+            "pre_samples": self.pre_samples,
+            "post_samples": self.post_samples,
+            "truncated_events": truncated_events,
+            "events": [
+                {"trigger_sample": sample, "time": sample / self.sample_rate, "first_row": first_row,
+                 "first_sample": first_sample, "num_samples": num_samples}
+                for sample, (first_row, first_sample, num_samples) in events
+            ],
+        }
+        with open(file_path, "w") as f:
+            json.dump(index, f, indent=2)